@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import ValidationError
 import logging
 import sys
 import os
+import time
 from pathlib import Path
 
 # Adiciona o diretório pai ao path para importar db e services
@@ -15,7 +16,9 @@ sys.path.insert(0, current_dir)
 
 from models import WooCommerceOrderWebhook
 from db import DB
-from services import ProductService
+from services import GtinCache, ProductService
+import metrics
+import tracing
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +32,14 @@ app = FastAPI(
 
 # Instâncias globais
 db = DB()
-product_service = ProductService(db)
+# GTIN -> variante em cache (WEBHOOK_GTIN_CACHE_TTL segundos). Desligada por defeito: com ela ligada,
+# um GTIN reatribuído ou uma variante recriada dentro do ttl ainda baixa o stock da variante antiga
+gtin_cache = GtinCache(ttl=float(os.getenv("WEBHOOK_GTIN_CACHE_TTL", "0")))
+product_service = ProductService(db, gtin_cache)
+
+# Métricas (GET /metrics): os tempos dos pedidos à base de dados vêm do tracing do DB
+metrics.register_gtin_cache(gtin_cache)
+tracing.tracer.add_sink(metrics.db_sink())
 
 @app.post("/venda/woocommerce")
 async def webhook_woocommerce(request: Request):
@@ -37,6 +47,23 @@ async def webhook_woocommerce(request: Request):
     Endpoint que recebe o webhook de 'Order Created' do WooCommerce.
     Extrai GTIN do SKU ou meta_data e baixa o estoque no PostgreSQL.
     """
+    started = time.perf_counter()
+    outcome = "error"
+    metrics.webhook_in_flight.inc()
+    try:
+        outcome, result = await process_order(request)
+        return result
+    except HTTPException as e:
+        outcome = "invalid_payload" if e.status_code == 422 else "bad_request"
+        raise
+    finally:
+        metrics.webhook_in_flight.dec()
+        metrics.webhook_requests.inc(outcome)
+        metrics.webhook_duration.observe(time.perf_counter() - started, outcome)
+
+
+async def process_order(request: Request):
+    """Processa o webhook; retorna (resultado para as métricas, resposta)"""
     payload = None
     content_type = (request.headers.get("content-type") or "").lower()
 
@@ -59,7 +86,7 @@ async def webhook_woocommerce(request: Request):
 
         # WooCommerce pode enviar apenas webhook_id no teste
         if isinstance(payload, dict) and set(payload.keys()) == {"webhook_id"}:
-            return {"ok": True, "mensagem": "Webhook de teste recebido"}
+            return "test", {"ok": True, "mensagem": "Webhook de teste recebido"}
 
         # Valida o payload com o modelo Pydantic
         order = WooCommerceOrderWebhook(**(payload or {}))
@@ -73,11 +100,12 @@ async def webhook_woocommerce(request: Request):
 
     if order.status not in ["processing", "completed"]:
         logger.info(f"Ignorando order {order.id} - status: {order.status}")
-        return {"ok": True, "mensagem": "Status não processável"}
+        return "ignored_status", {"ok": True, "mensagem": "Status não processável"}
 
     processed_items = 0
 
     for item in order.line_items:
+        line_started = time.perf_counter()
         gtin = None
 
         # Prioridade 1: tenta pegar GTIN do campo SKU da variação
@@ -93,6 +121,7 @@ async def webhook_woocommerce(request: Request):
 
         if not gtin:
             logger.warning(f"Item sem GTIN identificável: {item.name} (variation_id: {item.variation_id})")
+            metrics.webhook_line_duration.observe(time.perf_counter() - line_started, "no_gtin")
             continue
 
         try:
@@ -100,6 +129,8 @@ async def webhook_woocommerce(request: Request):
             # Ajusta o método conforme o teu ProductService
             sucesso, mensagem = product_service.sell_from_woocommerce(gtin, item.quantity)
 
+            metrics.webhook_line_duration.observe(time.perf_counter() - line_started, "ok" if sucesso else "failed")
+
             if sucesso:
                 processed_items += 1
                 logger.info(f"Baixa de estoque OK - GTIN: {gtin}, Qtd: {item.quantity}")
@@ -110,16 +141,22 @@ async def webhook_woocommerce(request: Request):
 
         except Exception as e:
             logger.exception(f"Erro ao processar item {gtin}: {str(e)}")
+            metrics.webhook_line_duration.observe(time.perf_counter() - line_started, "error")
             continue
 
     if processed_items == 0:
-        return {"ok": True, "mensagem": "Nenhum item com GTIN válido encontrado"}
+        return "no_items", {"ok": True, "mensagem": "Nenhum item com GTIN válido encontrado"}
 
-    return {
+    return "processed" if processed_items == len(order.line_items) else "partial", {
         "ok": True,
         "mensagem": f"Processados {processed_items} de {len(order.line_items)} itens com sucesso"
     }
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "sapataria-webhook"}
\ No newline at end of file
+    return {"status": "healthy", "service": "sapataria-webhook"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas no formato de texto do Prometheus"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Métricas da API no formato de texto do Prometheus (GET /metrics).
+
+Sem dependências nem threads: os contadores e histogramas são atualizados no próprio pedido
+(um lock curto por métrica) e o texto só é gerado quando o Prometheus faz o scrape.
+Os tempos dos pedidos à base de dados chegam pelo tracing (tracing.py) através do DbMetricsSink.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# segundos; cobre desde um pedido local até um webhook lento em hora de ponta
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(Metric):
+    """Valor atual; com fn é calculado no scrape (ex.: tamanho de uma cache)"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.fn = fn
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def render(self):
+        value = self.fn() if self.fn is not None else self.value
+        return self.header() + [f"{self.name} {_number(value)}"]
+
+
+class CounterFunc(Gauge):
+    """Contador mantido noutro objeto, lido no scrape"""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # por combinação de labels: [contagem por bucket (+Inf no fim)], soma
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self.values.items())
+        lines = self.header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class DbMetricsSink:
+    """Sink do tracing (tracing.tracer.add_sink) que alimenta os histogramas dos pedidos à base de dados"""
+
+    def __init__(self, duration: Histogram, errors: Counter):
+        self.duration = duration
+        self.errors = errors
+
+    def emit(self, span) -> None:
+        if span.table is None:
+            return  # spans pai (tracer.span) não são pedidos
+        self.duration.observe(span.duration_ms / 1000, span.name, span.table, span.method)
+        if span.error:
+            self.errors.inc(span.name, span.table)
+
+
+# -----------------------------
+# Métricas do webhook
+# -----------------------------
+registry = Registry()
+
+webhook_requests = registry.register(Counter(
+    "sapataria_webhook_requests_total",
+    "Webhooks do WooCommerce recebidos, por resultado", ("outcome",)))
+webhook_duration = registry.register(Histogram(
+    "sapataria_webhook_duration_seconds",
+    "Tempo de resposta do webhook (do início do pedido à resposta), por resultado", ("outcome",)))
+webhook_line_duration = registry.register(Histogram(
+    "sapataria_webhook_line_duration_seconds",
+    "Tempo de processamento de cada linha da encomenda, por resultado", ("result",)))
+webhook_in_flight = registry.register(Gauge(
+    "sapataria_webhook_in_flight",
+    "Webhooks a ser processados neste momento (pedidos em curso, não uma fila: o handler é "
+    "async e as chamadas à base de dados bloqueiam o event loop)"))
+db_duration = registry.register(Histogram(
+    "sapataria_db_request_duration_seconds",
+    "Duração dos pedidos à base de dados, por operação", ("operation", "table", "method")))
+db_errors = registry.register(Counter(
+    "sapataria_db_request_errors_total",
+    "Pedidos à base de dados que falharam, por operação", ("operation", "table")))
+
+
+def register_gtin_cache(cache) -> None:
+    """Expõe os acertos/falhas e o tamanho da GtinCache do ProductService"""
+    registry.register(CounterFunc(
+        "sapataria_gtin_cache_hits_total", "Pesquisas de GTIN resolvidas pela cache", lambda: cache.hits))
+    registry.register(CounterFunc(
+        "sapataria_gtin_cache_misses_total", "Pesquisas de GTIN que foram à base de dados", lambda: cache.misses))
+    registry.register(Gauge(
+        "sapataria_gtin_cache_hit_ratio", "Fração das pesquisas de GTIN resolvidas pela cache", cache.hit_ratio))
+    registry.register(Gauge(
+        "sapataria_gtin_cache_entries", "GTINs em cache", lambda: len(cache.entries)))
+
+
+def db_sink() -> DbMetricsSink:
+    return DbMetricsSink(db_duration, db_errors)
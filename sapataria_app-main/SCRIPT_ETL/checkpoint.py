@@ -0,0 +1,82 @@
+"""
+Checkpoints do ETL (etl_excel_to_supabase.py): retomar uma importação interrompida com --resume.
+- Ids dos modelos e variantes já gravados, stock já enviado e contadores do relatório
+- Gravado de forma atómica (ficheiro temporário + rename), no máximo a cada CHECKPOINT_INTERVAL
+- Só vale para o mesmo conjunto de linhas (impressoes_digitais.fingerprints_signature)
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# chave natural de product_model: (ref, marca_id, categoria_id, subcategoria_id)
+ModelKey = Tuple[Optional[str], int, int, int]
+
+DEFAULT_CHECKPOINT_FILE = "etl_checkpoint.json"
+
+# intervalo mínimo (s) entre gravações durante uma fase; o fim de cada fase grava sempre
+CHECKPOINT_INTERVAL = 2.0
+
+# contadores do relatório acumulados entre a execução interrompida e a retomada
+RESUMABLE_COUNTERS = [
+    "suppliers_created", "brands_created", "categories_created", "subcategories_created",
+    "colors_created", "sizes_created", "models_created", "stock_upserts",
+]
+
+
+class Checkpoint:
+    """
+    Progresso da escrita em bloco (ids dos modelos e variantes gravados, stock já enviado
+    e contadores), gravado de forma atómica para que --resume não reenvie blocos já gravados.
+    Só é válido para o mesmo conjunto de linhas (assinatura das impressões digitais).
+    stats: o Stats do ETL, onde load() soma os RESUMABLE_COUNTERS da execução interrompida.
+    """
+
+    def __init__(self, path: str, signature: str, stats: Any):
+        self.path = path
+        self.signature = signature
+        self.stats = stats
+        self.model_ids: Dict[ModelKey, int] = {}
+        self.variant_ids: Dict[str, int] = {}
+        self.stock_done: set = set()
+        self._last_save = 0.0
+
+    def load(self) -> bool:
+        """Carrega o checkpoint; False se não existir ou for de outro ficheiro/conjunto de linhas"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("signature") != self.signature:
+            return False
+        self.model_ids = {tuple(k): mid for *k, mid in data["model_ids"]}
+        self.variant_ids = data["variant_ids"]
+        self.stock_done = set(data["stock_done"])
+        for name, value in data.get("counters", {}).items():
+            setattr(self.stats, name, getattr(self.stats, name) + value)
+        return True
+
+    def tick(self) -> None:
+        """Grava se já passou CHECKPOINT_INTERVAL desde a última gravação"""
+        if time.monotonic() - self._last_save >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        data = {
+            "version": 1,
+            "signature": self.signature,
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model_ids": [[*key, mid] for key, mid in self.model_ids.items()],
+            "variant_ids": self.variant_ids,
+            "stock_done": sorted(self.stock_done),
+            "counters": {name: getattr(self.stats, name) for name in RESUMABLE_COUNTERS},
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self._last_save = time.monotonic()
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,41 +1,42 @@
 import os
 import sys
-import csv
+import glob
+import json
+import time
+import random
 import logging
-from dataclasses import dataclass
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from typing import Dict, Optional, Tuple, List, Any
 
+import numpy as np
 import pandas as pd
 import requests
 from dotenv import load_dotenv
-
-
-# -----------------------------
-# Config: colunas do Excel
-# -----------------------------
-REQUIRED_COLUMNS = [
-    "Ref. Keyinvoice",
-    "Ref. Woocomerce",
-    "Categoria",
-    "Subcategoria",
-    "Marca",
-    "Nome",
-    "Cor",
-    "TAMANHO",
-    "CODIGO DE BARRAS",
-]
-
-COLMAP = {
-    "Ref. Keyinvoice": "ref_keyinvoice",
-    "Ref. Woocomerce": "ref_woocomerce",
-    "Categoria": "categoria",
-    "Subcategoria": "subcategoria",
-    "Marca": "marca",
-    "Nome": "nome",
-    "Cor": "cor",
-    "TAMANHO": "tamanho",
-    "CODIGO DE BARRAS": "gtin",
-}
+from urllib3.exceptions import NewConnectionError
+
+from checkpoint import DEFAULT_CHECKPOINT_FILE, Checkpoint, ModelKey
+from impressoes_digitais import (
+    DEFAULT_STATE_FILE,
+    compute_delta,
+    fingerprints_signature,
+    load_state,
+    save_state,
+    sheet_fingerprints,
+)
+from normalizacao import (
+    COLMAP,
+    REQUIRED_COLUMNS,
+    clean_column_name,
+    normalize_frame,
+    to_original_headers,
+    write_frame,
+)
+from reconciliacao import DEFAULT_AUDIT_FILE, STOCK_KEY, diff_stock, read_count_sheet, validate_counts
+from validacao import REJECT_REASONS, validate_frame
 
 
 # -----------------------------
@@ -57,11 +58,83 @@ class Stats:
     sizes_created: int = 0
 
     models_created: int = 0
-    models_reused: int = 0
+    models_reused: int = 0         # modelos distintos que já existiam
 
     variants_upserted: int = 0
     stock_upserts: int = 0
 
+    # modo delta (comparação com a última execução)
+    delta_added: int = 0
+    delta_changed: int = 0
+    delta_unchanged: int = 0
+    delta_removed: int = 0
+
+
+class PhaseTimer:
+    """Tempo acumulado por fase (uma fase pode ser medida várias vezes, ex.: leitura em blocos)"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    @property
+    def total(self) -> float:
+        return time.monotonic() - self._started
+
+
+class RequestStats:
+    """Contabilidade dos pedidos HTTP do SupabaseClient (partilhada pelas threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_method: Dict[str, int] = {}
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies: List[float] = []
+
+    def record(self, method: str, elapsed: float, sent: int, received: int, ok: bool) -> None:
+        with self._lock:
+            self.by_method[method] = self.by_method.get(method, 0) + 1
+            self.latencies.append(elapsed)
+            self.bytes_sent += sent
+            self.bytes_received += received
+            if not ok:
+                self.errors += 1
+
+    def retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            return {
+                "requests": len(self.latencies),
+                "by_method": dict(self.by_method),
+                "errors": self.errors,
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "latency_p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+                "latency_p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+            }
+
+
+def append_metrics(path: str, metrics: dict) -> None:
+    """Uma linha JSON por execução (fácil de carregar com pandas.read_json(lines=True))"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(metrics, ensure_ascii=False) + "\n")
+
 
 # -----------------------------
 # Logging
@@ -96,21 +169,6 @@ def clean_str(x) -> Optional[str]:
     return s
 
 
-def clean_gtin(x) -> Optional[str]:
-    """
-    Mantém só dígitos quando possível, para evitar:
-    - espaços
-    - hífens
-    - Excel em notação científica
-    """
-    s = clean_str(x)
-    if not s:
-        return None
-    s = s.replace(" ", "").replace("-", "")
-    digits = "".join(ch for ch in s if ch.isdigit())
-    return digits if digits else None
-
-
 def as_int_or_none(x) -> Optional[int]:
     s = clean_str(x)
     if not s:
@@ -121,22 +179,483 @@ def as_int_or_none(x) -> Optional[int]:
         return None
 
 
+# -----------------------------
+# Rejeitos: juntos em memória, gravados de uma vez no fim
+# -----------------------------
+DEFAULT_REJECTS_FILE = "etl_rejects.csv"
+
+# linhas de exemplo por motivo no log
+REJECT_SAMPLE = 3
+
+
+def collect_rejects(rejects: pd.DataFrame, db_errors: List[Tuple[Any, str, List[Any]]]) -> pd.DataFrame:
+    """
+    Junta os rejeitos da validação e os erros de gravação (row_index, erro, valores originais)
+    num único DataFrame: reason_code, reason e as colunas da folha, indexado por row_index.
+    """
+    out = rejects.copy()
+    out.insert(1, "reason", out["reason_code"].map(REJECT_REASONS))
+    if db_errors:
+        columns = [c for c in rejects.columns if c != "reason_code"]
+        errors = pd.DataFrame([values for _, _, values in db_errors], columns=columns,
+                              index=[idx for idx, _, _ in db_errors], dtype=object)
+        errors.insert(0, "reason_code", "DB_ERROR")
+        errors.insert(1, "reason", [error for _, error, _ in db_errors])
+        out = pd.concat([out, errors]) if len(out) else errors
+    out.index.name = "row_index"
+    return out
+
+
+def write_rejects(rejects: pd.DataFrame, path: str, parquet_path: Optional[str], logger: logging.Logger) -> None:
+    """Grava o CSV (sempre, mesmo vazio) e, se pedido, o Parquet, cada um numa única escrita"""
+    rejects.to_csv(path, encoding="utf-8")
+    if parquet_path:
+        try:
+            rejects.astype("string").to_parquet(parquet_path)
+        except ImportError as e:
+            logger.warning("Rejeitos em Parquet não gravados (%s); o CSV está em %s", e, path)
+
+
+def log_rejects(rejects: pd.DataFrame, logger: logging.Logger, sample: int = REJECT_SAMPLE) -> None:
+    """Uma linha de log por motivo: contagem e algumas linhas de exemplo"""
+    if not len(rejects):
+        return
+    logger.warning("%s linhas rejeitadas no total", len(rejects))
+    for code, group in rejects.groupby("reason_code", sort=False):
+        head = group.head(sample)
+        files = head["file"].map(os.path.basename) + " " if "file" in head else [""] * len(head)
+        examples = ", ".join(f"{f}linha {idx} gtin={gtin}" for f, idx, gtin in zip(files, head.index, head["gtin"]))
+        logger.warning("  %s: %s (%s) | ex.: %s", code, len(group), REJECT_REASONS[code], examples)
+
+
+# -----------------------------
+# Leitura em streaming (Excel/CSV/Parquet em blocos normalizados)
+# -----------------------------
+DEFAULT_READ_BATCH = 20_000
+
+EXCEL_EXTENSIONS = {".xlsx", ".xlsm"}
+
+
+def _cell_str(value: Any) -> Optional[str]:
+    """Converte uma célula do openpyxl para texto como o read_excel(dtype=str) (5731.0 -> '5731')"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _missing_columns(columns: List[str]) -> List[str]:
+    return [c for c in REQUIRED_COLUMNS if c not in columns]
+
+
+def _iter_excel_raw(path: str, sheet: Optional[str], batch_size: int):
+    """Lê o Excel em modo read-only (o openpyxl vai lendo o XML, não carrega o livro inteiro)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = [clean_column_name(c) for c in next(rows, ())]
+        missing = _missing_columns(header)
+        if missing:
+            raise SystemExit(f"Faltam colunas no Excel: {missing}")
+        positions = [header.index(c) for c in REQUIRED_COLUMNS]
+
+        batch: List[List[Optional[str]]] = []
+        for row in rows:
+            batch.append([_cell_str(row[i]) if i < len(row) else None for i in positions])
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=REQUIRED_COLUMNS, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=REQUIRED_COLUMNS, dtype=object)
+    finally:
+        wb.close()
+
+
+def _iter_csv_raw(path: str, batch_size: int):
+    wanted = set(REQUIRED_COLUMNS)
+    reader = pd.read_csv(path, dtype=str, chunksize=batch_size, encoding="utf-8-sig",
+                         usecols=lambda c: clean_column_name(c) in wanted)
+    for chunk in reader:
+        chunk.columns = [clean_column_name(c) for c in chunk.columns]
+        missing = _missing_columns(list(chunk.columns))
+        if missing:
+            raise SystemExit(f"Faltam colunas no CSV: {missing}")
+        yield chunk[REQUIRED_COLUMNS]
+
+
+def _iter_parquet_raw(path: str, batch_size: int):
+    """Parquet já convertido: aceita os cabeçalhos originais ou os nomes normalizados (COLMAP)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Para ler Parquet é preciso instalar o pyarrow (pip install pyarrow)")
+
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    if all(c in names for c in COLMAP.values()):
+        columns = list(COLMAP.values())
+    else:
+        missing = _missing_columns(names)
+        if missing:
+            raise SystemExit(f"Faltam colunas no Parquet: {missing}")
+        columns = REQUIRED_COLUMNS
+    for batch in pf.iter_batches(batch_size=batch_size, columns=columns):
+        chunk = batch.to_pandas().astype(object)
+        chunk.columns = REQUIRED_COLUMNS
+        yield chunk
+
+
+def iter_sheet_batches(
+    path: str,
+    sheet: Optional[str] = None,
+    batch_size: int = DEFAULT_READ_BATCH,
+    timer: Optional[PhaseTimer] = None,
+):
+    """
+    Lê o ficheiro de produtos em blocos de batch_size linhas, já com as colunas
+    renomeadas (COLMAP) e normalizadas (normalize_frame). O índice é o nº da linha de dados
+    (0 = primeira linha depois do cabeçalho), como no read_excel.
+    Formato pela extensão: .xlsx/.xlsm (streaming), .csv, .parquet; .xls é lido de uma vez.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXCEL_EXTENSIONS:
+        raw = _iter_excel_raw(path, sheet, batch_size)
+    elif ext == ".csv":
+        raw = _iter_csv_raw(path, batch_size)
+    elif ext == ".parquet":
+        raw = _iter_parquet_raw(path, batch_size)
+    else:
+        # formatos antigos (.xls): o openpyxl não os lê em streaming
+        df = pd.read_excel(path, sheet_name=sheet, dtype=str)
+        df.columns = [clean_column_name(c) for c in df.columns]
+        missing = _missing_columns(list(df.columns))
+        if missing:
+            raise SystemExit(f"Faltam colunas no Excel: {missing}")
+        raw = iter([df[REQUIRED_COLUMNS]])
+
+    timer = timer or PhaseTimer()
+    offset = 0
+    while True:
+        with timer.phase("read"):
+            chunk = next(raw, None)
+        if chunk is None:
+            return
+        with timer.phase("clean"):
+            chunk = chunk.rename(columns=COLMAP)
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            chunk = normalize_frame(chunk)
+        yield chunk
+
+
+# -----------------------------
+# Vários ficheiros: pastas/glob, leitura em paralelo, uma só escrita
+# -----------------------------
+INPUT_EXTENSIONS = {*EXCEL_EXTENSIONS, ".xls", ".csv", ".parquet"}
+
+DEFAULT_WATCH_INTERVAL = 10.0
+
+
+@dataclass
+class InputFile:
+    """Ficheiro lido; as suas linhas ocupam o índice global [start, start + rows)"""
+    path: str
+    start: int
+    rows: int
+
+
+def _is_input_file(path: str) -> bool:
+    name = os.path.basename(path)
+    # ~$... são os ficheiros de bloqueio do Excel aberto
+    return (os.path.isfile(path) and not name.startswith(("~$", "."))
+            and os.path.splitext(name)[1].lower() in INPUT_EXTENSIONS)
+
+
+def resolve_inputs(patterns: List[str], must_exist: bool = True) -> List[str]:
+    """
+    Expande ficheiros, pastas (ficheiros .xlsx/.xlsm/.xls/.csv/.parquet lá dentro) e padrões glob
+    para a lista de ficheiros a importar: por ordem alfabética dentro de cada padrão, sem repetidos.
+    Num GTIN repetido entre ficheiros vale o último, como dentro de uma folha.
+    """
+    paths: List[str] = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = [p for p in (os.path.join(pattern, n) for n in sorted(os.listdir(pattern))) if _is_input_file(p)]
+        elif any(ch in pattern for ch in "*?["):
+            found = [p for p in sorted(glob.glob(pattern)) if _is_input_file(p)]
+        elif os.path.isfile(pattern):
+            found = [pattern]
+        elif must_exist:
+            raise SystemExit(f"Ficheiro não encontrado: {pattern}")
+        else:
+            found = []
+        for path in map(os.path.abspath, found):
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def read_file(
+    path: str,
+    sheet: Optional[str] = None,
+    batch_size: int = DEFAULT_READ_BATCH,
+    timer: Optional[PhaseTimer] = None,
+) -> pd.DataFrame:
+    """
+    Lê um ficheiro em blocos normalizados e junta-os: só as 9 colunas do ETL ficam em memória,
+    nunca o livro inteiro nem cópias intermédias. Corre também nos processos de read_inputs.
+    """
+    batches = list(iter_sheet_batches(path, sheet, batch_size, timer))
+    if not batches:
+        return pd.DataFrame(columns=list(COLMAP.values()), dtype=object)
+    return pd.concat(batches) if len(batches) > 1 else batches[0]
+
+
+def read_inputs(
+    paths: List[str],
+    sheet: Optional[str],
+    batch_size: int,
+    workers: int,
+    logger: logging.Logger,
+    timer: Optional[PhaseTimer] = None,
+    skip_invalid: bool = False,
+) -> Tuple[pd.DataFrame, List[InputFile]]:
+    """
+    Lê e normaliza os ficheiros, até `workers` em paralelo (um processo por ficheiro: a leitura
+    e a limpeza são CPU), e junta-os por ordem num só DataFrame com índice global contínuo.
+    A escrita continua a ser uma só para todos os ficheiros, com domínios e modelos resolvidos uma vez.
+    skip_invalid: um ficheiro que não se lê (colunas em falta, ainda a ser copiado...) é ignorado
+    com um erro no log em vez de parar tudo.
+    Retorna (linhas, ficheiros lidos com a posição das suas linhas)
+    """
+    timer = timer or PhaseTimer()
+    workers = max(1, min(workers, len(paths)))
+    logger.info("Lendo %s ficheiro(s) | aba: %s | blocos de %s linhas | %s processo(s)",
+                len(paths), sheet or "(primeira)", batch_size, workers)
+
+    results: List[Tuple[str, Any]] = []
+    if workers == 1:
+        for path in paths:
+            try:
+                results.append((path, read_file(path, sheet, batch_size, timer)))
+            except (Exception, SystemExit) as e:
+                results.append((path, e))
+    else:
+        # os processos medem a sua própria leitura/limpeza; aqui conta o tempo de parede
+        with timer.phase("read"), ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(path, pool.submit(read_file, path, sheet, batch_size)) for path in paths]
+            for path, future in futures:
+                try:
+                    results.append((path, future.result()))
+                except (Exception, SystemExit) as e:
+                    results.append((path, e))
+
+    frames: List[pd.DataFrame] = []
+    files: List[InputFile] = []
+    start = 0
+    for path, result in results:
+        if isinstance(result, BaseException):
+            if not skip_invalid:
+                raise SystemExit(f"{path}: {result}")
+            logger.error("Ficheiro ignorado (%s): %s", path, result)
+            continue
+        result.index = pd.RangeIndex(start, start + len(result))
+        files.append(InputFile(path, start, len(result)))
+        frames.append(result)
+        start += len(result)
+        if len(paths) > 1:
+            logger.info("  %s: %s linhas", os.path.basename(path), len(result))
+
+    if not frames:
+        return pd.DataFrame(columns=list(COLMAP.values()), dtype=object), files
+    return (pd.concat(frames) if len(frames) > 1 else frames[0]), files
+
+
+def label_sources(rejects: pd.DataFrame, files: List[InputFile]) -> pd.DataFrame:
+    """
+    Com vários ficheiros, acrescenta a coluna file e volta a pôr em row_index
+    o nº da linha dentro de cada ficheiro. Com um só ficheiro não muda nada.
+    """
+    if len(files) <= 1 or not len(rejects):
+        return rejects
+    starts = np.array([f.start for f in files])
+    position = np.searchsorted(starts, rejects.index.to_numpy(dtype=np.int64), side="right") - 1
+    out = rejects.copy()
+    out.insert(0, "file", [files[i].path for i in position])
+    out.index = pd.Index(rejects.index.to_numpy(dtype=np.int64) - starts[position], name="row_index")
+    return out
+
+
+class FolderWatcher:
+    """
+    Deteta ficheiros novos ou alterados nos padrões do --input entre passagens.
+    Um ficheiro só é entregue quando o tamanho e a data não mudam entre duas passagens
+    (pode ainda estar a ser copiado para a pasta).
+    """
+
+    def __init__(self, patterns: List[str], exclude: Optional[set] = None):
+        self.patterns = patterns
+        self.exclude = exclude or set()
+        self.done: Dict[str, Tuple[float, int]] = {}
+        self._seen: Dict[str, Tuple[float, int]] = {}
+
+    def poll(self) -> List[str]:
+        current: Dict[str, Tuple[float, int]] = {}
+        for path in resolve_inputs(self.patterns, must_exist=False):
+            if path in self.exclude:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (st.st_mtime, st.st_size)
+        ready = [path for path, sig in current.items()
+                 if self._seen.get(path) == sig and self.done.get(path) != sig]
+        self._seen = current
+        return ready
+
+    def mark_done(self, paths: List[str]) -> None:
+        for path in paths:
+            self.done[path] = self._seen[path]
+
+
 # -----------------------------
 # Supabase REST client (PostgREST)
 # -----------------------------
+DEFAULT_CONCURRENCY = 4
+
+# respostas que valem nova tentativa (com backoff)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# num insert simples (não idempotente) só se repete quando o pedido de certeza não foi aplicado
+RETRY_STATUS_UNSAFE = {429, 503}
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5   # segundos
+BACKOFF_MAX = 15.0
+
+
+def connect_failed(exc: Exception) -> bool:
+    """True se a ligação nem chegou a abrir (o servidor não recebeu o pedido, pode repetir-se sempre)"""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    # requests embrulha o erro do urllib3 (MaxRetryError.reason)
+    cause = exc.args[0] if exc.args else None
+    return isinstance(cause, NewConnectionError) or isinstance(getattr(cause, "reason", None), NewConnectionError)
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_backend(supabase_url: str):
+    """
+    SUPABASE_URL=fake://<ficheiro sqlite | :memory:>: o backend local da app (fake_postgrest.py).
+    Retorna o servidor, ou None para um Supabase real.
+    """
+    if not supabase_url.startswith("fake://"):
+        return None
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import fake_postgrest
+
+    return fake_postgrest.get_server(supabase_url)
+
+
 class SupabaseClient:
-    def __init__(self, supabase_url: str, supabase_key: str, dry_run: bool, logger: logging.Logger):
+    def __init__(
+        self,
+        supabase_url: str,
+        supabase_key: str,
+        dry_run: bool,
+        logger: logging.Logger,
+        concurrency: int = 1,
+    ):
+        self._fake = fake_backend(supabase_url)
+        if self._fake is not None:
+            from fake_postgrest import FAKE_HTTP_URL
+
+            supabase_url = FAKE_HTTP_URL
         self.base = supabase_url.rstrip("/") + "/rest/v1"
         self.dry_run = dry_run
         self.logger = logger
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             "apikey": supabase_key,
             "Authorization": f"Bearer {supabase_key}",
             "Content-Type": "application/json",
-        })
+        }
+        self.concurrency = max(1, concurrency)
+        self.http = RequestStats()
+        # uma Session por thread (requests.Session não é thread-safe)
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency) if self.concurrency > 1 else None
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            if self._fake is not None:
+                session.mount(self.base, self._fake.requests_adapter())
+            self._local.session = session
+        return session
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    def run_parallel(self, func, items, on_done=None) -> List[Tuple[Any, Any, Optional[Exception]]]:
+        """
+        Aplica func a cada item com no máximo `concurrency` pedidos em voo.
+        Retorna [(item, resultado, erro)] pela ordem dos itens; quem chama decide o que fazer com os erros.
+        on_done(item, resultado, erro), se dado, corre na thread de quem chama à medida que cada item termina.
+        """
+        items = list(items)
+        results: List[Tuple[Any, Any, Optional[Exception]]] = []
+        if self.executor is None or len(items) <= 1:
+            for item in items:
+                try:
+                    results.append((item, func(item), None))
+                except Exception as e:
+                    results.append((item, None, e))
+                if on_done:
+                    on_done(*results[-1])
+            return results
+
+        futures = {self.executor.submit(func, item): i for i, item in enumerate(items)}
+        results = [None] * len(items)
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = (items[i], future.result(), None)
+            except Exception as e:
+                results[i] = (items[i], None, e)
+            if on_done:
+                on_done(*results[i])
+        return results
 
-    def _request(self, method: str, path: str, params: dict | None = None, json: Any | None = None, prefer: str | None = None):
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)  # jitter para não sincronizar as threads
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        params: dict | None = None,
+        json: Any | None = None,
+        prefer: str | None = None,
+        idempotent: bool = True,
+    ):
         url = f"{self.base}/{path.lstrip('/')}"
         headers = {}
         if prefer:
@@ -146,20 +665,56 @@ class SupabaseClient:
             self.logger.info("DRY_RUN %s %s | params=%s | json=%s", method, path, params, json)
             return []
 
-        r = self.session.request(method, url, params=params, json=json, headers=headers, timeout=60)
-        if r.status_code >= 300:
-            raise RuntimeError(f"{method} {path} -> {r.status_code}: {r.text}")
-        if not r.text:
-            return []
-        return r.json()
+        retry_status = RETRY_STATUS if idempotent else RETRY_STATUS_UNSAFE
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                r = self.session.request(method, url, params=params, json=json, headers=headers, timeout=60)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.http.record(method, time.monotonic() - started, 0, 0, ok=False)
+                # num insert não idempotente, uma ligação cortada depois de enviar o corpo pode já ter
+                # gravado as linhas: só se repete se a ligação nem chegou a abrir
+                if attempt >= MAX_RETRIES or (not idempotent and not connect_failed(e)):
+                    raise
+                delay = self._backoff(attempt)
+                self.logger.warning("%s %s falhou (%s); nova tentativa em %.1fs", method, path, e, delay)
+            else:
+                self.http.record(method, time.monotonic() - started, len(r.request.body or b""),
+                                 len(r.content), ok=r.status_code < 300)
+                if r.status_code in retry_status and attempt < MAX_RETRIES:
+                    delay = self._backoff(attempt, r.headers.get("Retry-After"))
+                    self.logger.warning("%s %s -> %s; nova tentativa em %.1fs", method, path, r.status_code, delay)
+                else:
+                    if r.status_code >= 300:
+                        raise RuntimeError(f"{method} {path} -> {r.status_code}: {r.text}")
+                    if not r.text:
+                        return []
+                    return r.json()
+            attempt += 1
+            self.http.retry()
+            time.sleep(delay)
 
     def select(self, table: str, select: str = "id", **filters) -> List[dict]:
         params = {"select": select}
         params.update(filters)
         return self._request("GET", table, params=params)
 
+    def select_all(
+        self, table: str, select: str = "id", page_size: int = 1000, order: str = "id", **filters
+    ) -> List[dict]:
+        """Lê a tabela inteira em páginas (o PostgREST corta as respostas a 1000 linhas por defeito)"""
+        rows: List[dict] = []
+        offset = 0
+        while True:
+            page = self.select(table, select=select, order=order, limit=str(page_size), offset=str(offset), **filters)
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            offset += page_size
+
     def insert(self, table: str, rows: List[dict]) -> List[dict]:
-        return self._request("POST", table, json=rows, prefer="return=representation")
+        return self._request("POST", table, json=rows, prefer="return=representation", idempotent=False)
 
     def upsert(self, table: str, rows: List[dict], on_conflict: str) -> List[dict]:
         # merge duplicates faz UPDATE quando encontra conflito
@@ -168,342 +723,1596 @@ class SupabaseClient:
 
 
 # -----------------------------
-# DB: get/create com cache (agora via Supabase)
+# Domínios: pré-carregados uma vez e criados em bloco
 # -----------------------------
-def get_or_create_simple_name(
+# tabela -> (coluna com o valor, contador em Stats)
+SIMPLE_DOMAINS = {
+    "suppliers": ("name", "suppliers_created"),
+    "brands": ("name", "brands_created"),
+    "categories": ("name", "categories_created"),
+    "colors": ("name", "colors_created"),
+    "sizes": ("value", "sizes_created"),
+}
+
+
+def distinct_values(values) -> List[str]:
+    """Valores distintos (sem diferenciar maiúsculas), pela ordem em que aparecem"""
+    seen: Dict[str, str] = {}
+    for v in values:
+        if v and v.lower() not in seen:
+            seen[v.lower()] = v
+    return list(seen.values())
+
+
+def raise_first_error(results: List[Tuple[Any, Any, Optional[Exception]]]) -> List[Any]:
+    """Para fases em que qualquer falha é fatal: relança o 1º erro ou devolve os resultados"""
+    for _, _, error in results:
+        if error is not None:
+            raise error
+    return [result for _, result, _ in results]
+
+
+def domain_columns() -> Dict[str, str]:
+    """Projeção estreita de cada tabela de domínio"""
+    columns = {table: f"id,{field}" for table, (field, _) in SIMPLE_DOMAINS.items()}
+    columns["subcategories"] = "id,category_id,name"
+    return columns
+
+
+def index_domains(downloaded: Dict[str, List[dict]]) -> Dict[str, dict]:
+    """
+    Indexa as linhas descarregadas das tabelas de domínio.
+    Retorna {tabela: {valor.lower(): id}}; subcategories usa a chave (category_id, nome.lower()).
+    """
+    caches: Dict[str, dict] = {}
+    for table, rows in downloaded.items():
+        cache: dict = {}
+        if table == "subcategories":
+            for r in rows:
+                if r.get("name") and r.get("category_id") is not None:
+                    cache.setdefault((int(r["category_id"]), str(r["name"]).lower()), int(r["id"]))
+        else:
+            field = SIMPLE_DOMAINS[table][0]
+            for r in rows:
+                if r.get(field):
+                    cache.setdefault(str(r[field]).lower(), int(r["id"]))
+        caches[table] = cache
+    return caches
+
+
+def preload_domains(sb: SupabaseClient) -> Dict[str, dict]:
+    """Descarrega cada tabela de domínio uma única vez (em paralelo) e indexa-a"""
+    columns = domain_columns()
+    tables = list(columns)
+    downloaded = raise_first_error(sb.run_parallel(lambda t: sb.select_all(t, select=columns[t]), tables))
+    return index_domains(dict(zip(tables, downloaded)))
+
+
+def create_missing_simple(
     sb: SupabaseClient,
     table: str,
-    field: str,
-    value: str,
+    values: List[str],
     cache: Dict[str, int],
-    on_created,
-) -> int:
-    key = value.lower()
-    if key in cache:
-        return cache[key]
+    stats: Stats,
+) -> None:
+    """Cria num único insert todos os valores que ainda não existem na tabela"""
+    field, counter = SIMPLE_DOMAINS[table]
+    missing = [v for v in distinct_values(values) if v.lower() not in cache]
+    if not missing:
+        return
+
+    created = sb.insert(table, [{field: v} for v in missing])
+    for r in created:
+        cache[str(r[field]).lower()] = int(r["id"])
+    # DRY_RUN: nada foi gravado, não há ids
+    for v in missing:
+        cache.setdefault(v.lower(), -1)
+    setattr(stats, counter, getattr(stats, counter) + len(missing))
+
+
+def create_missing_subcategories(
+    sb: SupabaseClient,
+    pairs: List[Tuple[int, str]],
+    cache: Dict[Tuple[int, str], int],
+    stats: Stats,
+) -> None:
+    """Cria num único insert todas as subcategorias (category_id, nome) em falta"""
+    missing: Dict[Tuple[int, str], str] = {}
+    for category_id, name in pairs:
+        key = (category_id, name.lower())
+        if key not in cache and key not in missing:
+            missing[key] = name
+    if not missing:
+        return
+
+    created = sb.insert("subcategories", [
+        {"category_id": category_id, "name": name} for (category_id, _), name in missing.items()
+    ])
+    for r in created:
+        cache[(int(r["category_id"]), str(r["name"]).lower())] = int(r["id"])
+    for key in missing:
+        cache.setdefault(key, -1)
+    stats.subcategories_created += len(missing)
+
+
+def warm_up_domains(
+    sb: SupabaseClient,
+    df: pd.DataFrame,
+    default_supplier: str,
+    stats: Stats,
+    caches: Optional[Dict[str, dict]] = None,
+) -> Dict[str, dict]:
+    """
+    Fase inicial do ETL: lê todos os domínios e cria de uma vez os valores que a folha precisa.
+    Custa no máximo 6 leituras + 6 inserts, seja qual for o tamanho do Excel.
+    caches: domínios já carregados (--watch); são completados no lugar, sem voltar a ler as tabelas.
+    """
+    if caches is None:
+        caches = preload_domains(sb)
+
+    needed = {
+        "suppliers": [default_supplier],
+        "brands": df["marca"].tolist(),
+        "categories": df["categoria"].tolist(),
+        "colors": df["cor"].tolist(),
+        "sizes": df["tamanho"].tolist(),
+    }
+    # tabelas independentes entre si: inserts em paralelo
+    raise_first_error(sb.run_parallel(
+        lambda t: create_missing_simple(sb, t, needed[t], caches[t], stats), list(needed)
+    ))
+
+    # subcategorias dependem do id da categoria
+    pairs = [
+        (caches["categories"][cat.lower()], sub)
+        for cat, sub in zip(df["categoria"], df["subcategoria"])
+    ]
+    create_missing_subcategories(sb, pairs, caches["subcategories"], stats)
+    return caches
+
+
+# -----------------------------
+# Model + Variant + Stock: escrita em bloco (via Supabase)
+# -----------------------------
+DEFAULT_CHUNK_SIZE = 500
+
+# nº máximo de valores num filtro in.(...) de um GET (limita o tamanho do URL)
+LOOKUP_CHUNK = 200
+
+
+@dataclass
+class RowPayload:
+    """Linha válida do Excel, à espera da escrita em bloco"""
+    idx: Any
+    values: List[Any]      # valores originais, para o ficheiro de rejeitos
+    model_key: ModelKey
+    gtin: str
+
+
+def chunks(seq: List[Any], size: int):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def in_filter(values: List[Any]) -> str:
+    """Filtro PostgREST in.(...) com os valores entre aspas (podem ter vírgulas)"""
+    quoted = []
+    for v in values:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"')
+        quoted.append(f'"{v}"')
+    return f"in.({','.join(quoted)})"
+
+
+def model_key_of(row: dict) -> ModelKey:
+    return (
+        row.get("ref"),
+        int(row["marca_id"]),
+        int(row["categoria_id"]),
+        int(row["subcategoria_id"]),
+    )
+
+
+# projeção estreita de product_model: só a chave natural e o id
+MODEL_INDEX_COLUMNS = "id,ref,marca_id,categoria_id,subcategoria_id"
 
-    rows = sb.select(table, select="id", **{field: f"eq.{value}"})
-    if rows:
-        cache[key] = int(rows[0]["id"])
-        return cache[key]
 
-    created = sb.insert(table, [{field: value}])
-    new_id = int(created[0]["id"]) if created else -1
-    cache[key] = new_id
-    on_created()
-    return new_id
+def index_models(rows: List[dict]) -> Dict[ModelKey, int]:
+    """Indexa modelos pela chave natural (se houver duplicados, fica o de menor id)"""
+    index: Dict[ModelKey, int] = {}
+    for r in rows:
+        index.setdefault(model_key_of(r), int(r["id"]))
+    return index
 
 
-def get_or_create_size(
+def load_model_index(sb: SupabaseClient) -> Dict[ModelKey, int]:
+    """Descarrega product_model uma vez (paginado, projeção estreita), indexado pela chave natural"""
+    return index_models(sb.select_all("product_model", select=MODEL_INDEX_COLUMNS))
+
+
+def flush_models(
     sb: SupabaseClient,
-    value: str,
-    cache: Dict[str, int],
+    models: Dict[ModelKey, dict],
+    chunk_size: int,
+    logger: logging.Logger,
+    checkpoint: Optional[Checkpoint] = None,
+    index: Optional[Dict[ModelKey, int]] = None,
+) -> Tuple[Dict[ModelKey, int], Dict[ModelKey, str], set]:
+    """
+    Resolve os modelos pela chave natural no índice de product_model (carregado uma vez
+    se não for dado) e cria os que faltam em blocos de chunk_size. Todas as cores/tamanhos
+    de um modelo partilham o mesmo id.
+    Retorna (ids por chave, erro por chave que falhou, chaves dos modelos criados)
+    """
+    ids: Dict[ModelKey, int] = {}
+    if checkpoint:
+        ids.update((key, mid) for key, mid in checkpoint.model_ids.items() if key in models)
+
+    pending = [key for key in models if key not in ids]
+    if pending:
+        if index is None:
+            index = load_model_index(sb)
+        ids.update((key, index[key]) for key in pending if key in index)
+
+    failed: Dict[ModelKey, str] = {}
+    missing = [key for key in pending if key not in ids]
+
+    def on_done(chunk, created, error):
+        if error is not None:
+            logger.warning("Falha ao criar %s modelos: %s", len(chunk), error)
+            for key in chunk:
+                failed[key] = str(error)
+            return
+        for r in created:
+            ids[model_key_of(r)] = int(r["id"])
+        # DRY_RUN: nada foi gravado, não há ids
+        for key in chunk:
+            ids.setdefault(key, -1)
+        if checkpoint:
+            checkpoint.model_ids.update((key, ids[key]) for key in chunk)
+            checkpoint.tick()
+
+    sb.run_parallel(
+        lambda chunk: sb.insert("product_model", [models[key] for key in chunk]),
+        chunks(missing, chunk_size),
+        on_done=on_done,
+    )
+    if checkpoint:
+        checkpoint.save()
+    return ids, failed, {key for key in missing if key not in failed}
+
+
+def flush_variants(
+    sb: SupabaseClient,
+    variants: Dict[str, dict],
+    chunk_size: int,
+    logger: logging.Logger,
+    checkpoint: Optional[Checkpoint] = None,
+) -> Tuple[Dict[str, int], Dict[str, str]]:
+    """
+    Upsert das variantes (on_conflict=gtin) em blocos de chunk_size, até `concurrency` em paralelo.
+    Com checkpoint, as variantes já gravadas numa execução anterior não são reenviadas.
+    Retorna (variant_id por GTIN, erro por GTIN que falhou)
+    """
+    ids: Dict[str, int] = {}
+    failed: Dict[str, str] = {}
+    if checkpoint:
+        ids.update((gtin, vid) for gtin, vid in checkpoint.variant_ids.items() if gtin in variants)
+
+    def upsert_chunk(chunk: List[str]) -> Dict[str, int]:
+        rows = sb.upsert("product_variant", [variants[gtin] for gtin in chunk], on_conflict="gtin")
+        chunk_ids = {str(r["gtin"]): int(r["id"]) for r in rows}
+
+        # DRY_RUN: não há retorno (e nem gravou). Buscamos os ids existentes só para coerência.
+        unresolved = [gtin for gtin in chunk if gtin not in chunk_ids]
+        for sub in chunks(unresolved, LOOKUP_CHUNK):
+            for r in sb.select_all("product_variant", select="id,gtin", gtin=in_filter(sub)):
+                chunk_ids[str(r["gtin"])] = int(r["id"])
+        return chunk_ids
+
+    def on_done(chunk, chunk_ids, error):
+        if error is not None:
+            logger.warning("Falha no upsert de %s variantes: %s", len(chunk), error)
+            for gtin in chunk:
+                failed[gtin] = str(error)
+            return
+        ids.update(chunk_ids)
+        for gtin in chunk:
+            ids.setdefault(gtin, -1)
+        if checkpoint:
+            checkpoint.variant_ids.update((gtin, ids[gtin]) for gtin in chunk)
+            checkpoint.tick()
+
+    pending = [gtin for gtin in variants if gtin not in ids]
+    sb.run_parallel(upsert_chunk, chunks(pending, chunk_size), on_done=on_done)
+    if checkpoint:
+        checkpoint.save()
+    return ids, failed
+
+
+def load_warehouse_ids(sb: SupabaseClient) -> List[int]:
+    warehouses = sb.select_all("warehouses", select="id")
+    if not warehouses:
+        raise RuntimeError("Tabela warehouses está vazia. Não dá para criar stock.")
+    return [int(w["id"]) for w in warehouses]
+
+
+def flush_stock(
+    sb: SupabaseClient,
+    variant_ids: Dict[str, int],
+    warehouse_ids: List[int],
+    stock_value: int,
+    chunk_size: int,
     stats: Stats,
-) -> int:
-    key = value.lower()
-    if key in cache:
-        return cache[key]
+    logger: logging.Logger,
+    checkpoint: Optional[Checkpoint] = None,
+) -> Dict[str, str]:
+    """
+    Upsert de stock_value em todos os armazéns para cada variante, em blocos de ~chunk_size linhas.
+    Retorna {gtin: erro} das variantes cujo bloco falhou
+    """
+    failed: Dict[str, str] = {}
+    done = checkpoint.stock_done if checkpoint else set()
+    gtins = [gtin for gtin, vid in variant_ids.items() if vid != -1 and gtin not in done]
+    per_chunk = max(1, chunk_size // len(warehouse_ids))
+
+    def upsert_chunk(chunk: List[str]) -> int:
+        payload = [
+            {"variant_id": variant_ids[gtin], "warehouse_id": wh, "stock": stock_value}
+            for gtin in chunk
+            for wh in warehouse_ids
+        ]
+        sb.upsert("warehouse_stock", payload, on_conflict="variant_id,warehouse_id")
+        return len(payload)
+
+    def on_done(chunk, sent, error):
+        if error is not None:
+            logger.warning("Falha no upsert de stock de %s variantes: %s", len(chunk), error)
+            for gtin in chunk:
+                failed[gtin] = str(error)
+            return
+        stats.stock_upserts += sent
+        if checkpoint:
+            checkpoint.stock_done.update(chunk)
+            checkpoint.tick()
+
+    sb.run_parallel(upsert_chunk, chunks(gtins, per_chunk), on_done=on_done)
+    if checkpoint:
+        checkpoint.save()
+    return failed
+
+
+# -----------------------------
+# Plan/apply: diferença exata contra um snapshot do servidor
+# -----------------------------
+DEFAULT_PLAN_FILE = "etl_plan.json"
+PLAN_VERSION = 1
+
+# stock gravado em todos os armazéns para cada variante da folha
+INITIAL_STOCK = 1
+
+# projeções estreitas do snapshot (tabela -> (colunas, ordem para paginar))
+SNAPSHOT_TABLES = {
+    "warehouses": ("id", "id"),
+    "product_model": (MODEL_INDEX_COLUMNS, "id"),
+    "product_variant": ("id,gtin,model_id,cor_id,tamanho_id,ref_keyinvoice,ref_woocomerce", "id"),
+    "warehouse_stock": ("variant_id,warehouse_id,stock", "variant_id,warehouse_id"),
+}
+
+# campos da variante comparados com o servidor (o upsert grava-os todos)
+VARIANT_FIELDS = ["model_id", "cor_id", "tamanho_id", "ref_keyinvoice", "ref_woocomerce"]
+
+
+@dataclass
+class Snapshot:
+    """Estado atual do servidor, só com o que o ETL precisa para decidir o que escrever"""
+    domains: Dict[str, dict]
+    warehouse_ids: List[int]
+    models: Dict[ModelKey, int]
+    variants: Dict[str, dict]               # gtin -> linha de product_variant
+    stock: Dict[Tuple[int, int], int]       # (variant_id, warehouse_id) -> stock
 
-    rows = sb.select("sizes", select="id", value=f"eq.{value}")
-    if rows:
-        cache[key] = int(rows[0]["id"])
-        return cache[key]
 
-    created = sb.insert("sizes", [{"value": value}])
-    new_id = int(created[0]["id"]) if created else -1
-    cache[key] = new_id
-    stats.sizes_created += 1
-    return new_id
+def load_snapshot(sb: SupabaseClient) -> Snapshot:
+    """
+    Descarrega domínios, armazéns, modelos, variantes e stock (só leituras, paginadas,
+    todas as tabelas em paralelo).
+    """
+    tables = {table: (columns, "id") for table, columns in domain_columns().items()}
+    tables.update(SNAPSHOT_TABLES)
+    names = list(tables)
+    downloaded = dict(zip(names, raise_first_error(sb.run_parallel(
+        lambda t: sb.select_all(t, select=tables[t][0], order=tables[t][1]), names
+    ))))
+
+    warehouse_ids = [int(w["id"]) for w in downloaded.pop("warehouses")]
+    if not warehouse_ids:
+        raise RuntimeError("Tabela warehouses está vazia. Não dá para criar stock.")
+    models = index_models(downloaded.pop("product_model"))
+    variants = {str(r["gtin"]): r for r in downloaded.pop("product_variant") if r.get("gtin")}
+    stock = {(int(r["variant_id"]), int(r["warehouse_id"])): int(r["stock"])
+             for r in downloaded.pop("warehouse_stock")}
+    return Snapshot(index_domains(downloaded), warehouse_ids, models, variants, stock)
 
 
-def get_or_create_subcategory(
+def _same_value(a, b) -> bool:
+    """Compara valores do servidor e da folha (ex.: ref_keyinvoice varchar vs int)"""
+    if a is None or b is None:
+        return a is None and b is None
+    return str(a) == str(b)
+
+
+def build_plan(df: pd.DataFrame, default_supplier: str, snapshot: Snapshot) -> dict:
+    """
+    Calcula, sem pedidos HTTP, tudo o que uma execução escreveria: domínios e modelos em falta,
+    variantes novas/alteradas e linhas de stock diferentes de INITIAL_STOCK.
+    Os domínios e modelos são referidos pelo nome, porque os novos ainda não têm id.
+    """
+    domains = snapshot.domains
+    plan_domains = {
+        table: [v for v in distinct_values(values) if v.lower() not in domains[table]]
+        for table, values in {
+            "suppliers": [default_supplier],
+            "brands": df["marca"].tolist(),
+            "categories": df["categoria"].tolist(),
+            "colors": df["cor"].tolist(),
+            "sizes": df["tamanho"].tolist(),
+        }.items()
+    }
+
+    plan_subcategories: Dict[Tuple[str, str], List[str]] = {}
+    models: Dict[Tuple[Any, ...], dict] = {}
+    variants: Dict[str, dict] = {}
+
+    for row in df.itertuples():
+        cat_id = domains["categories"].get(row.categoria.lower())
+        sub_id = domains["subcategories"].get((cat_id, row.subcategoria.lower())) if cat_id else None
+        if sub_id is None:
+            plan_subcategories.setdefault((row.categoria.lower(), row.subcategoria.lower()),
+                                          [row.categoria, row.subcategoria])
+
+        # modelo pela chave natural (com nomes); id só se todos os domínios já existirem
+        names = (row.ref_keyinvoice, row.marca.lower(), row.categoria.lower(), row.subcategoria.lower())
+        if names not in models:
+            marca_id = domains["brands"].get(row.marca.lower())
+            model_id = None
+            if marca_id and sub_id:
+                model_id = snapshot.models.get((row.ref_keyinvoice, marca_id, cat_id, sub_id))
+            models[names] = {
+                "id": model_id,
+                "ref": row.ref_keyinvoice,
+                "nome_modelo": row.nome,
+                "marca": row.marca,
+                "categoria": row.categoria,
+                "subcategoria": row.subcategoria,
+            }
+
+        # GTIN repetido: vale a última linha, como na execução normal
+        variants[row.gtin] = {
+            "gtin": row.gtin,
+            "model": [row.ref_keyinvoice, row.marca, row.categoria, row.subcategoria],
+            "cor": row.cor,
+            "tamanho": row.tamanho,
+            "ref_keyinvoice": as_int_or_none(row.ref_keyinvoice),
+            "ref_woocomerce": None,
+            "_model_names": names,
+        }
+
+    variant_inserts: List[dict] = []
+    variant_updates: List[dict] = []
+    stock_rows: List[dict] = []
+    unchanged_variants = unchanged_stock = 0
+    for gtin, v in variants.items():
+        current = snapshot.variants.get(gtin)
+        wanted = {
+            "model_id": models[v.pop("_model_names")]["id"],
+            "cor_id": domains["colors"].get(v["cor"].lower()),
+            "tamanho_id": domains["sizes"].get(v["tamanho"].lower()),
+            "ref_keyinvoice": v["ref_keyinvoice"],
+            "ref_woocomerce": v["ref_woocomerce"],
+        }
+        variant_id = int(current["id"]) if current else None
+        if current is None:
+            variant_inserts.append(v)
+        else:
+            changes = [f for f in VARIANT_FIELDS if not _same_value(current.get(f), wanted[f])]
+            if changes:
+                variant_updates.append({"id": variant_id, **v, "changes": changes})
+            else:
+                unchanged_variants += 1
+
+        for wh in snapshot.warehouse_ids:
+            stock = snapshot.stock.get((variant_id, wh)) if variant_id else None
+            if stock == INITIAL_STOCK:
+                unchanged_stock += 1
+                continue
+            stock_rows.append({"gtin": gtin, "variant_id": variant_id, "warehouse_id": wh,
+                               "stock": INITIAL_STOCK, "current": stock})
+
+    model_list = list(models.values())
+    return {
+        "domains": plan_domains,
+        "subcategories": list(plan_subcategories.values()),
+        "models": model_list,
+        "variants": {"insert": variant_inserts, "update": variant_updates},
+        "stock": stock_rows,
+        "summary": {
+            **{f"{table}_insert": len(values) for table, values in plan_domains.items()},
+            "subcategories_insert": len(plan_subcategories),
+            "models_insert": sum(1 for m in model_list if m["id"] is None),
+            "models_existing": sum(1 for m in model_list if m["id"] is not None),
+            "variants_insert": len(variant_inserts),
+            "variants_update": len(variant_updates),
+            "variants_unchanged": unchanged_variants,
+            "stock_upsert": len(stock_rows),
+            "stock_unchanged": unchanged_stock,
+        },
+    }
+
+
+def save_plan(path: str, plan: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def load_plan(path: str) -> dict:
+    if not os.path.exists(path):
+        raise SystemExit(f"Plano não encontrado: {path} (corre primeiro o comando plan)")
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise SystemExit(f"Versão do plano não suportada: {plan.get('version')}")
+    return plan
+
+
+def apply_plan(
     sb: SupabaseClient,
-    category_id: int,
-    subcat_name: str,
-    cache: Dict[Tuple[int, str], int],
+    plan: dict,
+    chunk_size: int,
     stats: Stats,
-) -> int:
-    key = (category_id, subcat_name.lower())
-    if key in cache:
-        return cache[key]
-
-    rows = sb.select(
-        "subcategories",
-        select="id",
-        category_id=f"eq.{category_id}",
-        name=f"eq.{subcat_name}",
-        limit="1",
+    logger: logging.Logger,
+) -> Dict[str, str]:
+    """
+    Executa um plano em bloco: domínios -> modelos -> variantes -> stock.
+    Os domínios e modelos são resolvidos de novo pelo nome, por isso um plano aplicado
+    duas vezes (ou depois de outra importação) não cria duplicados.
+    Retorna {gtin: erro} das variantes que falharam
+    """
+    caches = preload_domains(sb)
+    raise_first_error(sb.run_parallel(
+        lambda t: create_missing_simple(sb, t, plan["domains"][t], caches[t], stats), list(plan["domains"])
+    ))
+    pairs = [(caches["categories"][cat.lower()], sub) for cat, sub in plan["subcategories"]]
+    create_missing_subcategories(sb, pairs, caches["subcategories"], stats)
+
+    fornecedor_id = caches["suppliers"][plan["supplier"].lower()]
+
+    def key_of(ref, marca, categoria, subcategoria) -> ModelKey:
+        cat_id = caches["categories"][categoria.lower()]
+        return (ref, caches["brands"][marca.lower()], cat_id,
+                caches["subcategories"][(cat_id, subcategoria.lower())])
+
+    models: Dict[ModelKey, dict] = {}
+    for m in plan["models"]:
+        key = key_of(m["ref"], m["marca"], m["categoria"], m["subcategoria"])
+        models.setdefault(key, {
+            "ref": key[0], "nome_modelo": m["nome_modelo"], "marca_id": key[1], "categoria_id": key[2],
+            "subcategoria_id": key[3], "fornecedor_id": fornecedor_id, "wc_product_id": None,
+        })
+    model_ids, failed_models, created = flush_models(sb, models, chunk_size, logger)
+    stats.models_created += len(created)
+
+    failed: Dict[str, str] = {}
+    ready: Dict[str, dict] = {}
+    for v in plan["variants"]["insert"] + plan["variants"]["update"]:
+        key = key_of(*v["model"])
+        if key in failed_models:
+            failed[v["gtin"]] = failed_models[key]
+            continue
+        ready[v["gtin"]] = {
+            "gtin": v["gtin"],
+            "model_id": model_ids[key],
+            "cor_id": caches["colors"][v["cor"].lower()],
+            "tamanho_id": caches["sizes"][v["tamanho"].lower()],
+            "ref_woocomerce": v["ref_woocomerce"],
+            "ref_keyinvoice": v["ref_keyinvoice"],
+        }
+    variant_ids, failed_variants = flush_variants(sb, ready, chunk_size, logger)
+    stats.variants_upserted = len(variant_ids)
+    failed.update(failed_variants)
+
+    rows = []
+    for r in plan["stock"]:
+        variant_id = r["variant_id"] or variant_ids.get(r["gtin"])
+        if r["gtin"] in failed or variant_id is None:
+            continue
+        rows.append({"variant_id": variant_id, "warehouse_id": r["warehouse_id"], "stock": r["stock"]})
+
+    def on_done(chunk, _, error):
+        if error is not None:
+            logger.warning("Falha no upsert de %s linhas de stock: %s", len(chunk), error)
+            gtins = {vid: gtin for gtin, vid in variant_ids.items()}
+            for r in chunk:
+                failed.setdefault(gtins.get(r["variant_id"], str(r["variant_id"])), str(error))
+            return
+        stats.stock_upserts += len(chunk)
+
+    sb.run_parallel(
+        lambda chunk: sb.upsert("warehouse_stock", chunk, on_conflict="variant_id,warehouse_id"),
+        chunks(rows, chunk_size),
+        on_done=on_done,
     )
-    if rows:
-        cache[key] = int(rows[0]["id"])
-        return cache[key]
+    return failed
 
-    created = sb.insert("subcategories", [{"category_id": category_id, "name": subcat_name}])
-    new_id = int(created[0]["id"]) if created else -1
-    cache[key] = new_id
-    stats.subcategories_created += 1
-    return new_id
+
+@dataclass
+class WriteCache:
+    """
+    Domínios e índice de product_model partilhados entre os ciclos do --watch:
+    cada ficheiro novo só lê/cria o que ainda não está em memória.
+    """
+    domains: Optional[Dict[str, dict]] = None
+    models: Optional[Dict[ModelKey, int]] = None
 
 
-def get_or_create_supplier(
+def load_with_rest(
     sb: SupabaseClient,
-    supplier_name: str,
-    cache: Dict[str, int],
+    valid: pd.DataFrame,
+    settings: "Settings",
     stats: Stats,
-) -> int:
-    key = supplier_name.lower()
-    if key in cache:
-        return cache[key]
+    logger: logging.Logger,
+    checkpoint: Optional[Checkpoint],
+    db_errors: List[Tuple[Any, str, List[Any]]],
+    timer: PhaseTimer,
+    cache: Optional[WriteCache] = None,
+) -> set:
+    """
+    Escrita pela API REST: domínios, montagem dos payloads em memória e escrita em bloco.
+    As linhas que falham são acrescentadas a db_errors como (row_index, erro, valores).
+    cache: se dado, os domínios e os modelos vêm dele (e ficam nele) em vez de serem lidos outra vez.
+    Retorna os GTINs gravados
+    """
+    default_supplier = settings.default_supplier
+    chunk_size = settings.chunk_size
+
+    logger.info("Carregando domínios (brands, categories, subcategories, colors, sizes, suppliers)...")
+    with timer.phase("domains"):
+        caches = warm_up_domains(sb, valid, default_supplier, stats, cache.domains if cache else None)
+        if cache:
+            cache.domains = caches
+        fornecedor_id = caches["suppliers"][default_supplier.lower()]
+        warehouse_ids = load_warehouse_ids(sb)
+
+    logger.info("Iniciando ETL (Supabase REST) | dry_run=%s | supplier=%s | chunk=%s | concurrency=%s",
+                settings.dry_run, default_supplier, chunk_size, settings.concurrency)
+
+    # 1) montagem dos payloads em memória (sem pedidos HTTP; domínios já resolvidos)
+    payloads: List[RowPayload] = []
+    models: Dict[ModelKey, dict] = {}
+    variants: Dict[str, dict] = {}
+    variant_models: Dict[str, ModelKey] = {}
+
+    brands, categories, subcategories = caches["brands"], caches["categories"], caches["subcategories"]
+    colors, sizes = caches["colors"], caches["sizes"]
+
+    with timer.phase("payloads"):
+        for row in valid.itertuples():
+            marca_id = brands[row.marca.lower()]
+            categoria_id = categories[row.categoria.lower()]
+            subcategoria_id = subcategories[(categoria_id, row.subcategoria.lower())]
+
+            # model (product_model.ref é varchar); a 1ª linha de cada modelo define o nome
+            ref = row.ref_keyinvoice
+            model_key = (ref, marca_id, categoria_id, subcategoria_id)
+            if model_key not in models:
+                models[model_key] = {
+                    "ref": ref,
+                    "nome_modelo": row.nome,
+                    "marca_id": marca_id,
+                    "categoria_id": categoria_id,
+                    "subcategoria_id": subcategoria_id,
+                    "fornecedor_id": fornecedor_id,
+                    "wc_product_id": None,
+                }
+
+            # variant (GTIN repetido: vale a última linha, como no processamento linha a linha)
+            variants[row.gtin] = {
+                "gtin": row.gtin,
+                "cor_id": colors[row.cor.lower()],
+                "tamanho_id": sizes[row.tamanho.lower()],
+                "ref_woocomerce": None,   # conforme pediste
+                "ref_keyinvoice": as_int_or_none(ref),  # product_variant.ref_keyinvoice é bigint
+            }
+            variant_models[row.gtin] = model_key
+            payloads.append(RowPayload(row.Index, list(row[1:]), model_key, row.gtin))
+
+    # 2) escrita em bloco: modelos -> variantes -> stock (=1 em todos os armazéns)
+    logger.info("A gravar %s modelos, %s variantes, stock em %s armazéns...",
+                len(models), len(variants), len(warehouse_ids))
+    try:
+        with timer.phase("models"):
+            index = None
+            if cache:
+                if cache.models is None:
+                    cache.models = load_model_index(sb)
+                index = cache.models
+            model_ids, failed_models, created = flush_models(sb, models, chunk_size, logger, checkpoint, index)
+            if index is not None:
+                index.update((key, model_ids[key]) for key in created)
+        stats.models_created += len(created)
+
+        ready = {}
+        for gtin, draft in variants.items():
+            model_key = variant_models[gtin]
+            if model_key in failed_models:
+                continue
+            ready[gtin] = {"model_id": model_ids[model_key], **draft}
+        with timer.phase("variants"):
+            variant_ids, failed_variants = flush_variants(sb, ready, chunk_size, logger, checkpoint)
+        stats.variants_upserted = len(variant_ids)
+
+        # (Se DRY_RUN, isto só loga)
+        with timer.phase("stock"):
+            failed_stock = flush_stock(sb, variant_ids, warehouse_ids, INITIAL_STOCK, chunk_size,
+                                       stats, logger, checkpoint)
+    except BaseException:
+        # interrupção (Ctrl+C, erro fatal): guarda o que já foi gravado para --resume
+        if checkpoint:
+            checkpoint.save()
+            logger.error("ETL interrompido; progresso guardado em %s (usa --resume)", checkpoint.path)
+        raise
+
+    if checkpoint:
+        if failed_models or failed_variants or failed_stock:
+            logger.warning("Houve blocos com falha; usa --resume para reenviar só esses blocos")
+        else:
+            checkpoint.clear()
+
+    # 3) resultado por linha
+    succeeded = set()
+    used_models = set()
+    for p in payloads:
+        error = (failed_models.get(p.model_key)
+                 or failed_variants.get(p.gtin)
+                 or failed_stock.get(p.gtin))
+        if error:
+            stats.rows_rejected_error += 1
+            db_errors.append((p.idx, error, p.values))
+            continue
+        stats.rows_ok += 1
+        succeeded.add(p.gtin)
+        used_models.add(p.model_key)
+    # por modelo distinto (não por linha): modelos já existentes usados pelas linhas gravadas
+    stats.models_reused = len(used_models - created)
+
+    return succeeded
 
-    rows = sb.select("suppliers", select="id", name=f"eq.{supplier_name}", limit="1")
-    if rows:
-        cache[key] = int(rows[0]["id"])
-        return cache[key]
 
-    created = sb.insert("suppliers", [{"name": supplier_name}])
-    new_id = int(created[0]["id"]) if created else -1
-    cache[key] = new_id
-    stats.suppliers_created += 1
-    return new_id
+# -----------------------------
+# Backend COPY: Postgres direto (DATABASE_URL), numa só transação
+# -----------------------------
+# colunas da tabela de staging, pela ordem do COPY
+STAGING_COLUMNS = ["row_index", *COLMAP.values()]
+
+# tabelas de domínio: (tabela, coluna do valor, coluna da folha, contador em Stats)
+COPY_DOMAINS = [
+    ("brands", "name", "marca", "brands_created"),
+    ("categories", "name", "categoria", "categories_created"),
+    ("colors", "name", "cor", "colors_created"),
+    ("sizes", "value", "tamanho", "sizes_created"),
+]
+
+# o staging fica em tabelas temporárias; tudo o resto é um merge em SQL por etapa
+COPY_MERGE_SQL = {
+    "rows": """
+        -- GTIN repetido: vale a última linha, como no modo REST
+        CREATE TEMP TABLE etl_rows ON COMMIT DROP AS
+        SELECT DISTINCT ON (gtin) * FROM etl_staging ORDER BY gtin, row_index DESC
+    """,
+    "suppliers": """
+        INSERT INTO public.suppliers (name)
+        SELECT %(supplier)s::text
+        WHERE NOT EXISTS (SELECT 1 FROM public.suppliers WHERE lower(name) = lower(%(supplier)s::text))
+    """,
+    # {table}/{field}/{column} vêm de COPY_DOMAINS (nunca do Excel)
+    "domain": """
+        INSERT INTO public.{table} ({field})
+        SELECT DISTINCT ON (lower(s.{column})) s.{column}
+        FROM etl_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM public.{table} d WHERE lower(d.{field}) = lower(s.{column}))
+        ORDER BY lower(s.{column}), s.row_index
+    """,
+    "domain_map": """
+        CREATE TEMP TABLE etl_map_{table} ON COMMIT DROP AS
+        SELECT lower({field}) AS k, min(id) AS id FROM public.{table} GROUP BY 1
+    """,
+    "subcategories": """
+        INSERT INTO public.subcategories (category_id, name)
+        SELECT DISTINCT ON (c.id, lower(s.subcategoria)) c.id, s.subcategoria
+        FROM etl_staging s
+        JOIN etl_map_categories c ON c.k = lower(s.categoria)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM public.subcategories d
+            WHERE d.category_id = c.id AND lower(d.name) = lower(s.subcategoria)
+        )
+        ORDER BY c.id, lower(s.subcategoria), s.row_index
+    """,
+    "subcategory_map": """
+        CREATE TEMP TABLE etl_map_subcategories ON COMMIT DROP AS
+        SELECT category_id, lower(name) AS k, min(id) AS id FROM public.subcategories GROUP BY 1, 2
+    """,
+    "resolved": """
+        CREATE TEMP TABLE etl_resolved ON COMMIT DROP AS
+        SELECT s.row_index, s.gtin, s.nome, s.ref_keyinvoice AS ref,
+               coalesce(s.ref_keyinvoice, '') AS ref_key, s.ref_keyinvoice IS NULL AS ref_null,
+               b.id AS marca_id, c.id AS categoria_id, sc.id AS subcategoria_id,
+               co.id AS cor_id, sz.id AS tamanho_id,
+               CASE WHEN s.ref_keyinvoice ~ '^[+-]?[0-9]+$' THEN (s.ref_keyinvoice::numeric)::text END
+                   AS variant_ref
+        FROM etl_staging s
+        JOIN etl_map_brands b ON b.k = lower(s.marca)
+        JOIN etl_map_categories c ON c.k = lower(s.categoria)
+        JOIN etl_map_subcategories sc ON sc.category_id = c.id AND sc.k = lower(s.subcategoria)
+        JOIN etl_map_colors co ON co.k = lower(s.cor)
+        JOIN etl_map_sizes sz ON sz.k = lower(s.tamanho)
+    """,
+    # chave natural do modelo com ref NULL explícito, para os joins poderem ser por hash
+    "model_map": """
+        CREATE TEMP TABLE etl_map_models ON COMMIT DROP AS
+        SELECT coalesce(ref, '') AS ref_key, ref IS NULL AS ref_null,
+               marca_id, categoria_id, subcategoria_id, min(id) AS id
+        FROM public.product_model GROUP BY 1, 2, 3, 4, 5
+    """,
+    "models": """
+        -- a 1ª linha de cada modelo define o nome
+        WITH created AS (
+            INSERT INTO public.product_model
+                (ref, nome_modelo, marca_id, categoria_id, subcategoria_id, fornecedor_id)
+            SELECT DISTINCT ON (r.ref_key, r.ref_null, r.marca_id, r.categoria_id, r.subcategoria_id)
+                   r.ref, r.nome, r.marca_id, r.categoria_id, r.subcategoria_id,
+                   (SELECT min(id) FROM public.suppliers WHERE lower(name) = lower(%(supplier)s::text))
+            FROM etl_resolved r
+            WHERE NOT EXISTS (
+                SELECT 1 FROM etl_map_models m
+                WHERE m.ref_key = r.ref_key AND m.ref_null = r.ref_null AND m.marca_id = r.marca_id
+                  AND m.categoria_id = r.categoria_id AND m.subcategoria_id = r.subcategoria_id
+            )
+            ORDER BY r.ref_key, r.ref_null, r.marca_id, r.categoria_id, r.subcategoria_id, r.row_index
+            RETURNING id, ref, marca_id, categoria_id, subcategoria_id
+        )
+        INSERT INTO etl_map_models
+        SELECT coalesce(ref, ''), ref IS NULL, marca_id, categoria_id, subcategoria_id, id FROM created
+    """,
+    "variants": """
+        INSERT INTO public.product_variant (gtin, model_id, cor_id, tamanho_id, ref_keyinvoice, ref_woocomerce)
+        SELECT r.gtin, m.id, r.cor_id, r.tamanho_id, r.variant_ref, NULL
+        FROM etl_resolved r
+        JOIN etl_rows u ON u.row_index = r.row_index
+        JOIN etl_map_models m
+          ON m.ref_key = r.ref_key AND m.ref_null = r.ref_null AND m.marca_id = r.marca_id
+         AND m.categoria_id = r.categoria_id AND m.subcategoria_id = r.subcategoria_id
+        ON CONFLICT (gtin) DO UPDATE SET
+            model_id = EXCLUDED.model_id, cor_id = EXCLUDED.cor_id, tamanho_id = EXCLUDED.tamanho_id,
+            ref_keyinvoice = EXCLUDED.ref_keyinvoice, ref_woocomerce = EXCLUDED.ref_woocomerce,
+            updated_at = now()
+        WHERE (product_variant.model_id, product_variant.cor_id, product_variant.tamanho_id,
+               product_variant.ref_keyinvoice, product_variant.ref_woocomerce)
+              IS DISTINCT FROM
+              (EXCLUDED.model_id, EXCLUDED.cor_id, EXCLUDED.tamanho_id,
+               EXCLUDED.ref_keyinvoice, EXCLUDED.ref_woocomerce)
+    """,
+    "stock": """
+        INSERT INTO public.warehouse_stock (variant_id, warehouse_id, stock)
+        SELECT v.id, w.id, %(stock)s
+        FROM etl_rows u
+        JOIN public.product_variant v ON v.gtin = u.gtin
+        CROSS JOIN public.warehouses w
+        ON CONFLICT (variant_id, warehouse_id) DO UPDATE SET stock = EXCLUDED.stock, updated_at = now()
+        WHERE warehouse_stock.stock IS DISTINCT FROM EXCLUDED.stock
+    """,
+}
+
+
+def load_with_copy(
+    database_url: str,
+    valid: pd.DataFrame,
+    settings: "Settings",
+    stats: Stats,
+    logger: logging.Logger,
+    timer: PhaseTimer,
+) -> set:
+    """
+    Carrega as linhas válidas por COPY para uma tabela temporária e faz o merge no servidor
+    (domínios -> modelos -> variantes -> stock) numa única transação: ou grava tudo, ou nada.
+    Com DRY_RUN faz o mesmo trabalho e faz rollback no fim (os contadores ficam exatos).
+    Variantes e stock iguais ao que já está na base não são reescritos.
+    Retorna os GTINs gravados
+    """
+    try:
+        import psycopg
+    except ImportError:
+        raise SystemExit("O backend copy precisa do psycopg 3 (pip install \"psycopg[binary]\")")
+
+    params = {"supplier": settings.default_supplier, "stock": INITIAL_STOCK}
+    started = time.monotonic()
+    with psycopg.connect(database_url, autocommit=False, client_encoding="utf8") as conn:
+        with conn.cursor() as cur:
+            with timer.phase("copy"):
+                cur.execute(f"""
+                    CREATE TEMP TABLE etl_staging (
+                        row_index bigint NOT NULL,
+                        {", ".join(f"{c} text" for c in COLMAP.values())}
+                    ) ON COMMIT DROP
+                """)
+                with cur.copy(f"COPY etl_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN") as copy:
+                    for row in valid.itertuples(name=None):
+                        copy.write_row(row)
+                # tabelas temporárias não passam pelo autovacuum: sem estatísticas os joins saem maus
+                cur.execute("ANALYZE etl_staging")
+            logger.info("COPY de %s linhas para o staging em %.1fs", len(valid), timer.phases["copy"])
+
+            with timer.phase("domains"):
+                cur.execute(COPY_MERGE_SQL["rows"])
+                cur.execute(COPY_MERGE_SQL["suppliers"], params)
+                stats.suppliers_created += cur.rowcount
+                for table, field, column, counter in COPY_DOMAINS:
+                    cur.execute(COPY_MERGE_SQL["domain"].format(table=table, field=field, column=column))
+                    setattr(stats, counter, getattr(stats, counter) + cur.rowcount)
+                    cur.execute(COPY_MERGE_SQL["domain_map"].format(table=table, field=field))
+                cur.execute(COPY_MERGE_SQL["subcategories"])
+                stats.subcategories_created += cur.rowcount
+                cur.execute(COPY_MERGE_SQL["subcategory_map"])
+                cur.execute(COPY_MERGE_SQL["resolved"])
+                cur.execute("ANALYZE etl_resolved")
+
+            with timer.phase("models"):
+                cur.execute(COPY_MERGE_SQL["model_map"])
+                cur.execute(COPY_MERGE_SQL["models"], params)
+                stats.models_created += cur.rowcount
+                cur.execute("""
+                    SELECT count(*) FROM (
+                        SELECT DISTINCT ref_key, ref_null, marca_id, categoria_id, subcategoria_id
+                        FROM etl_resolved
+                    ) k
+                """)
+                stats.models_reused = cur.fetchone()[0] - stats.models_created
+
+            with timer.phase("variants"):
+                cur.execute(COPY_MERGE_SQL["variants"])
+                stats.variants_upserted = cur.rowcount
+            with timer.phase("stock"):
+                cur.execute(COPY_MERGE_SQL["stock"], params)
+                stats.stock_upserts += cur.rowcount
+
+        with timer.phase("commit"):
+            if settings.dry_run:
+                conn.rollback()
+                logger.info("DRY_RUN: merge calculado e desfeito (rollback) em %.1fs", time.monotonic() - started)
+            else:
+                conn.commit()
+                logger.info("Merge gravado (commit) em %.1fs", time.monotonic() - started)
+
+    stats.rows_ok += len(valid)
+    return set(valid["gtin"])
 
 
 # -----------------------------
-# Model + Variant + Stock (via Supabase)
+# Reconciliação de stock: leitura do stock atual e escrita (a folha e a diferença estão em reconciliacao.py)
 # -----------------------------
-def find_or_create_model(
+def lookup_variant_gtins(sb: SupabaseClient, column: str, values: List[Any]) -> Dict[str, int]:
+    """product_variant por gtin ou por id, em blocos de LOOKUP_CHUNK valores (em paralelo). Retorna {gtin: id}"""
+    pages = raise_first_error(sb.run_parallel(
+        lambda chunk: sb.select_all("product_variant", select="id,gtin", **{column: in_filter(chunk)}),
+        chunks(list(values), LOOKUP_CHUNK),
+    ))
+    return {str(r["gtin"]): int(r["id"]) for page in pages for r in page if r.get("gtin")}
+
+
+def load_counted_stock(
     sb: SupabaseClient,
-    ref: Optional[str],
-    nome_modelo: str,
-    marca_id: int,
-    categoria_id: int,
-    subcategoria_id: int,
-    fornecedor_id: int,
-    stats: Stats,
-) -> int:
-    # ref null vs value: PostgREST usa "is.null"
-    ref_filter = "is.null" if ref is None else f"eq.{ref}"
-
-    rows = sb.select(
-        "product_model",
-        select="id",
-        ref=ref_filter,
-        marca_id=f"eq.{marca_id}",
-        categoria_id=f"eq.{categoria_id}",
-        subcategoria_id=f"eq.{subcategoria_id}",
-        limit="1",
-    )
-    if rows:
-        stats.models_reused += 1
-        return int(rows[0]["id"])
-
-    created = sb.insert("product_model", [{
-        "ref": ref,
-        "nome_modelo": nome_modelo,
-        "marca_id": marca_id,
-        "categoria_id": categoria_id,
-        "subcategoria_id": subcategoria_id,
-        "fornecedor_id": fornecedor_id,
-        "wc_product_id": None,
-    }])
-    stats.models_created += 1
-    return int(created[0]["id"]) if created else -1
-
-
-def upsert_variant(
+    variant_ids: List[int],
+    warehouse_ids: List[int],
+    whole_warehouses: bool = False,
+) -> pd.DataFrame:
+    """
+    Stock atual nos armazéns contados: só das variantes da folha (blocos de LOOKUP_CHUNK ids,
+    em paralelo) ou, com whole_warehouses, de tudo o que esses armazéns têm.
+    Retorna as colunas variant_id, warehouse_id, stock
+    """
+    columns = ["variant_id", "warehouse_id", "stock"]
+    if not warehouse_ids:
+        return pd.DataFrame(columns=columns, dtype="int64")
+    select = ",".join(columns)
+    order = "variant_id,warehouse_id"
+    warehouse_filter = in_filter(warehouse_ids)
+    if whole_warehouses:
+        pages = [sb.select_all("warehouse_stock", select=select, order=order, warehouse_id=warehouse_filter)]
+    else:
+        pages = raise_first_error(sb.run_parallel(
+            lambda chunk: sb.select_all("warehouse_stock", select=select, order=order,
+                                        warehouse_id=warehouse_filter, variant_id=in_filter(chunk)),
+            chunks(variant_ids, LOOKUP_CHUNK),
+        ))
+    rows = [r for page in pages for r in page]
+    return pd.DataFrame(rows, columns=columns).astype("int64")
+
+
+def apply_stock_changes(
     sb: SupabaseClient,
-    model_id: int,
-    gtin: str,
-    cor_id: int,
-    tamanho_id: int,
-    ref_keyinvoice: Optional[int],
-    stats: Stats,
-) -> int:
-    rows = sb.upsert(
-        "product_variant",
-        [{
-            "model_id": model_id,
-            "gtin": gtin,
-            "cor_id": cor_id,
-            "tamanho_id": tamanho_id,
-            "ref_woocomerce": None,   # conforme pediste
-            "ref_keyinvoice": ref_keyinvoice,
-        }],
-        on_conflict="gtin",
+    changes: pd.DataFrame,
+    chunk_size: int,
+    logger: logging.Logger,
+) -> List[str]:
+    """
+    Upsert em bloco (on_conflict=variant_id,warehouse_id) das linhas de diff_stock.
+    Retorna o estado de cada linha: "ok", "dry_run" ou o erro do bloco
+    """
+    rows = [
+        {"variant_id": int(v), "warehouse_id": int(w), "stock": int(s)}
+        for v, w, s in zip(changes["variant_id"], changes["warehouse_id"], changes["after"])
+    ]
+    status = ["dry_run" if sb.dry_run else "ok"] * len(rows)
+
+    def on_done(chunk, _, error):
+        if error is not None:
+            logger.warning("Falha no upsert de %s linhas de stock: %s", len(chunk), error)
+            for i in chunk:
+                status[i] = str(error)
+
+    sb.run_parallel(
+        lambda chunk: sb.upsert("warehouse_stock", [rows[i] for i in chunk], on_conflict="variant_id,warehouse_id"),
+        chunks(list(range(len(rows))), chunk_size),
+        on_done=on_done,
     )
-    stats.variants_upserted += 1
+    return status
 
-    # Precisa do id para stock.
-    if rows:
-        return int(rows[0]["id"])
 
-    # DRY_RUN: não há retorno (e nem gravou). Tentamos buscar pelo gtin só para coerência.
-    found = sb.select("product_variant", select="id", gtin=f"eq.{gtin}", limit="1")
-    return int(found[0]["id"]) if found else -1
+def run_reconcile(args: argparse.Namespace, logger: logging.Logger) -> None:
+    """
+    Acerta o stock a partir de folhas de contagem (--input): lê o stock atual só das variantes
+    e armazéns contados, escreve só as linhas que mudaram e grava a auditoria (antes/depois).
+    """
+    if not args.input:
+        raise SystemExit("reconcile precisa da folha de contagem em --input")
+    settings = load_settings(args, need_excel=False)
+    paths = input_files(settings)
+    timer = PhaseTimer()
+
+    with timer.phase("read"):
+        frames: List[pd.DataFrame] = []
+        files: List[InputFile] = []
+        start = 0
+        for path in paths:
+            frame = read_count_sheet(path)
+            frame.index = pd.RangeIndex(start, start + len(frame))
+            files.append(InputFile(path, start, len(frame)))
+            frames.append(frame)
+            start += len(frame)
+        sheet = pd.concat(frames) if len(frames) > 1 else frames[0]
+    logger.info("Folha(s) de contagem: %s linhas em %s ficheiro(s)", len(sheet), len(files))
+
+    sb = SupabaseClient(settings.supabase_url, settings.supabase_key, dry_run=settings.dry_run, logger=logger,
+                        concurrency=settings.concurrency)
+    try:
+        with timer.phase("lookup"):
+            warehouse_rows = sb.select_all("warehouses", select="id,name")
+        warehouse_names = {int(w["id"]): str(w["name"]) for w in warehouse_rows}
+        warehouses = {str(wid): wid for wid in warehouse_names}
+        warehouses.update((name.lower(), wid) for wid, name in warehouse_names.items())
+
+        with timer.phase("validate"):
+            valid, rejects = validate_counts(sheet, warehouses, args.warehouse)
+
+        with timer.phase("lookup"):
+            variant_ids = lookup_variant_gtins(sb, "gtin", valid["gtin"].unique().tolist())
+        unknown = ~valid["gtin"].isin(list(variant_ids))
+        if unknown.any():
+            missing = sheet.loc[valid.index[unknown.to_numpy()]].copy()
+            missing.insert(0, "reason_code", "GTIN_UNKNOWN")
+            rejects = pd.concat([rejects, missing]) if len(rejects) else missing
+            valid = valid[~unknown]
+
+        # o mesmo GTIN contado em várias linhas do mesmo armazém (ex.: duas prateleiras): soma
+        counts = (valid.assign(variant_id=valid["gtin"].map(variant_ids))
+                  .groupby(STOCK_KEY, as_index=False, sort=False)
+                  .agg(gtin=("gtin", "first"), qty=("qty", "sum")))
+        counted_warehouses = sorted(counts["warehouse_id"].unique().tolist())
+
+        with timer.phase("stock"):
+            current = load_counted_stock(sb, counts["variant_id"].tolist(), counted_warehouses,
+                                         whole_warehouses=args.full_count)
+        with timer.phase("diff"):
+            changes = diff_stock(counts, current, whole_warehouses=args.full_count)
+            # linhas postas a 0 por --full-count: o GTIN não vem da folha
+            no_gtin = changes["gtin"].isna()
+            if no_gtin.any():
+                found = lookup_variant_gtins(sb, "id", changes.loc[no_gtin, "variant_id"].unique().tolist())
+                by_id = {vid: gtin for gtin, vid in found.items()}
+                changes.loc[no_gtin, "gtin"] = changes.loc[no_gtin, "variant_id"].map(by_id)
+
+        logger.info("%s linhas (GTIN, armazém) contadas; %s a escrever", len(counts), len(changes))
+        with timer.phase("write"):
+            changes["status"] = apply_stock_changes(sb, changes, settings.chunk_size, logger)
+    finally:
+        sb.close()
+    http = sb.http.summary()
+
+    all_rejects = label_sources(collect_rejects(rejects, []), files)
+    write_rejects(all_rejects, args.rejects_file, args.rejects_parquet, logger)
+    log_rejects(all_rejects, logger)
+
+    changes.insert(3, "warehouse", changes["warehouse_id"].map(warehouse_names))
+    changes.to_csv(args.audit_file, index=False, encoding="utf-8")
+
+    failed = changes["status"].isin(["ok", "dry_run"]).eq(False)
+    new_rows = changes["before"].isna()
+    up = changes[changes["diff"] > 0]
+    down = changes[changes["diff"] < 0]
+    zeroed = ~changes["counted"].astype(bool)
+    summary = {
+        "count_rows": len(sheet),
+        "rejected": len(all_rejects),
+        "counted": len(counts),
+        "unchanged": len(counts) - int((~zeroed).sum()),
+        "changed": len(changes),
+        "increases": len(up),
+        "units_added": int(up["diff"].sum()),
+        "decreases": len(down),
+        "units_removed": int(-down["diff"].sum()),
+        "new_rows": int(new_rows.sum()),
+        "zeroed_not_counted": int(zeroed.sum()),
+        "written": 0 if settings.dry_run else int((~failed).sum()),
+        "failed": int(failed.sum()),
+    }
+
+    by_warehouse = "\n".join(
+        f"- {warehouse_names.get(wid, wid)} (id {wid}): {len(group)} alterações, "
+        f"+{int(group['diff'].clip(lower=0).sum())} / -{int(-group['diff'].clip(upper=0).sum())} unidades"
+        for wid, group in changes.groupby("warehouse_id")
+    ) or "- (sem alterações)"
+
+    if args.metrics_file:
+        append_metrics(args.metrics_file, {
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "command": "reconcile",
+            "inputs": paths,
+            "dry_run": settings.dry_run,
+            "full_count": args.full_count,
+            "total_s": round(timer.total, 3),
+            "phases_s": {name: round(seconds, 3) for name, seconds in timer.phases.items()},
+            "http": http,
+            "reconcile": summary,
+        })
 
+    print(f"""
+========================
+RECONCILIAÇÃO DE STOCK
+========================
+Modo: {"DRY-RUN (sem gravar, só logs)" if settings.dry_run else "REAL (gravando no Supabase)"}
+Contagem {"completa (o não contado passa a 0)" if args.full_count else "parcial (só o que está na folha)"}
 
-def upsert_stock_for_all_warehouses(
-    sb: SupabaseClient,
-    variant_id: int,
-    stock_value: int,
-    stats: Stats,
-) -> None:
-    warehouses = sb.select("warehouses", select="id")
-    if not warehouses:
-        raise RuntimeError("Tabela warehouses está vazia. Não dá para criar stock.")
+Folha:
+- Linhas lidas:                   {summary['count_rows']}
+- Rejeitadas:                     {summary['rejected']}
+- (GTIN, armazém) contados:       {summary['counted']} em {len(counted_warehouses)} armazém(ns)
 
-    payload = [
-        {"variant_id": variant_id, "warehouse_id": int(w["id"]), "stock": stock_value}
-        for w in warehouses
-    ]
+Stock:
+- Iguais (nada a escrever):       {summary['unchanged']}
+- A escrever:                     {summary['changed']}
+  - Aumentos:                     {summary['increases']} (+{summary['units_added']} unidades)
+  - Reduções:                     {summary['decreases']} (-{summary['units_removed']} unidades)
+  - Linhas novas:                 {summary['new_rows']}
+  - Postas a 0 (não contadas):    {summary['zeroed_not_counted']}
+- Gravadas:                       {summary['written']}
+- Falhas:                         {summary['failed']}
+
+Por armazém:
+{by_warehouse}
 
-    sb.upsert("warehouse_stock", payload, on_conflict="variant_id,warehouse_id")
-    stats.stock_upserts += len(payload)
+HTTP: {http['requests']} pedidos em {timer.total:.2f}s
+
+Ficheiros:
+- Auditoria: {args.audit_file}
+- Rejeitos:  {args.rejects_file}
+========================
+""")
 
 
 # -----------------------------
 # ETL
 # -----------------------------
-def main():
-    # Carrega o .env do mesmo diretório do script
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Importa o Excel de produtos para o Supabase")
+    parser.add_argument(
+        "command", nargs="?", choices=["run", "plan", "apply", "reconcile"], default="run",
+        help="run: importa diretamente (default); plan: calcula o que seria escrito, sem gravar; "
+             "apply: executa um plano (grava sempre, ignora DRY_RUN); "
+             "reconcile: acerta o stock a partir de folhas de contagem (--input com GTIN, armazém, quantidade)",
+    )
+    parser.add_argument(
+        "--plan-file", default=DEFAULT_PLAN_FILE,
+        help=f"ficheiro do plano para plan/apply (default: {DEFAULT_PLAN_FILE})",
+    )
+    parser.add_argument(
+        "--backend", choices=["rest", "copy"], default=os.getenv("ETL_BACKEND", "rest").strip() or "rest",
+        help="rest: API do Supabase (default); copy: COPY + merge direto no Postgres via DATABASE_URL "
+             "(recargas completas do catálogo, numa só transação)",
+    )
+    parser.add_argument(
+        "--input", nargs="+", default=None, metavar="PATH",
+        help="ficheiros, pastas ou padrões glob a importar, juntos numa só escrita "
+             "(default: EXCEL_PATH no .env)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="processos a ler/normalizar ficheiros em paralelo (default: nº de CPUs)",
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="fica a vigiar as pastas/padrões do --input e importa cada ficheiro novo ou alterado",
+    )
+    parser.add_argument(
+        "--watch-interval", type=float, default=DEFAULT_WATCH_INTERVAL,
+        help=f"segundos entre passagens do --watch (default: {DEFAULT_WATCH_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--warehouse", default=None, metavar="NOME|ID",
+        help="reconcile: armazém das linhas da contagem sem armazém (ou folha sem essa coluna)",
+    )
+    parser.add_argument(
+        "--full-count", action="store_true",
+        help="reconcile: a contagem cobre os armazéns inteiros; o stock não contado passa a 0",
+    )
+    parser.add_argument(
+        "--audit-file", default=DEFAULT_AUDIT_FILE,
+        help=f"reconcile: CSV com cada linha de stock alterada, antes e depois (default: {DEFAULT_AUDIT_FILE})",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=None,
+        help=f"pedidos em paralelo por fase (default: CONCURRENCY no .env ou {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=None,
+        help=f"linhas por pedido de escrita (default: CHUNK_SIZE no .env ou {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--read-batch", type=int, default=DEFAULT_READ_BATCH,
+        help=f"linhas lidas e normalizadas de cada vez (default: {DEFAULT_READ_BATCH})",
+    )
+    parser.add_argument(
+        "--write-normalized", default=None, metavar="PATH",
+        help="grava a folha normalizada (.xlsx, .csv ou .parquet) com os cabeçalhos originais",
+    )
+    parser.add_argument(
+        "--delta", action="store_true",
+        help="só processa linhas novas ou alteradas desde a última execução bem-sucedida",
+    )
+    parser.add_argument(
+        "--strict-gtin", action="store_true",
+        help="rejeita GTINs que não tenham 8, 12, 13 ou 14 dígitos",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continua a partir do último checkpoint sem reenviar os blocos já gravados",
+    )
+    parser.add_argument(
+        "--checkpoint-file", default=DEFAULT_CHECKPOINT_FILE,
+        help=f"ficheiro de checkpoint (default: {DEFAULT_CHECKPOINT_FILE})",
+    )
+    parser.add_argument(
+        "--rejects-file", default=DEFAULT_REJECTS_FILE,
+        help=f"CSV com as linhas rejeitadas e o motivo (default: {DEFAULT_REJECTS_FILE})",
+    )
+    parser.add_argument(
+        "--rejects-parquet", default=None,
+        help="grava também os rejeitos em Parquet neste caminho (precisa do pyarrow)",
+    )
+    parser.add_argument(
+        "--metrics-file", default=os.getenv("METRICS_FILE", "").strip() or None,
+        help="acrescenta as métricas da execução (tempos por fase, HTTP, contadores) "
+             "como uma linha JSON neste ficheiro, para comparar execuções",
+    )
+    parser.add_argument(
+        "--state-file", default=DEFAULT_STATE_FILE,
+        help=f"ficheiro com as impressões digitais da última execução (default: {DEFAULT_STATE_FILE})",
+    )
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Settings:
+    supabase_url: str
+    supabase_key: str
+    excel_path: str
+    excel_sheet: Optional[str]
+    default_supplier: str
+    dry_run: bool
+    chunk_size: int
+    concurrency: int
+    database_url: str
+    inputs: List[str]        # ficheiros, pastas ou padrões glob (--input ou EXCEL_PATH)
+    workers: int
+
+
+def load_settings(args: argparse.Namespace, need_excel: bool = True, backend: str = "rest") -> Settings:
+    """Lê o .env do mesmo diretório do script e valida a configuração"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     dotenv_path = os.path.join(script_dir, ".env")
     load_dotenv(dotenv_path)
-    logger = setup_logger()
 
-    supabase_url = os.getenv("SUPABASE_URL", "").strip()
-    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
-
-    excel_path = os.getenv("EXCEL_PATH", "").strip()
-    excel_sheet = os.getenv("EXCEL_SHEET", "").strip() or None
-    default_supplier = os.getenv("DEFAULT_SUPPLIER", "KeyInvoice Import").strip()
-    dry_run = os.getenv("DRY_RUN", "true").strip().lower() in {"1", "true", "yes", "y"}
+    settings = Settings(
+        supabase_url=os.getenv("SUPABASE_URL", "").strip(),
+        supabase_key=os.getenv("SUPABASE_KEY", "").strip(),
+        excel_path=os.getenv("EXCEL_PATH", "").strip(),
+        excel_sheet=os.getenv("EXCEL_SHEET", "").strip() or None,
+        default_supplier=os.getenv("DEFAULT_SUPPLIER", "KeyInvoice Import").strip(),
+        dry_run=os.getenv("DRY_RUN", "true").strip().lower() in {"1", "true", "yes", "y"},
+        chunk_size=args.chunk_size or int(os.getenv("CHUNK_SIZE", "").strip() or DEFAULT_CHUNK_SIZE),
+        concurrency=args.concurrency or int(os.getenv("CONCURRENCY", "").strip() or DEFAULT_CONCURRENCY),
+        database_url=os.getenv("DATABASE_URL", "").strip(),
+        inputs=[os.path.abspath(p) for p in args.input or []],
+        workers=args.workers or os.cpu_count() or 1,
+    )
 
-    if not supabase_url or not supabase_key:
+    if backend == "copy":
+        if not settings.database_url:
+            raise SystemExit("Falta DATABASE_URL no .env (necessário para --backend copy)")
+    elif not settings.supabase_url or not (settings.supabase_key or settings.supabase_url.startswith("fake://")):
         raise SystemExit("Falta SUPABASE_URL ou SUPABASE_KEY no .env")
-    if not excel_path:
-        raise SystemExit("Falta EXCEL_PATH no .env")
-    
-    # Se o caminho do Excel não for absoluto, busca no diretório do script
-    if not os.path.isabs(excel_path):
-        excel_path = os.path.join(script_dir, excel_path)
-
-    sb = SupabaseClient(supabase_url, supabase_key, dry_run=dry_run, logger=logger)
-    stats = Stats()
-
-    logger.info("Lendo Excel: %s | aba: %s", excel_path, excel_sheet or "(primeira)")
-    df = pd.read_excel(excel_path, sheet_name=excel_sheet, dtype=str)
-    # Limpa nomes das colunas: remove espaços extras e caracteres especiais como _x000d_
-    df.columns = [str(c).strip().replace('_x000d_', '').replace('_x000D_', '') for c in df.columns]
-
-    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
-    if missing:
-        raise SystemExit(f"Faltam colunas no Excel: {missing}")
+    if need_excel and not settings.inputs and not settings.excel_path:
+        raise SystemExit("Falta EXCEL_PATH no .env (ou --input)")
 
-    df = df[REQUIRED_COLUMNS].rename(columns=COLMAP)
+    # Se o caminho do Excel não for absoluto, busca no diretório do script
+    if settings.excel_path and not os.path.isabs(settings.excel_path):
+        settings.excel_path = os.path.join(script_dir, settings.excel_path)
+    if not settings.inputs and settings.excel_path:
+        settings.inputs = [settings.excel_path]
+    return settings
+
+
+def input_files(settings: Settings) -> List[str]:
+    paths = resolve_inputs(settings.inputs)
+    if not paths:
+        raise SystemExit(f"Nenhum ficheiro para importar em: {', '.join(settings.inputs)}")
+    return paths
+
+
+def run_plan(args: argparse.Namespace, logger: logging.Logger) -> None:
+    """Lê o(s) Excel(s) e um snapshot do servidor e grava o plano; nunca escreve no Supabase"""
+    settings = load_settings(args)
+    paths = input_files(settings)
+    df, _ = read_inputs(paths, settings.excel_sheet, args.read_batch, settings.workers, logger)
+    valid, rejects = validate_frame(df, strict_gtin=args.strict_gtin)
+    if len(rejects):
+        logger.warning("%s linhas rejeitadas na validação: %s (não entram no plano)", len(rejects),
+                       rejects["reason_code"].value_counts().to_dict())
+
+    # dry_run=True: garantia de que o plano não faz escritas
+    sb = SupabaseClient(settings.supabase_url, settings.supabase_key, dry_run=True, logger=logger,
+                        concurrency=settings.concurrency)
+    started = time.monotonic()
+    try:
+        snapshot = load_snapshot(sb)
+    finally:
+        sb.close()
+    logger.info("Snapshot em %.1fs: %s modelos, %s variantes, %s linhas de stock, %s armazéns",
+                time.monotonic() - started, len(snapshot.models), len(snapshot.variants),
+                len(snapshot.stock), len(snapshot.warehouse_ids))
+
+    fingerprints = sheet_fingerprints(valid, settings.default_supplier)
+    plan = {
+        "version": PLAN_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "inputs": paths,
+        "supplier": settings.default_supplier,
+        "signature": fingerprints_signature(fingerprints),
+        "rows_valid": len(valid),
+        "rows_rejected": len(rejects),
+        **build_plan(valid, settings.default_supplier, snapshot),
+    }
+    save_plan(args.plan_file, plan)
+
+    summary = "\n".join(f"- {name + ':':<24}{value}" for name, value in plan["summary"].items())
+    print(f"""
+========================
+PLANO ({args.plan_file})
+========================
+Linhas válidas: {len(valid)} | rejeitadas: {len(rejects)}
 
-    for col in ["ref_keyinvoice", "ref_woocomerce", "categoria", "subcategoria", "marca", "nome", "cor", "tamanho"]:
-        df[col] = df[col].apply(clean_str)
-    df["gtin"] = df["gtin"].apply(clean_gtin)
+{summary}
 
-    stats.rows_total = len(df)
+Para executar: python {os.path.basename(__file__)} apply --plan-file {args.plan_file}
+========================
+""")
 
-    rejects_path = "etl_rejects.csv"
-    with open(rejects_path, "w", newline="", encoding="utf-8") as f_rej:
-        rej_writer = csv.writer(f_rej)
-        rej_writer.writerow(["row_index", "reason", *df.columns.tolist()])
 
-        # caches
-        brands_cache: Dict[str, int] = {}
-        categories_cache: Dict[str, int] = {}
-        subcategories_cache: Dict[Tuple[int, str], int] = {}
-        colors_cache: Dict[str, int] = {}
-        sizes_cache: Dict[str, int] = {}
-        suppliers_cache: Dict[str, int] = {}
+def run_apply(args: argparse.Namespace, logger: logging.Logger) -> None:
+    """Executa o plano gravado por run_plan"""
+    settings = load_settings(args, need_excel=False)
+    plan = load_plan(args.plan_file)
+    stats = Stats()
 
-        # fornecedor default (obrigatório no schema)
-        fornecedor_id = get_or_create_supplier(sb, default_supplier, suppliers_cache, stats)
+    logger.info("Aplicando plano %s (criado em %s): %s", args.plan_file, plan["created_at"], plan["summary"])
+    if settings.dry_run:
+        logger.info("DRY_RUN ignorado: apply grava sempre (para simular usa o comando plan)")
+    sb = SupabaseClient(settings.supabase_url, settings.supabase_key, dry_run=False, logger=logger,
+                        concurrency=settings.concurrency)
+    try:
+        failed = apply_plan(sb, plan, settings.chunk_size, stats, logger)
+    finally:
+        sb.close()
 
-        logger.info("Iniciando ETL (Supabase REST) | dry_run=%s | supplier=%s", dry_run, default_supplier)
+    if failed:
+        logger.warning("%s GTINs falharam; volta a correr plan para gerar um plano só com o que falta", len(failed))
+    print(f"""
+========================
+APLICAÇÃO DO PLANO ({args.plan_file})
+========================
+Domínios criados:
+- suppliers:      {stats.suppliers_created}
+- brands:         {stats.brands_created}
+- categories:     {stats.categories_created}
+- subcategories:  {stats.subcategories_created}
+- colors:         {stats.colors_created}
+- sizes:          {stats.sizes_created}
 
-        for idx, row in df.iterrows():
-            gtin = row["gtin"]
+Modelos criados:  {stats.models_created}
+Variantes:        {stats.variants_upserted}
+Stocks:           {stats.stock_upserts}
+GTINs com falha:  {len(failed)}
+========================
+""")
 
-            # REGRA: sem GTIN, não cadastra absolutamente nada
-            if not gtin:
-                stats.rows_skipped_no_gtin += 1
-                rej_writer.writerow([idx, "GTIN ausente (linha ignorada)", *[row.get(c) for c in df.columns]])
-                continue
 
-            stats.rows_processed += 1
+def run_import(
+    args: argparse.Namespace,
+    settings: Settings,
+    logger: logging.Logger,
+    paths: List[str],
+    sb: Optional[SupabaseClient] = None,
+    cache: Optional[WriteCache] = None,
+) -> None:
+    """
+    Importa os ficheiros dados numa só escrita e imprime o relatório.
+    sb/cache: cliente e caches partilhados entre os ciclos do --watch (senão, criados e largados aqui)
+    """
+    default_supplier = settings.default_supplier
+    dry_run = settings.dry_run
+    stats = Stats()
+    timer = PhaseTimer()
+    http: Optional[dict] = None
 
+    df, files = read_inputs(paths, settings.excel_sheet, args.read_batch, settings.workers, logger, timer,
+                            skip_invalid=args.watch)
+    stats.rows_total = len(df)
+    if args.write_normalized:
+        # substitui o padronizar_excel.py: grava a folha já normalizada, sem a voltar a ler
+        with timer.phase("write_normalized"):
+            write_frame(to_original_headers(df), args.write_normalized, settings.excel_sheet or "Folha1")
+        logger.info("Folha normalizada gravada em %s", args.write_normalized)
+
+    # validação vetorizada: só as linhas válidas seguem (e só estas criam domínios)
+    with timer.phase("validate"):
+        valid, rejects = validate_frame(df, strict_gtin=args.strict_gtin)
+    stats.rows_skipped_no_gtin = int((rejects["reason_code"] == "GTIN_MISSING").sum())
+    stats.rows_processed = len(df) - stats.rows_skipped_no_gtin
+    stats.rows_rejected_error = len(rejects) - stats.rows_skipped_no_gtin
+
+    # impressões digitais: no modo delta só seguem as linhas novas/alteradas
+    with timer.phase("delta"):
+        fingerprints = sheet_fingerprints(valid, default_supplier)
+        previous_state = load_state(args.state_file)
+        delta = compute_delta(fingerprints, previous_state)
+    if args.delta:
+        stats.delta_added = len(delta.added)
+        stats.delta_changed = len(delta.changed)
+        stats.delta_unchanged = len(delta.unchanged)
+        # no --watch cada ciclo só vê os ficheiros novos: o que falta não foi removido
+        stats.delta_removed = 0 if args.watch else len(delta.removed)
+        logger.info("Delta vs %s: %s novas, %s alteradas, %s iguais, %s removidas",
+                    args.state_file, stats.delta_added, stats.delta_changed,
+                    stats.delta_unchanged, stats.delta_removed)
+        before = len(valid)
+        valid = valid[~valid["gtin"].isin(delta.unchanged)]
+        stats.rows_processed -= before - len(valid)
+
+    # checkpoint: só em gravação real; a assinatura liga-o a este conjunto de linhas
+    checkpoint = None
+    if args.resume and dry_run:
+        raise SystemExit("--resume não se aplica a DRY_RUN")
+    if args.resume and args.backend == "copy":
+        raise SystemExit("--resume não se aplica ao backend copy (a transação grava tudo ou nada)")
+    if not dry_run and args.backend == "rest":
+        signature = fingerprints_signature(fingerprints)
+        checkpoint = Checkpoint(args.checkpoint_file, signature, stats)
+        if args.resume:
+            if not checkpoint.load():
+                raise SystemExit(f"Sem checkpoint válido para este Excel em {args.checkpoint_file}")
+            logger.info("Retomando do checkpoint: %s modelos, %s variantes e %s stocks já gravados",
+                        len(checkpoint.model_ids), len(checkpoint.variant_ids), len(checkpoint.stock_done))
+        elif os.path.exists(args.checkpoint_file):
+            logger.warning("Checkpoint anterior em %s ignorado (usa --resume para o continuar)",
+                           args.checkpoint_file)
+
+    db_errors: List[Tuple[Any, str, List[Any]]] = []
+    try:
+        if args.backend == "copy":
+            logger.info("Iniciando ETL (COPY Postgres) | dry_run=%s | supplier=%s", dry_run, default_supplier)
+            succeeded = load_with_copy(settings.database_url, valid, settings, stats, logger, timer)
+        else:
+            shared = sb is not None
+            if shared:
+                sb.http = RequestStats()   # contas HTTP por ciclo
+            else:
+                sb = SupabaseClient(settings.supabase_url, settings.supabase_key, dry_run=dry_run, logger=logger,
+                                    concurrency=settings.concurrency)
             try:
-                if len(gtin) < 8:
-                    raise ValueError("GTIN inválido (menos de 8 dígitos)")
-
-                categoria = row["categoria"]
-                subcategoria = row["subcategoria"]
-                marca = row["marca"]
-                nome = row["nome"]
-                cor = row["cor"]
-                tamanho = row["tamanho"]
-
-                if not all([categoria, subcategoria, marca, nome, cor, tamanho]):
-                    raise ValueError("Campos obrigatórios vazios (categoria/subcategoria/marca/nome/cor/tamanho)")
-
-                # domínios
-                marca_id = get_or_create_simple_name(
-                    sb, "brands", "name", marca, brands_cache,
-                    lambda: setattr(stats, "brands_created", stats.brands_created + 1)
-                )
-                categoria_id = get_or_create_simple_name(
-                    sb, "categories", "name", categoria, categories_cache,
-                    lambda: setattr(stats, "categories_created", stats.categories_created + 1)
-                )
-                subcategoria_id = get_or_create_subcategory(sb, categoria_id, subcategoria, subcategories_cache, stats)
-                cor_id = get_or_create_simple_name(
-                    sb, "colors", "name", cor, colors_cache,
-                    lambda: setattr(stats, "colors_created", stats.colors_created + 1)
-                )
-                tamanho_id = get_or_create_size(sb, tamanho, sizes_cache, stats)
-
-                # model
-                ref = row["ref_keyinvoice"]  # product_model.ref (varchar)
-                model_id = find_or_create_model(
-                    sb=sb,
-                    ref=ref,
-                    nome_modelo=nome,
-                    marca_id=marca_id,
-                    categoria_id=categoria_id,
-                    subcategoria_id=subcategoria_id,
-                    fornecedor_id=fornecedor_id,
-                    stats=stats,
-                )
-
-                # variant
-                ref_keyinvoice_bigint = as_int_or_none(row["ref_keyinvoice"])  # product_variant.ref_keyinvoice é bigint
-                variant_id = upsert_variant(
-                    sb=sb,
-                    model_id=model_id,
-                    gtin=gtin,
-                    cor_id=cor_id,
-                    tamanho_id=tamanho_id,
-                    ref_keyinvoice=ref_keyinvoice_bigint,
-                    stats=stats,
-                )
-
-                # stock=1 em todos os armazéns
-                # (Se DRY_RUN, isto só loga)
-                if variant_id != -1:
-                    upsert_stock_for_all_warehouses(sb, variant_id, stock_value=1, stats=stats)
-
-                stats.rows_ok += 1
-
-            except Exception as e:
-                stats.rows_rejected_error += 1
-                rej_writer.writerow([idx, str(e), *[row.get(c) for c in df.columns]])
-                logger.warning("Linha %s rejeitada por erro: %s", idx, e)
+                succeeded = load_with_rest(sb, valid, settings, stats, logger, checkpoint, db_errors, timer, cache)
+            finally:
+                if not shared:
+                    sb.close()
+                http = sb.http.summary()
+    finally:
+        # mesmo que a escrita falhe a meio, os rejeitos da validação ficam gravados
+        with timer.phase("rejects"):
+            all_rejects = label_sources(collect_rejects(rejects, db_errors), files)
+            write_rejects(all_rejects, args.rejects_file, args.rejects_parquet, logger)
+            log_rejects(all_rejects, logger)
+
+    # estado para o próximo --delta (só quando gravou de facto)
+    if not dry_run:
+        if args.watch:
+            # cada ciclo só vê os ficheiros novos: as linhas dos outros ficam como estavam
+            state = dict(previous_state)
+        elif args.delta:
+            state = {g: fp for g, fp in previous_state.items() if g in delta.unchanged}
+        else:
+            state = {}
+        state.update({g: fingerprints[g] for g in succeeded})
+        save_state(args.state_file, state)
 
     # relatório final
+    total = timer.total
+    timing_report = "\n".join(
+        f"- {name + ':':<16}{seconds:8.2f}s ({seconds / total:5.1%})" for name, seconds in timer.phases.items()
+    )
+    http_report = "- (backend copy: sem pedidos HTTP)"
+    if http is not None:
+        methods = ", ".join(f"{m} {n}" for m, n in sorted(http["by_method"].items())) or "-"
+        latency = (f"p50 {http['latency_p50_ms']} ms | p95 {http['latency_p95_ms']} ms"
+                   if http["requests"] else "-")
+        http_report = f"""- Pedidos:        {http['requests']} ({methods})
+- Retries:        {http['retries']}
+- Erros:          {http['errors']}
+- Enviados:       {http['bytes_sent'] / 1024:.1f} KB
+- Recebidos:      {http['bytes_received'] / 1024:.1f} KB
+- Latência:       {latency}"""
+
+    if args.metrics_file:
+        append_metrics(args.metrics_file, {
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "inputs": [f.path for f in files],
+            "backend": args.backend,
+            "dry_run": dry_run,
+            "delta": args.delta,
+            "chunk_size": settings.chunk_size,
+            "concurrency": settings.concurrency,
+            "total_s": round(total, 3),
+            "phases_s": {name: round(seconds, 3) for name, seconds in timer.phases.items()},
+            "http": http,
+            "stats": asdict(stats),
+        })
+
+    delta_report = ""
+    if args.delta:
+        delta_report = f"""
+Delta (vs {args.state_file}):
+- Novas:          {stats.delta_added}
+- Alteradas:      {stats.delta_changed}
+- Iguais:         {stats.delta_unchanged}
+- Removidas:      {stats.delta_removed}
+"""
     report = f"""
 ========================
 RELATÓRIO FINAL
@@ -511,6 +2320,7 @@ RELATÓRIO FINAL
 Modo: {"DRY-RUN (sem gravar, só logs)" if dry_run else "REAL (gravando no Supabase)"}
 
 Linhas:
+- Ficheiros lidos:                {len(files)}
 - Total no Excel:                 {stats.rows_total}
 - Ignoradas (sem GTIN):           {stats.rows_skipped_no_gtin}
 - Processadas (com GTIN):         {stats.rows_processed}
@@ -534,14 +2344,80 @@ Variantes (GTIN):
 
 Stocks:
 - Upserts total:  {stats.stock_upserts}
+{delta_report}
+Tempos:
+{timing_report}
+- {'total:':<16}{total:8.2f}s
+
+HTTP:
+{http_report}
 
 Ficheiros:
 - Log:      etl_run.log
-- Rejeitos: etl_rejects.csv
+- Rejeitos: {args.rejects_file}{f" | {args.rejects_parquet}" if args.rejects_parquet else ""}
 ========================
 """
     print(report)
 
 
+def run_watch(args: argparse.Namespace, settings: Settings, logger: logging.Logger) -> None:
+    """
+    Vigia as pastas/padrões do --input e importa os ficheiros novos ou alterados até Ctrl+C.
+    O cliente e as caches de domínios/modelos são partilhados entre ciclos; cada ciclo grava
+    o seu relatório e rejeitos. Um ficheiro que falhe só volta a ser tentado se for alterado.
+    """
+    if args.resume:
+        raise SystemExit("--resume não se aplica ao --watch")
+    # os ficheiros que o próprio ETL escreve não são entradas
+    outputs = [args.rejects_file, args.rejects_parquet, args.write_normalized, args.metrics_file]
+    watcher = FolderWatcher(settings.inputs, exclude={os.path.abspath(p) for p in outputs if p})
+    cache = WriteCache()
+    sb = None
+    if args.backend == "rest":
+        sb = SupabaseClient(settings.supabase_url, settings.supabase_key, dry_run=settings.dry_run,
+                            logger=logger, concurrency=settings.concurrency)
+
+    logger.info("A vigiar %s a cada %gs (Ctrl+C para parar)", ", ".join(settings.inputs), args.watch_interval)
+    try:
+        while True:
+            ready = watcher.poll()
+            if ready:
+                logger.info("%s ficheiro(s) novo(s) ou alterado(s): %s", len(ready),
+                            ", ".join(os.path.basename(p) for p in ready))
+                try:
+                    run_import(args, settings, logger, ready, sb=sb, cache=cache)
+                except (Exception, SystemExit) as e:
+                    logger.exception("Falha ao importar %s: %s (volta a copiar o ficheiro para tentar outra vez)",
+                                     ", ".join(ready), e)
+                    # o que ficou a meio pode não estar na cache: volta a ler do servidor no próximo ciclo
+                    cache = WriteCache()
+                watcher.mark_done(ready)
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        logger.info("Watch parado")
+    finally:
+        if sb:
+            sb.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    logger = setup_logger()
+
+    if args.watch and args.command != "run":
+        raise SystemExit("--watch só se aplica ao comando run")
+    if args.command == "plan":
+        return run_plan(args, logger)
+    if args.command == "apply":
+        return run_apply(args, logger)
+    if args.command == "reconcile":
+        return run_reconcile(args, logger)
+
+    settings = load_settings(args, backend=args.backend)
+    if args.watch:
+        return run_watch(args, settings, logger)
+    run_import(args, settings, logger, input_files(settings))
+
+
 if __name__ == "__main__":
     main()
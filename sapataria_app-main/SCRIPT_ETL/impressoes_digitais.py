@@ -0,0 +1,78 @@
+"""
+Impressões digitais das linhas do ETL (etl_excel_to_supabase.py) para o modo --delta.
+- Uma impressão digital (sha1) por GTIN, sobre as colunas já normalizadas e o fornecedor
+- Estado da última execução bem-sucedida num JSON, gravado de forma atómica
+- Diferença entre execuções: linhas novas, alteradas, iguais e removidas
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+import pandas as pd
+
+
+DEFAULT_STATE_FILE = "etl_state.json"
+
+# colunas (já normalizadas) que entram na impressão digital
+FINGERPRINT_COLUMNS = ["ref_keyinvoice", "ref_woocomerce", "categoria", "subcategoria",
+                       "marca", "nome", "cor", "tamanho", "gtin"]
+
+
+@dataclass
+class Delta:
+    added: set
+    changed: set
+    unchanged: set
+    removed: set
+
+
+def sheet_fingerprints(df: pd.DataFrame, supplier: str) -> Dict[str, str]:
+    """
+    Impressão digital (sha1) de cada linha normalizada, por GTIN.
+    O fornecedor entra na conta porque também vai para o modelo. GTIN repetido: vale a última linha.
+    """
+    fingerprints: Dict[str, str] = {}
+    cols = [df[c].tolist() for c in FINGERPRINT_COLUMNS]
+    for values in zip(*cols):
+        gtin = values[-1]
+        if not gtin:
+            continue
+        raw = "\x1f".join("" if v is None else str(v) for v in (*values, supplier))
+        fingerprints[gtin] = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def load_state(path: str) -> Dict[str, str]:
+    """Lê {gtin: impressão digital} da última execução bem-sucedida (vazio se não houver)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("rows", {})
+
+
+def save_state(path: str, rows: Dict[str, str]) -> None:
+    """Grava o estado de forma atómica (ficheiro temporário + rename)"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "rows": rows}, f)
+    os.replace(tmp, path)
+
+
+def fingerprints_signature(fingerprints: Dict[str, str]) -> str:
+    """Assinatura (sha1) do conjunto de linhas: identifica a folha nos checkpoints e nos planos"""
+    return hashlib.sha1(json.dumps(sorted(fingerprints.items())).encode("utf-8")).hexdigest()
+
+
+def compute_delta(current: Dict[str, str], previous: Dict[str, str]) -> Delta:
+    added, changed, unchanged = set(), set(), set()
+    for gtin, fp in current.items():
+        if gtin not in previous:
+            added.add(gtin)
+        elif previous[gtin] != fp:
+            changed.add(gtin)
+        else:
+            unchanged.add(gtin)
+    return Delta(added, changed, unchanged, set(previous) - set(current))
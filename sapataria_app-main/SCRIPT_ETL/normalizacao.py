@@ -0,0 +1,154 @@
+"""
+Normalização das folhas de produtos, partilhada pelo ETL (etl_excel_to_supabase.py)
+e pelo padronizar_excel.py.
+- Corrige os cabeçalhos (espaços, _x000d_)
+- Remove espaços extras e trata 'nan'/'none'/'null' como vazio
+- Padroniza capitalização (marcas, categorias, subcategorias, cores)
+- Limpa GTINs (só dígitos)
+Tudo vetorizado: cada limpeza corre só sobre os valores distintos de cada coluna.
+"""
+import os
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+# -----------------------------
+# Colunas da folha
+# -----------------------------
+REQUIRED_COLUMNS = [
+    "Ref. Keyinvoice",
+    "Ref. Woocomerce",
+    "Categoria",
+    "Subcategoria",
+    "Marca",
+    "Nome",
+    "Cor",
+    "TAMANHO",
+    "CODIGO DE BARRAS",
+]
+
+COLMAP = {
+    "Ref. Keyinvoice": "ref_keyinvoice",
+    "Ref. Woocomerce": "ref_woocomerce",
+    "Categoria": "categoria",
+    "Subcategoria": "subcategoria",
+    "Marca": "marca",
+    "Nome": "nome",
+    "Cor": "cor",
+    "TAMANHO": "tamanho",
+    "CODIGO DE BARRAS": "gtin",
+}
+
+NULL_TOKENS = ["", "nan", "none", "null"]
+
+# colunas (nomes normalizados) com a primeira letra de cada palavra em maiúscula
+TITLE_COLUMNS = ["categoria", "subcategoria", "marca", "cor"]
+
+# casos especiais: ficam sempre em maiúsculas
+UPPERCASE_EXCEPTIONS = ["SORRISO", "BIANCA", "HÉLIA"]
+
+
+def clean_column_name(name: Any) -> str:
+    """Remove espaços extras e caracteres especiais como _x000d_ dos cabeçalhos"""
+    return str(name).strip().replace('_x000d_', '').replace('_x000D_', '')
+
+
+# -----------------------------
+# Limpeza vetorizada por coluna
+# -----------------------------
+def _map_distinct(col: pd.Series, func) -> pd.Series:
+    """
+    Aplica uma limpeza vetorizada só aos valores distintos e volta a expandir.
+    Colunas como marca/categoria/cor têm poucas dezenas de valores em centenas de milhares de linhas.
+    """
+    codes, uniques = pd.factorize(col)
+    cleaned = func(pd.Series(uniques, dtype="string"))
+    cleaned = np.asarray(cleaned.astype(object).where(cleaned.notna(), None), dtype=object)
+    out = np.full(len(codes), None, dtype=object)
+    present = codes >= 0
+    out[present] = cleaned[codes[present]]
+    return pd.Series(out, index=col.index, dtype=object)
+
+
+def _clean_str_values(s: pd.Series) -> pd.Series:
+    s = s.str.strip()
+    return s.where(~s.str.lower().isin(NULL_TOKENS), None)
+
+
+def _title_values(s: pd.Series) -> pd.Series:
+    s = _clean_str_values(s)
+    upper = s.str.upper()
+    return s.str.title().where(~upper.isin(UPPERCASE_EXCEPTIONS), upper)
+
+
+def _clean_gtin_values(s: pd.Series) -> pd.Series:
+    digits = _clean_str_values(s).str.replace(r"\D", "", regex=True)
+    return digits.where(digits != "", None)
+
+
+def clean_str_series(col: pd.Series) -> pd.Series:
+    """Trim e None para vazio/'nan'/'none'/'null'"""
+    return _map_distinct(col, _clean_str_values)
+
+
+def title_case_series(col: pd.Series) -> pd.Series:
+    """Como clean_str_series e com capitalização padronizada ('bordeaux e branco' -> 'Bordeaux E Branco')"""
+    return _map_distinct(col, _title_values)
+
+
+def clean_gtin_series(col: pd.Series) -> pd.Series:
+    """
+    Mantém só os dígitos (espaços, hífens, Excel em notação científica...).
+    None quando não sobra nenhum dígito.
+    """
+    return _map_distinct(col, _clean_gtin_values)
+
+
+def _normalizer(column: str):
+    if column == "gtin":
+        return clean_gtin_series
+    if column in TITLE_COLUMNS:
+        return title_case_series
+    return clean_str_series
+
+
+# -----------------------------
+# Folhas inteiras
+# -----------------------------
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Normaliza um DataFrame com os nomes de coluna do ETL (valores de COLMAP)"""
+    df = df.copy()
+    for col in df.columns:
+        df[col] = _normalizer(col)(df[col])
+    return df
+
+
+def normalize_sheet(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normaliza uma folha com os cabeçalhos originais: corrige os cabeçalhos,
+    limpa as colunas conhecidas (REQUIRED_COLUMNS) e mantém as restantes como estão.
+    """
+    df = df.copy()
+    df.columns = [clean_column_name(c) for c in df.columns]
+    for original, column in COLMAP.items():
+        if original in df.columns:
+            df[original] = _normalizer(column)(df[original])
+    return df
+
+
+def to_original_headers(df: pd.DataFrame) -> pd.DataFrame:
+    """Volta aos cabeçalhos da folha, para o ficheiro normalizado poder ser lido outra vez pelo ETL"""
+    return df.rename(columns={v: k for k, v in COLMAP.items()})
+
+
+def write_frame(df: pd.DataFrame, path: str, sheet_name: str = "Folha1") -> None:
+    """Grava a folha normalizada; formato pela extensão (.xlsx, .csv ou .parquet)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        df.to_csv(path, index=False, encoding="utf-8")
+    elif ext == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_excel(path, sheet_name=sheet_name, index=False)
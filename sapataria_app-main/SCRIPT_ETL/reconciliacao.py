@@ -0,0 +1,108 @@
+"""
+Reconciliação de stock do ETL (etl_excel_to_supabase.py reconcile): folha de contagem -> só as
+linhas de stock que mudaram.
+- Lê a folha de contagem (GTIN, armazém por nome ou id, quantidade) com cabeçalhos flexíveis
+- Valida as linhas e resolve o armazém, com um código de motivo por linha rejeitada (REJECT_REASONS)
+- Compara com o stock atual e devolve só o que muda
+Sem pedidos à rede: a leitura do stock e a escrita ficam no ETL.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from normalizacao import clean_column_name, clean_gtin_series, clean_str_series
+
+
+DEFAULT_AUDIT_FILE = "etl_reconcile.csv"
+
+# cabeçalhos aceites na folha de contagem (comparados em minúsculas)
+COUNT_COLUMNS = {
+    "gtin": ["gtin", "codigo de barras", "código de barras", "ean"],
+    "warehouse": ["warehouse", "warehouse_id", "armazem", "armazém"],
+    "qty": ["qty", "qtd", "quantidade", "stock", "contagem"],
+}
+
+STOCK_KEY = ["variant_id", "warehouse_id"]
+
+
+def read_count_sheet(path: str) -> pd.DataFrame:
+    """
+    Lê uma folha de contagem (.xlsx/.xls na primeira aba, .csv ou .parquet) com GTIN, armazém
+    (nome ou id) e quantidade. A coluna do armazém pode faltar quando se usa --warehouse.
+    Retorna as colunas gtin, warehouse, qty limpas, ainda por validar.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        df = pd.read_csv(path, dtype=str, encoding="utf-8-sig")
+    elif ext == ".parquet":
+        df = pd.read_parquet(path).astype(object)
+    else:
+        df = pd.read_excel(path, sheet_name=0, dtype=str)
+
+    aliases = {alias: column for column, names in COUNT_COLUMNS.items() for alias in names}
+    df.columns = [aliases.get(clean_column_name(c).lower(), clean_column_name(c)) for c in df.columns]
+    missing = [c for c in ("gtin", "qty") if c not in df.columns]
+    if missing:
+        accepted = {c: COUNT_COLUMNS[c] for c in missing}
+        raise SystemExit(f"Faltam colunas na folha de contagem {path}: {accepted}")
+    return pd.DataFrame({
+        "gtin": clean_gtin_series(df["gtin"]),
+        "warehouse": clean_str_series(df["warehouse"]) if "warehouse" in df.columns else None,
+        "qty": clean_str_series(df["qty"]),
+    }, index=df.index)
+
+
+def validate_counts(
+    df: pd.DataFrame,
+    warehouses: Dict[str, int],
+    default_warehouse: Optional[str] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Valida a folha de contagem e resolve o armazém pelo nome ou pelo id
+    (default_warehouse vale para as linhas sem armazém).
+    Retorna (válidas com warehouse_id e qty inteiros, rejeitadas com a coluna reason_code)
+    """
+    warehouse = df["warehouse"].fillna(default_warehouse) if default_warehouse else df["warehouse"]
+    warehouse_id = warehouse.astype("string").str.lower().map(warehouses)
+    qty = pd.to_numeric(df["qty"], errors="coerce")
+
+    conditions = [
+        df["gtin"].isna(),
+        df["gtin"].str.len() < 8,
+        qty.isna() | (qty < 0) | (qty % 1 != 0),
+        warehouse_id.isna(),
+    ]
+    codes = ["GTIN_MISSING", "GTIN_TOO_SHORT", "QTY_INVALID", "WAREHOUSE_UNKNOWN"]
+    reason = pd.Series(np.select(conditions, codes, default=""), index=df.index)
+
+    ok = reason == ""
+    rejects = df[~ok].copy()
+    rejects.insert(0, "reason_code", reason[~ok])
+    valid = df[ok].assign(warehouse_id=warehouse_id[ok].astype("int64"), qty=qty[ok].astype("int64"))
+    return valid, rejects
+
+
+def diff_stock(counts: pd.DataFrame, current: pd.DataFrame, whole_warehouses: bool = False) -> pd.DataFrame:
+    """
+    Compara a contagem (variant_id, warehouse_id, gtin, qty) com o stock atual.
+    Com whole_warehouses, o que os armazéns contados têm e não foi contado passa a 0.
+    Retorna só as linhas a escrever: gtin, variant_id, warehouse_id, counted (False nas postas a 0),
+    before (NaN se não havia linha), after, diff
+    """
+    merged = counts.merge(current, on=STOCK_KEY, how="outer" if whole_warehouses else "left")
+    after = merged["qty"].fillna(0).astype("int64")
+    before = merged["stock"]
+    # sem linha de stock e contado 0: não há nada a escrever
+    changed = before.ne(after) & ~(before.isna() & after.eq(0))
+    out = pd.DataFrame({
+        "gtin": merged["gtin"],
+        "variant_id": merged["variant_id"],
+        "warehouse_id": merged["warehouse_id"],
+        "counted": merged["qty"].notna(),
+        "before": before,
+        "after": after,
+        "diff": after - before.fillna(0).astype("int64"),
+    })[changed]
+    return out.reset_index(drop=True)
@@ -0,0 +1,77 @@
+"""
+Validação vetorizada das linhas do ETL (etl_excel_to_supabase.py), antes de qualquer pedido à rede.
+- GTIN ausente, curto ou com tamanho fora do padrão
+- Dígito de controlo GS1 de GTIN-8/12/13/14
+- Campos obrigatórios vazios
+Cada linha rejeitada leva um código de motivo (REJECT_REASONS). A limpeza está em normalizacao.py.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# tamanhos de GTIN normalizados (GTIN-8, UPC-A/GTIN-12, EAN-13, GTIN-14)
+GTIN_LENGTHS = {8, 12, 13, 14}
+
+REQUIRED_FIELDS = ["categoria", "subcategoria", "marca", "nome", "cor", "tamanho"]
+
+# código -> mensagem gravada no ficheiro de rejeitos
+REJECT_REASONS = {
+    "GTIN_MISSING": "GTIN ausente (linha ignorada)",
+    "GTIN_TOO_SHORT": "GTIN inválido (menos de 8 dígitos)",
+    "GTIN_LENGTH": "GTIN com tamanho fora do padrão (8/12/13/14 dígitos)",
+    "GTIN_CHECK_DIGIT": "GTIN com dígito de controlo inválido",
+    "REQUIRED_EMPTY": "Campos obrigatórios vazios (categoria/subcategoria/marca/nome/cor/tamanho)",
+    "DB_ERROR": "Erro ao gravar no Supabase",
+    # reconciliação de stock (folha de contagem)
+    "QTY_INVALID": "Quantidade vazia, negativa ou não inteira",
+    "WAREHOUSE_UNKNOWN": "Armazém inexistente (nome ou id)",
+    "GTIN_UNKNOWN": "GTIN sem variante no Supabase",
+}
+
+
+def gtin_check_digit_ok(gtins: pd.Series) -> pd.Series:
+    """
+    Valida o dígito de controlo GS1 de GTIN-8/12/13/14 (o resto fica False).
+    Preenche com zeros à esquerda até 14 dígitos e calcula tudo numa única operação numpy.
+    """
+    result = pd.Series(False, index=gtins.index)
+    lengths = gtins.str.len()
+    eligible = gtins.notna() & lengths.isin(GTIN_LENGTHS)
+    if not eligible.any():
+        return result
+
+    padded = gtins[eligible].str.zfill(14)
+    digits = np.frombuffer("".join(padded).encode("ascii"), dtype=np.uint8).reshape(-1, 14) - ord("0")
+    weights = np.array([3, 1] * 6 + [3])
+    expected = (10 - (digits[:, :13] @ weights) % 10) % 10
+    result[eligible] = expected == digits[:, 13]
+    return result
+
+
+def validate_frame(df: pd.DataFrame, strict_gtin: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Separa as linhas válidas das rejeitadas, com um código de motivo por linha.
+    GTIN-8/12/13/14 têm de ter dígito de controlo válido; outros tamanhos (>= 8)
+    só são rejeitados com strict_gtin, porque a folha atual tem códigos internos de 16/17 dígitos.
+    Retorna (válidas, rejeitadas com a coluna reason_code)
+    """
+    gtin = df["gtin"]
+    lengths = gtin.str.len()
+    standard = lengths.isin(GTIN_LENGTHS)
+
+    conditions = [
+        gtin.isna(),
+        lengths < 8,
+        ~standard if strict_gtin else pd.Series(False, index=df.index),
+        standard & ~gtin_check_digit_ok(gtin),
+        df[REQUIRED_FIELDS].isna().any(axis=1),
+    ]
+    codes = ["GTIN_MISSING", "GTIN_TOO_SHORT", "GTIN_LENGTH", "GTIN_CHECK_DIGIT", "REQUIRED_EMPTY"]
+    reason = pd.Series(np.select(conditions, codes, default=""), index=df.index)
+
+    ok = reason == ""
+    rejects = df[~ok].copy()
+    rejects.insert(0, "reason_code", reason[~ok])
+    return df[ok], rejects
@@ -0,0 +1,359 @@
+"""
+Benchmarks dos caminhos críticos, ponta a ponta, contra o backend local (fake_postgrest.py).
+
+Cada caso corre o código real (views do Django, webhook da API, ETL) sobre um catálogo sintético
+(gerar_catalogo.py),
+com uma latência por pedido configurável para os números refletirem as idas e voltas ao Supabase:
+  - search_stock_summary   pesquisa por modelo na página Ver (resultados + resumo de stock)
+  - variant_full_view      detalhe de uma variante (vista completa + auditoria)
+  - warehouse_load         carregar um armazém grande (50k linhas)
+  - bulk_update            atualização em massa de 1k códigos
+  - webhook_order          encomenda do WooCommerce com 20 linhas
+  - etl_import             ETL de 10k linhas (CSV) para uma base vazia
+  - xlsx_export            exportar um armazém para Excel
+
+Grava os resultados em JSON (mediana/min/max por caso e nº de pedidos ao backend) e, com --baseline,
+compara com uma execução anterior e falha (exit 1) se algum caso ficar mais lento que a tolerância
+ou fizer mais pedidos.
+
+Uso (a partir de sapataria_app-main/):
+    python benchmarks/hot_paths.py --output antes.json
+    python benchmarks/hot_paths.py --baseline antes.json --output depois.json
+    python benchmarks/hot_paths.py --latency-ms 30 --only search_stock_summary,webhook_order
+    python benchmarks/hot_paths.py --scale 0.1 --repeat 1          # versão rápida (tamanhos / 10)
+
+Com os tamanhos por defeito cada repetição demora 1-2 minutos (o bulk_update faz ~4k pedidos).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATALOG_URL = "fake://:memory:bench"
+
+# Tamanhos por defeito (--scale multiplica-os)
+SIZES = {
+    "warehouse_rows": 50_000,   # variantes com stock no armazém grande
+    "export_rows": 5_000,       # variantes com stock na loja (o armazém exportado)
+    "bulk_codes": 1_000,
+    "order_lines": 20,
+    "etl_rows": 10_000,
+}
+
+DEFAULT_LATENCY_MS = 5.0
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.20
+
+# Antes de importar db/Django: tudo aponta para o backend local
+os.environ["SUPABASE_URL"] = CATALOG_URL
+os.environ.setdefault("SUPABASE_KEY", "fake")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sapataria_web.settings")
+os.environ.setdefault("DJANGO_DEBUG", "0")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, "webapp"))
+
+import fake_postgrest  # noqa: E402
+from gerar_catalogo import CatalogSpec, generate, seed_fake, sheet_rows, write_sheet  # noqa: E402
+
+
+# -----------------------------
+# Catálogo sintético (gerar_catalogo.py)
+# -----------------------------
+def seed_catalog(server, sizes, repeat):
+    """Grava o catálogo no backend (sem latência). Retorna os ids/códigos usados nos casos"""
+    spec = CatalogSpec(
+        variants=sizes["warehouse_rows"],
+        seed=1,
+        # a loja (id 1, o armazém das vendas online) só tem parte do catálogo: é o armazém exportado
+        warehouses={"Loja": sizes["export_rows"] / sizes["warehouse_rows"], "Armazem": 1.0},
+    )
+    catalog = generate(spec)
+    seeded = seed_fake(catalog, server)
+    variant_ids = seeded["variant_ids"]
+    # linhas da encomenda: variantes com stock na loja para todas as repetições
+    sellable = [catalog.variants[i]["gtin"] for (i, warehouse), quantity in catalog.stock.items()
+                if warehouse == "Loja" and quantity >= repeat]
+    return {
+        "warehouses": seeded["warehouses"],
+        "model": catalog.models[0]["nome_modelo"],
+        "variant_id": variant_ids[0],
+        "gtins": [v["gtin"] for v in catalog.variants],
+        "order_gtins": sellable[:sizes["order_lines"]],
+    }
+
+
+# -----------------------------
+# Casos
+# -----------------------------
+def django_client(server):
+    """Cliente de testes do Django já com sessão iniciada"""
+    import django
+
+    django.setup()
+    from django.test import Client
+
+    from db import DB
+    from services import AuthService
+
+    username = "benchmark"
+    if not server.count("profiles"):
+        AuthService(DB()).create_user(username, "Benchmark", None, username)
+    client = Client()
+    response = client.post("/login/", {"username": username, "password": username})
+    if response.status_code != 302:
+        raise RuntimeError("login no Django falhou")
+    return client
+
+
+def post(client, path, data, expect_excel=False):
+    response = client.post(path, data)
+    if response.status_code != 200:
+        raise RuntimeError(f"POST {path} -> HTTP {response.status_code}")
+    if expect_excel and "spreadsheetml" not in response.get("Content-Type", ""):
+        raise RuntimeError(f"POST {path} não devolveu um Excel")
+    return response
+
+
+def webhook_driver():
+    """
+    Envia a encomenda pelo endpoint real (TestClient do FastAPI) quando o FastAPI está instalado;
+    senão corre o mesmo ciclo do endpoint sobre o ProductService. Retorna (nome, função(payload))
+    """
+    try:
+        from fastapi.testclient import TestClient
+    except ImportError:
+        from db import DB
+        from services import ProductService
+
+        service = ProductService(DB())
+
+        def send(order):
+            for item in order["line_items"]:
+                ok, message = service.sell_from_woocommerce(item["sku"], item["quantity"])
+                if not ok:
+                    raise RuntimeError(message)
+        return "service", send
+
+    sys.path.insert(0, os.path.join(APP_DIR, "API"))
+    import main as api
+
+    client = TestClient(api.app)
+
+    def send(order):
+        response = client.post("/venda/woocommerce", json=order)
+        if response.status_code != 200 or not response.json().get("ok"):
+            raise RuntimeError(f"webhook -> HTTP {response.status_code}: {response.text[:200]}")
+    return "fastapi", send
+
+
+def woocommerce_order(gtins):
+    return {
+        "id": 1,
+        "status": "processing",
+        "date_created": datetime.now(timezone.utc).isoformat(),
+        "line_items": [
+            {"id": i + 1, "name": f"Produto {i}", "product_id": i + 1, "quantity": 1, "sku": gtin, "meta_data": []}
+            for i, gtin in enumerate(gtins)
+        ],
+    }
+
+
+def etl_runner(sizes, workdir):
+    """ETL real (etl_excel_to_supabase.main) sobre um CSV gerado, para uma base nova em cada execução"""
+    sys.path.insert(0, os.path.join(APP_DIR, "SCRIPT_ETL"))
+    import etl_excel_to_supabase as etl
+
+    # outro catálogo (outra semente, outros GTINs), para uma base vazia: o ETL cria tudo de raiz
+    path = os.path.join(workdir, "etl_input.csv")
+    write_sheet(sheet_rows(generate(CatalogSpec(variants=sizes["etl_rows"], seed=2))), path)
+
+    runs = iter(range(1_000_000))
+
+    def prepare():
+        url = f"fake://:memory:etl{next(runs)}"
+        target = fake_postgrest.get_server(url)
+        target.latency = fake_postgrest.get_server(CATALOG_URL).latency
+        target.seed("warehouses", [{"name": "Loja"}, {"name": "Armazem"}])
+        return url, target
+
+    def run(url):
+        env = {"SUPABASE_URL": url, "DRY_RUN": "false"}
+        previous = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                etl.main(["--input", path, "--workers", "1"])
+        finally:
+            os.chdir(cwd)
+            for k, v in previous.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            logger = etl.logging.getLogger("etl")
+            for handler in logger.handlers:
+                handler.close()
+            logger.handlers.clear()
+
+    return prepare, run
+
+
+def build_cases(server, seeded, sizes, workdir):
+    """{nome: (preparar, correr, servidor)}; preparar() corre fora do tempo medido e devolve o argumento de correr"""
+    client = django_client(server)
+    warehouses = seeded["warehouses"]
+    gtins = seeded["gtins"]
+    driver, send_order = webhook_driver()
+    prepare_etl, run_etl = etl_runner(sizes, workdir)
+    order = woocommerce_order(seeded["order_gtins"])
+
+    cases = {
+        "search_stock_summary": (None, lambda _: post(client, "/view/", {
+            "action": "search", "search_type": "modelo", "search_value": seeded["model"]}), server),
+        "variant_full_view": (None, lambda _: post(client, "/view/", {
+            "action": "details", "variant_id": seeded["variant_id"]}), server),
+        "warehouse_load": (None, lambda _: post(client, "/warehouse/", {
+            "action": "load", "warehouse_id": warehouses["Armazem"]}), server),
+        "bulk_update": (None, lambda _: post(client, "/bulk-update/", {
+            "action": "process", "operation": "add", "quantity": 1, "search_type": "gtin",
+            "warehouse_id": warehouses["Armazem"], "codes": "\n".join(gtins[:sizes["bulk_codes"]])}), server),
+        "webhook_order": (None, lambda _: send_order(order), server),
+        "etl_import": (prepare_etl, run_etl, None),
+        "xlsx_export": (None, lambda _: post(client, "/warehouse/", {
+            "action": "export", "warehouse_id": warehouses["Loja"]}, expect_excel=True), server),
+    }
+    return cases, {"webhook_order": driver}
+
+
+def run_case(prepare, run, server, repeat):
+    """Retorna (tempos em s, pedidos ao backend por execução)"""
+    times, requests = [], []
+    for _ in range(repeat):
+        arg, target = None, server
+        if prepare is not None:
+            arg, target = prepare()
+        before = sum(target.calls.values())
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+        requests.append(sum(target.calls.values()) - before)
+        if prepare is not None:
+            fake_postgrest.close_server(arg)
+    return times, requests
+
+
+# -----------------------------
+# Resultados
+# -----------------------------
+def git_commit():
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True)
+        return proc.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Lista de regressões face a uma execução anterior"""
+    if baseline.get("params") != results["params"]:
+        return [f"baseline com parâmetros diferentes: {baseline.get('params')} vs {results['params']}"]
+    failures = []
+    for name, current in results["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if not before:
+            continue
+        limit = before["median_s"] * (1 + tolerance)
+        if current["median_s"] > limit:
+            failures.append(f"{name}: mediana {current['median_s']:.3f}s > {before['median_s']:.3f}s "
+                            f"+{tolerance:.0%}")
+        if current["requests"] > before["requests"]:
+            failures.append(f"{name}: {current['requests']} pedidos ao backend (antes {before['requests']})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede os caminhos críticos contra o backend local")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS,
+                        help=f"latência por pedido ao backend (default: {DEFAULT_LATENCY_MS:g})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"execuções por caso (usa a mediana; default: {DEFAULT_REPEAT})")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplica os tamanhos do catálogo e dos casos")
+    parser.add_argument("--only", default=None, help="casos a correr, separados por vírgulas")
+    parser.add_argument("--output", default=None, help="grava os resultados em JSON neste ficheiro")
+    parser.add_argument("--baseline", default=None, help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"abrandamento máximo face à baseline (default: {DEFAULT_TOLERANCE * 100:g} %%)")
+    args = parser.parse_args()
+
+    sizes = {k: max(1, int(v * args.scale)) for k, v in SIZES.items()}
+    server = fake_postgrest.get_server(CATALOG_URL)
+
+    print(f"A preparar o catálogo ({sizes['warehouse_rows']} variantes)...")
+    start = time.perf_counter()
+    seeded = seed_catalog(server, sizes, max(1, args.repeat))
+    print(f"  pronto em {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory(prefix="sapataria-bench-") as workdir:
+        cases, drivers = build_cases(server, seeded, sizes, workdir)
+        selected = args.only.split(",") if args.only else list(cases)
+        unknown = [name for name in selected if name not in cases]
+        if unknown:
+            raise SystemExit(f"Casos desconhecidos: {', '.join(unknown)} (disponíveis: {', '.join(cases)})")
+
+        # só a partir daqui os pedidos pagam latência
+        server.latency = args.latency_ms / 1000
+        results = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {"latency_ms": args.latency_ms, "sizes": sizes},
+            "cases": {},
+        }
+        print(f"\nLatência {args.latency_ms:g} ms por pedido, {args.repeat} execução(ões) por caso:")
+        for name in selected:
+            prepare, run, target = cases[name]
+            times, requests = run_case(prepare, run, target, max(1, args.repeat))
+            results["cases"][name] = {
+                "median_s": round(statistics.median(times), 4),
+                "min_s": round(min(times), 4),
+                "max_s": round(max(times), 4),
+                "runs": [round(t, 4) for t in times],
+                "requests": max(requests),
+                **({"driver": drivers[name]} if name in drivers else {}),
+            }
+            r = results["cases"][name]
+            print(f"  {name:22} mediana {r['median_s']:8.3f}s  (min {r['min_s']:.3f} / max {r['max_s']:.3f})"
+                  f"  {r['requests']:6} pedidos")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = compare(results, json.load(f), args.tolerance)
+        if failures:
+            print("\nFALHOU:")
+            for failure in failures:
+                print(f"  - {failure}")
+            sys.exit(1)
+        print("\nOK (sem regressões face à baseline)")
+
+
+if __name__ == "__main__":
+    main()
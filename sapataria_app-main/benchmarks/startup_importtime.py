@@ -0,0 +1,110 @@
+"""
+Benchmark de arranque da aplicação desktop.
+
+Corre `python -X importtime -c "import <módulo>"` num processo limpo (várias vezes),
+mostra o tempo total de import e os módulos mais pesados, e falha (exit 1) se:
+  - o tempo mediano ultrapassar o orçamento (--budget-ms), ou
+  - algum módulo pesado (SDK do supabase, openpyxl, bcrypt) for importado no arranque.
+
+Uso (a partir de sapataria_app-main/):
+    python benchmarks/startup_importtime.py
+    python benchmarks/startup_importtime.py --module ui_tk --runs 7 --budget-ms 300
+    python benchmarks/startup_importtime.py --output startup.json   # resultados em JSON (como hot_paths.py)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Só devem ser importados quando forem precisos (ligação, login, exportar/importar Excel)
+LAZY_MODULES = ("supabase", "postgrest", "httpx", "openpyxl", "bcrypt")
+
+DEFAULT_BUDGET_MS = 250
+
+
+def measure(module):
+    """
+    Importa o módulo num interpretador novo com -X importtime.
+    Retorna (total_us, {módulo: cumulativo_us})
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}:\n{proc.stderr[-2000:]}")
+
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, self_us, cum_us, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        cumulative[name] = int(cum_us)
+
+    if module not in cumulative:
+        raise RuntimeError(f"{module} não aparece no output de -X importtime (já estava em cache?)")
+    return cumulative[module], cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de import no arranque da app")
+    parser.add_argument("--module", default="ui.main", help="módulo de entrada (default: ui.main)")
+    parser.add_argument("--runs", type=int, default=5, help="número de medições (usa a mediana)")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"tempo máximo aceitável em ms (default: {DEFAULT_BUDGET_MS})")
+    parser.add_argument("--top", type=int, default=15, help="quantos módulos mais pesados mostrar")
+    parser.add_argument("--output", default=None, help="grava os resultados em JSON neste ficheiro")
+    args = parser.parse_args()
+
+    totals = []
+    last = {}
+    for _ in range(max(1, args.runs)):
+        total_us, last = measure(args.module)
+        totals.append(total_us)
+
+    median_ms = statistics.median(totals) / 1000
+    print(f"import {args.module}: mediana {median_ms:.1f} ms "
+          f"(min {min(totals) / 1000:.1f} / max {max(totals) / 1000:.1f} ms, {len(totals)} execuções)")
+
+    print("\nMódulos mais pesados (cumulativo, última execução):")
+    for name, us in sorted(last.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = sorted(name for name in last if name.split(".")[0] in LAZY_MODULES)
+    if eager:
+        roots = sorted({name.split(".")[0] for name in eager})
+        failures.append(f"módulos que deviam ser importados só quando precisos: {', '.join(roots)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"mediana {median_ms:.1f} ms acima do orçamento de {args.budget_ms:.0f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "module": args.module,
+                "median_ms": round(median_ms, 1),
+                "min_ms": round(min(totals) / 1000, 1),
+                "max_ms": round(max(totals) / 1000, 1),
+                "runs": len(totals),
+                "budget_ms": args.budget_ms,
+                "eager_modules": sorted({name.split(".")[0] for name in eager}),
+                "failures": failures,
+            }, f, ensure_ascii=False, indent=2)
+
+    if failures:
+        print("\nFALHOU:")
+        for f in failures:
+            print(f"  - {f}")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+from db import DB
+
+# Campos pesquisáveis por prefixo: tipo de pesquisa -> chave na variante
+PREFIX_FIELDS = {
+    "gtin": "gtin",
+    "ref_keyinvoice": "ref_keyinvoice",
+    "ref_woocommerce": "ref_woocomerce",
+}
+
+
+def normalize(text):
+    """Minúsculas e sem acentos, para comparar 'HÈLIA' com 'hélia'"""
+    text = unicodedata.normalize("NFKD", str(text).strip().lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return [t for t in normalize(text).replace("-", " ").replace("/", " ").split() if t]
+
+
+class CatalogIndex:
+    """
+    Índice local do catálogo, mantido em memória.
+    Pré-carregado uma vez e depois atualizado incrementalmente via updated_at,
+    responde a pesquisas por GTIN/referências (prefixo) e por palavras do nome do modelo
+    sem ir à rede.
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+        self._by_gtin = {}
+        self._by_id = {}
+        # tipo de pesquisa -> lista ordenada de (chave normalizada, variant_id)
+        self._sorted = {field: [] for field in PREFIX_FIELDS}
+        # palavra do nome do modelo -> {variant_id}
+        self._tokens = {}
+        self._sorted_tokens = []
+        self._last_updated = None
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def refresh(self):
+        """
+        Carrega o catálogo (1ª vez) ou só as variantes alteradas desde o último refresh.
+        Pode correr numa thread de fundo. Retorna o número de variantes recebidas.
+        """
+        rows = self.db.list_variant_index(updated_since=self._last_updated)
+        with self._lock:
+            for entry in rows:
+                self._put(entry)
+            if rows or not self.loaded:
+                self._rebuild()
+            stamps = [r["updated_at"] for r in rows if r.get("updated_at")]
+            if stamps:
+                self._last_updated = max([self._last_updated or ""] + stamps)
+            self.loaded = True
+        return len(rows)
+
+    def add(self, entry):
+        """Adiciona/atualiza uma variante (ex.: encontrada no servidor fora do índice)"""
+        with self._lock:
+            self._put(entry)
+            for search_type, field in PREFIX_FIELDS.items():
+                if entry.get(field):
+                    insort(self._sorted[search_type], (normalize(entry[field]), entry["variant_id"]))
+            for token in tokenize(entry.get("nome_modelo") or ""):
+                if token not in self._tokens:
+                    insort(self._sorted_tokens, token)
+                self._tokens.setdefault(token, set()).add(entry["variant_id"])
+
+    def _put(self, entry):
+        old = self._by_id.get(entry["variant_id"])
+        if old and old.get("gtin") and old["gtin"] != entry.get("gtin"):
+            self._by_gtin.pop(old["gtin"], None)
+        self._by_id[entry["variant_id"]] = entry
+        if entry.get("gtin"):
+            self._by_gtin[str(entry["gtin"]).strip()] = entry
+
+    def _rebuild(self):
+        """Reconstrói as listas ordenadas e o índice de palavras (O(n log n), fora da thread do Tk)"""
+        sorted_lists = {search_type: [] for search_type in PREFIX_FIELDS}
+        tokens = {}
+        for vid, entry in self._by_id.items():
+            for search_type, field in PREFIX_FIELDS.items():
+                if entry.get(field):
+                    sorted_lists[search_type].append((normalize(entry[field]), vid))
+            for token in tokenize(entry.get("nome_modelo") or ""):
+                tokens.setdefault(token, set()).add(vid)
+        for lst in sorted_lists.values():
+            lst.sort()
+        self._sorted = sorted_lists
+        self._tokens = tokens
+        self._sorted_tokens = sorted(tokens)
+
+    def lookup_gtin(self, gtin):
+        """Procura uma variante por GTIN exato (sem rede). Retorna dict ou None"""
+        return self._by_gtin.get(str(gtin).strip())
+
+    def get(self, variant_id):
+        """Obtém a variante por ID (sem rede)"""
+        return self._by_id.get(variant_id)
+
+    # ------------------------------------------
+    # Pesquisa incremental
+    # ------------------------------------------
+
+    def search(self, text, search_type="gtin", limit=50, exact=False):
+        """
+        Pesquisa por prefixo (gtin/ref_keyinvoice/ref_woocommerce; exact=True só o código completo) ou por
+        palavras do nome do modelo (search_type="modelo", todas as palavras por prefixo).
+        Retorna lista de variantes no formato de DB.search_variants.
+        """
+        if search_type == "modelo":
+            return self._search_tokens(text, limit)
+        return self._search_prefix(text, search_type, limit, exact)
+
+    def _search_prefix(self, text, search_type, limit, exact=False):
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        field = PREFIX_FIELDS[search_type]
+        lst = self._sorted[search_type]
+        results = []
+        seen = set()
+        i = bisect_left(lst, (prefix,))
+        while i < len(lst) and lst[i][0].startswith(prefix) and len(results) < limit:
+            vid = lst[i][1]
+            entry = self._by_id.get(vid)
+            # ignora chaves antigas de variantes alteradas desde o último rebuild
+            value = normalize(entry.get(field) or "") if entry else ""
+            if vid not in seen and entry and (value == prefix if exact else value.startswith(prefix)):
+                seen.add(vid)
+                results.append(entry)
+            i += 1
+        return results
+
+    def _token_matches(self, term):
+        ids = set()
+        i = bisect_left(self._sorted_tokens, term)
+        while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(term):
+            ids |= self._tokens[self._sorted_tokens[i]]
+            i += 1
+        return ids
+
+    def _search_tokens(self, text, limit):
+        terms = tokenize(text)
+        if not terms:
+            return []
+        matches = None
+        # termos mais longos primeiro: conjuntos menores, interseção mais barata
+        for term in sorted(terms, key=len, reverse=True):
+            ids = self._token_matches(term)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        entries = (self._by_id[vid] for vid in matches if vid in self._by_id)
+        return heapq.nsmallest(
+            limit, entries,
+            key=lambda e: (e.get("nome_modelo") or "", str(e.get("cor") or ""), str(e.get("tamanho") or "")),
+        )
@@ -2,6 +2,8 @@
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 
+from gerar_catalogo import CatalogSpec, generate
+
 # Criar workbook
 wb = Workbook()
 ws = wb.active
@@ -19,13 +21,11 @@ for cell in ws[1]:
     cell.font = header_font
     cell.alignment = Alignment(horizontal="center", vertical="center")
 
-# Dados de exemplo (você pode substituir pelos GTINs reais)
+# Dados de exemplo (você pode substituir pelos GTINs reais): GTINs válidos do gerador de catálogos
+catalog = generate(CatalogSpec(variants=5))
 example_data = [
-    ["1234567890123", "Modelo A", "Exemplo 1"],
-    ["9876543210987", "Modelo B", "Exemplo 2"],
-    ["5555555555555", "Modelo C", "Exemplo 3"],
-    ["1111111111111", "Modelo D", "Exemplo 4"],
-    ["2222222222222", "Modelo E", "Exemplo 5"],
+    [v["gtin"], catalog.models[v["model"]]["nome_modelo"], f"Exemplo {i}"]
+    for i, v in enumerate(catalog.variants, start=1)
 ]
 
 for row_data in example_data:
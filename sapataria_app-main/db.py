@@ -1,7 +1,11 @@
 import os
+import re
+import sys
 import json
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+import tracing
 
 # Carrega as variáveis do arquivo .env
 load_dotenv()
@@ -23,12 +27,52 @@ DOMAIN_TABLES = {
     "suppliers": ("id", "name"),
 }
 
+# Tamanho de página para leituras completas (limite por defeito do PostgREST é 1000)
+PAGE_SIZE = 1000
+
+# Tracing dos pedidos (DB_TRACE=log,ring,jsonl:<ficheiro>,otel; ver tracing.py)
+tracing.configure_from_env()
+
+
+def escape_like(value):
+    """Escapa os carateres especiais de um padrão like/ilike (\\, %, _) e a vírgula, que o PostgREST separa"""
+    return re.sub(r'([\\%_,])', r'\\\1', value)
+
 
 class DB:
     """Camada de acesso ao banco de dados Supabase"""
     
-    def __init__(self):
-        self.supabase = create_client(url, key)
+    def __init__(self, client=None):
+        # o cliente (e o SDK do supabase) só é criado no primeiro acesso ou em warm_up();
+        # client permite injetar outro (ex.: fake_postgrest.create_client() em testes)
+        self._supabase = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            with self._client_lock:
+                if self._supabase is None:
+                    if url and url.startswith("fake://"):
+                        # backend local em SQLite (fake_postgrest.py), sem projeto Supabase
+                        from fake_postgrest import create_client
+
+                        self._supabase = create_client(url)
+                    else:
+                        from supabase import create_client
+
+                        self._supabase = create_client(url, key)
+        if tracing.tracer.enabled:
+            # cada pedido fica registado em nome de quem o fez (ex.: search_variants, ou a view do Django)
+            return tracing.tracer.wrap(self._supabase, sys._getframe(1).f_code.co_name)
+        return self._supabase
+
+    def warm_up(self):
+        """
+        Cria o cliente e abre a ligação HTTP com um pedido mínimo.
+        Pensado para correr numa thread enquanto o utilizador escreve as credenciais.
+        """
+        self.supabase.table('warehouses').select('id').limit(1).execute()
 
     def init_app_tables(self):
         """
@@ -65,9 +109,10 @@ class DB:
     # AUDIT
     # ==========================================
     
-    def audit(self, user, action, entity, entity_pk=None, details=None):
-        """Registra log de auditoria"""
-        data = {
+    @staticmethod
+    def audit_row(user, action, entity, entity_pk=None, details=None):
+        """Linha de audit_logs"""
+        return {
             'user_id': user.get("user_id") if user else None,
             'username': user.get("username") if user else None,
             'action': action,
@@ -75,7 +120,19 @@ class DB:
             'entity_pk': entity_pk,
             'details': json.dumps(details or {})
         }
-        self.supabase.table('audit_logs').insert(data).execute()
+
+    def audit(self, user, action, entity, entity_pk=None, details=None):
+        """Registra log de auditoria"""
+        self.supabase.table('audit_logs').insert(self.audit_row(user, action, entity, entity_pk, details)).execute()
+
+    def audit_batch(self, user, entries):
+        """
+        Registra vários logs de auditoria num só insert.
+        entries: [{'action', 'entity', 'entity_pk', 'details'}]
+        """
+        if not entries:
+            return
+        self.supabase.table('audit_logs').insert([self.audit_row(user, **e) for e in entries]).execute()
 
     # ==========================================
     # DOMAIN LOADERS
@@ -190,20 +247,28 @@ class DB:
         """Pesquisa variantes por GTIN, ref_keyinvoice ou ref_woocommerce"""
         search_value = str(search_value).strip()
 
-        if search_type == 'gtin':
-            field = 'gtin'
-        elif search_type == 'ref_keyinvoice':
-            field = 'ref_keyinvoice'
-        elif search_type == 'ref_woocommerce':
-            field = 'ref_woocomerce'
+        if search_type == 'modelo':
+            # pesquisa parcial pelo nome do modelo (inner join para filtrar as variantes)
+            resp = self.supabase.table('product_variant').select(
+                'id, gtin, ref_keyinvoice, ref_woocomerce, '
+                'model_id, product_model!inner(nome_modelo), '
+                'colors(name), sizes(value)'
+            ).ilike('product_model.nome_modelo', f'%{escape_like(search_value)}%').limit(PAGE_SIZE).execute()
         else:
-            raise ValueError("search_type inválido")
-
-        resp = self.supabase.table('product_variant').select(
-            'id, gtin, ref_keyinvoice, ref_woocomerce, '
-            'model_id, product_model(nome_modelo), '
-            'colors(name), sizes(value)'
-        ).eq(field, search_value).execute()
+            if search_type == 'gtin':
+                field = 'gtin'
+            elif search_type == 'ref_keyinvoice':
+                field = 'ref_keyinvoice'
+            elif search_type == 'ref_woocommerce':
+                field = 'ref_woocomerce'
+            else:
+                raise ValueError("search_type inválido")
+
+            resp = self.supabase.table('product_variant').select(
+                'id, gtin, ref_keyinvoice, ref_woocomerce, '
+                'model_id, product_model(nome_modelo), '
+                'colors(name), sizes(value)'
+            ).eq(field, search_value).execute()
 
         results = []
         for r in (resp.data or []):
@@ -218,6 +283,60 @@ class DB:
             })
         return results
 
+    def list_rows_since(self, table, columns, updated_since=None, order_cols=('id',)):
+        """
+        Lê uma tabela inteira (paginada) ou só as linhas com updated_at >= updated_since.
+        Usado para sincronizar cópias locais.
+        """
+        results = []
+        start = 0
+        while True:
+            query = self.supabase.table(table).select(columns)
+            if updated_since:
+                query = query.gte('updated_at', updated_since)
+            for col in order_cols:
+                query = query.order(col)
+            rows = query.range(start, start + PAGE_SIZE - 1).execute().data or []
+            results.extend(rows)
+            if len(rows) < PAGE_SIZE:
+                return results
+            start += PAGE_SIZE
+
+    def list_variant_index(self, updated_since=None):
+        """
+        Lista todas as variantes numa projeção reduzida, para índices locais.
+        Com updated_since só devolve as alteradas desde esse instante (refresh incremental).
+        """
+        results = []
+        start = 0
+        while True:
+            query = self.supabase.table('product_variant').select(
+                'id, gtin, ref_keyinvoice, ref_woocomerce, updated_at, '
+                'product_model(nome_modelo, brands(name)), colors(name), sizes(value)'
+            )
+            if updated_since:
+                query = query.gte('updated_at', updated_since)
+            resp = query.order('id').range(start, start + PAGE_SIZE - 1).execute()
+            rows = resp.data or []
+
+            for r in rows:
+                model = r.get("product_model") or {}
+                results.append({
+                    "variant_id": r["id"],
+                    "gtin": r.get("gtin"),
+                    "ref_keyinvoice": r.get("ref_keyinvoice"),
+                    "ref_woocomerce": r.get("ref_woocomerce"),
+                    "nome_modelo": model.get("nome_modelo"),
+                    "marca": (model.get("brands") or {}).get("name"),
+                    "cor": (r.get("colors") or {}).get("name"),
+                    "tamanho": (r.get("sizes") or {}).get("value"),
+                    "updated_at": r.get("updated_at"),
+                })
+
+            if len(rows) < PAGE_SIZE:
+                return results
+            start += PAGE_SIZE
+
     def get_full_view_by_variant_id(self, variant_id):
         """Carrega view completa de uma variante por ID"""
         resp = self.supabase.table('product_variant').select(
@@ -253,12 +372,7 @@ class DB:
             'tamanho': row['sizes']['value'] if row.get('sizes') else None,
         }
 
-        stocks_resp = self.supabase.table('warehouse_stock').select(
-            'stock, warehouses(name)'
-        ).eq('variant_id', row['id']).execute()
-
-        stocks = [{'armazem': s['warehouses']['name'], 'stock': s['stock']} for s in (stocks_resp.data or [])]
-        return header, stocks
+        return header, self.list_variant_stocks(row['id'])
 
     def get_full_view_by_gtin(self, search_value, search_type='gtin'):
         """Carrega view completa de uma variante por código"""
@@ -305,21 +419,68 @@ class DB:
             'tamanho': row['sizes']['value'] if row.get('sizes') else None,
         }
 
-        stocks_response = self.supabase.table('warehouse_stock').select(
-            'stock, warehouses(name)'
-        ).eq('variant_id', row['id']).execute()
-
-        stocks = [
-            {'armazem': s['warehouses']['name'], 'stock': s['stock']}
-            for s in (stocks_response.data or [])
-        ]
-
-        return header, stocks
+        return header, self.list_variant_stocks(row['id'])
 
     # ==========================================
     # WAREHOUSE STOCK
     # ==========================================
     
+    def list_variant_stocks(self, variant_id):
+        """Lista o stock de uma variante em todos os armazéns"""
+        response = self.supabase.table('warehouse_stock').select(
+            'warehouse_id, stock, warehouses(name)'
+        ).eq('variant_id', variant_id).execute()
+        return [
+            {'warehouse_id': s['warehouse_id'], 'armazem': s['warehouses']['name'], 'stock': s['stock']}
+            for s in (response.data or [])
+        ]
+
+    def list_stocks_for_variants(self, variant_ids):
+        """
+        Stock de várias variantes em todos os armazéns, numa só query.
+        Retorna {variant_id: [{'warehouse_id', 'armazem', 'stock'}]}
+        """
+        result = {vid: [] for vid in variant_ids}
+        if not variant_ids:
+            return result
+        response = self.supabase.table('warehouse_stock').select(
+            'variant_id, warehouse_id, stock, warehouses(name)'
+        ).in_('variant_id', list(variant_ids)).execute()
+        for s in (response.data or []):
+            result.setdefault(s['variant_id'], []).append(
+                {'warehouse_id': s['warehouse_id'], 'armazem': s['warehouses']['name'], 'stock': s['stock']}
+            )
+        return result
+
+    def get_stock(self, variant_id, warehouse_id):
+        """Obtém stock atual de uma variante num armazém (0 se não houver registo)"""
+        response = self.supabase.table('warehouse_stock').select('stock').eq(
+            'variant_id', variant_id).eq('warehouse_id', warehouse_id).execute()
+        if response.data:
+            return response.data[0]['stock']
+        return 0
+
+    def list_warehouse_stock(self, warehouse_id):
+        """Lista todas as variantes com stock num armazém, ordenadas por GTIN"""
+        response = self.supabase.table('warehouse_stock').select(
+            'stock, product_variant(id, gtin, product_model(nome_modelo, brands(name)), colors(name), sizes(value))'
+        ).eq('warehouse_id', warehouse_id).order('product_variant(gtin)').execute()
+
+        rows = []
+        for r in (response.data or []):
+            variant = r['product_variant']
+            model = variant.get('product_model') or {}
+            rows.append({
+                'variant_id': variant['id'],
+                'gtin': variant.get('gtin'),
+                'nome_modelo': model.get('nome_modelo'),
+                'marca': (model.get('brands') or {}).get('name'),
+                'cor': (variant.get('colors') or {}).get('name'),
+                'tamanho': (variant.get('sizes') or {}).get('value'),
+                'stock': r['stock'],
+            })
+        return rows
+
     def upsert_stock(self, variant_id, warehouse_id, stock):
         """Cria ou atualiza stock"""
         data = {
@@ -329,6 +490,114 @@ class DB:
         }
         self.supabase.table('warehouse_stock').upsert(data).execute()
 
+    def adjust_stock(self, variant_id, warehouse_id, delta, key=None):
+        """
+        Soma delta ao stock numa só chamada (função adjust_stock no Postgres).
+        Nunca deixa o stock negativo: se não houver quantidade suficiente, não altera nada.
+        key: chave de idempotência opcional; um movimento com uma chave já aplicada não volta a somar
+        (reenvio depois de um timeout ou de uma resposta perdida).
+        Retorna {'variant_id', 'warehouse_id', 'stock', 'applied'}
+        """
+        params = {
+            'p_variant_id': variant_id,
+            'p_warehouse_id': warehouse_id,
+            'p_delta': int(delta),
+        }
+        if key is not None:
+            params['p_key'] = key
+        try:
+            response = self.supabase.rpc('adjust_stock', params).execute()
+        except Exception as e:
+            # função ainda não criada na base de dados: leitura + upsert (sem idempotência).
+            # DB.* explícito: numa subclasse (OfflineDB) get_stock/upsert_stock são os da cópia local.
+            if getattr(e, 'code', None) != 'PGRST202':
+                raise
+            current = DB.get_stock(self, variant_id, warehouse_id)
+            new_stock = current + int(delta)
+            if new_stock < 0:
+                return {'variant_id': variant_id, 'warehouse_id': warehouse_id, 'stock': current, 'applied': False}
+            DB.upsert_stock(self, variant_id, warehouse_id, new_stock)
+            return {'variant_id': variant_id, 'warehouse_id': warehouse_id, 'stock': new_stock, 'applied': True}
+
+        data = response.data
+        row = data[0] if isinstance(data, list) else data
+        return {
+            'variant_id': variant_id,
+            'warehouse_id': warehouse_id,
+            'stock': row['stock'],
+            'applied': bool(row['applied']),
+        }
+
+    def adjust_stock_batch(self, movements, applied=None):
+        """
+        Vários movimentos numa só chamada e numa só transação (função adjust_stock_batch no Postgres):
+        ou ficam todos gravados ou nenhum. Cada um segue as regras de adjust_stock.
+        movements: [{'variant_id', 'warehouse_id', 'delta', 'key' (opcional)}]
+        applied: lista preenchida com as linhas já gravadas, para quem chama saber o que reenviar
+        se o pedido falhar (vazia, salvo no recurso de um adjust_stock por movimento).
+        Retorna uma linha de adjust_stock por movimento, pela mesma ordem
+        """
+        applied = [] if applied is None else applied
+        if not movements:
+            return applied
+        payload = [
+            {'variant_id': int(m['variant_id']), 'warehouse_id': int(m['warehouse_id']),
+             'delta': int(m['delta']), 'key': m.get('key')}
+            for m in movements
+        ]
+        # ordenados por linha (sort estável: a ordem dos movimentos da mesma linha mantém-se),
+        # para dois lotes em paralelo bloquearem as linhas pela mesma ordem
+        order = sorted(range(len(payload)), key=lambda i: (payload[i]['variant_id'], payload[i]['warehouse_id']))
+        try:
+            response = self.supabase.rpc('adjust_stock_batch', {'p_movements': [payload[i] for i in order]}).execute()
+        except Exception as e:
+            # função ainda não criada na base de dados: um adjust_stock por movimento
+            if getattr(e, 'code', None) != 'PGRST202':
+                raise
+            for m in payload:
+                applied.append(DB.adjust_stock(self, m['variant_id'], m['warehouse_id'], m['delta'], m['key']))
+            return applied
+
+        rows = [None] * len(payload)
+        for i, r in zip(order, response.data or []):
+            rows[i] = {
+                'variant_id': r['variant_id'],
+                'warehouse_id': r['warehouse_id'],
+                'stock': r['stock'],
+                'applied': bool(r['applied']),
+            }
+        applied.extend(rows)
+        return applied
+
+    def adjust_stock_rows(self, movements, applied=None):
+        """
+        Aplica vários deltas de stock num só pedido e numa só transação (adjust_stock_batch).
+        movements: {(variant_id, warehouse_id): delta}
+        applied: dict preenchido com o que ficou gravado, para quem chama saber o que reenviar
+        se o pedido falhar.
+        Retorna {(variant_id, warehouse_id): linha de adjust_stock}
+        """
+        applied = {} if applied is None else applied
+        keys = list(movements)
+        rows = []
+        try:
+            self.adjust_stock_batch(
+                [{'variant_id': vid, 'warehouse_id': wh, 'delta': movements[(vid, wh)]} for vid, wh in keys], rows)
+        finally:
+            applied.update(zip(keys, rows))
+        return applied
+
+    def get_stock_rows(self, variant_ids, warehouse_ids):
+        """
+        Obtém o stock atual de várias variantes/armazéns numa só query.
+        Retorna {(variant_id, warehouse_id): stock}
+        """
+        if not variant_ids or not warehouse_ids:
+            return {}
+        response = self.supabase.table('warehouse_stock').select('variant_id, warehouse_id, stock').in_(
+            'variant_id', list(variant_ids)).in_('warehouse_id', list(warehouse_ids)).execute()
+        return {(r['variant_id'], r['warehouse_id']): r['stock'] for r in (response.data or [])}
+
     def delete_stock_row(self, variant_id, warehouse_id):
         """Apaga stock de um armazém"""
         self.supabase.table('warehouse_stock').delete().eq('variant_id', variant_id).eq('warehouse_id', warehouse_id).execute()
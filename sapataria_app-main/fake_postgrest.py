@@ -0,0 +1,925 @@
+"""
+Backend local compatível com o PostgREST do Supabase, em processo, sobre SQLite.
+
+Implementa o subconjunto da API REST que a app usa (db.py, local_store.py, o ETL, o Django e a API):
+  - GET com select (colunas, *, aliases, embeds por FK nos dois sentidos, !inner), filtros
+    eq/neq/gt/gte/lt/lte/like/ilike/in/is (e not.), filtros em embeds (product_model.nome_modelo=...),
+    order (também por coluna de um embed to-one: product_variant(gtin)), limit/offset e Range
+  - POST (insert), upsert (Prefer: resolution=merge/ignore-duplicates, on_conflict), PATCH, DELETE,
+    com Prefer: return=representation/minimal e count=exact
+  - rpc/adjust_stock, com a mesma lógica da função em query_corrected.txt
+O esquema é lido de query_corrected.txt (tabelas, PK, FK, UNIQUE, CHECK, DEFAULT), por isso os erros
+de integridade saem com os mesmos códigos do Postgres (23505, 23503, 23514, 23502).
+
+Ligar (o resto do código não muda):
+    SUPABASE_URL=fake://:memory:                  # base em memória (por processo; fake://:memory:<nome> para várias)
+    SUPABASE_URL=fake:///tmp/sapataria.sqlite     # ficheiro: partilhado entre processos (Django, uvicorn)
+    FAKE_SUPABASE_LATENCY_MS=30                   # latência por pedido, para benchmarks realistas
+
+DB usa-o através do SDK do supabase (transporte httpx), o ETL através de um adapter do requests.
+Em testes também se pode passar o cliente diretamente: DB(client=fake_postgrest.create_client()).
+Precisa de SQLite >= 3.35 (RETURNING).
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+FAKE_SCHEME = "fake://"
+
+# URL HTTP que os clientes veem; os pedidos nunca saem do processo
+FAKE_HTTP_URL = "http://fake-supabase.local"
+
+# o SDK do supabase só aceita chaves com formato de JWT
+FAKE_KEY = "fake.supabase.key"
+
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_corrected.txt")
+
+REST_PREFIX = "/rest/v1/"
+
+# parâmetros da query string que não são filtros
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')"
+
+# nº máximo de valores num IN (...) (embeds, releituras por rowid)
+IN_CHUNK = 900
+
+
+class PostgRESTError(Exception):
+    """Erro devolvido ao cliente no formato do PostgREST ({code, message, details, hint})"""
+
+    def __init__(self, status: int, code: str, message: str, details: Optional[str] = None,
+                 hint: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.details = details
+        self.hint = hint
+
+    def body(self) -> dict:
+        return {"code": self.code, "message": self.message, "details": self.details, "hint": self.hint}
+
+
+# -----------------------------
+# Esquema (query_corrected.txt -> SQLite)
+# -----------------------------
+@dataclass
+class Column:
+    name: str
+    kind: str        # integer | boolean | json | text
+    ddl: str
+
+
+@dataclass
+class Table:
+    name: str
+    columns: Dict[str, Column]
+    primary_key: List[str]
+    foreign_keys: List[Tuple[str, str, str]]      # (coluna, tabela referida, coluna referida)
+    constraints: List[str] = field(default_factory=list)
+
+    def ddl(self) -> str:
+        parts = [c.ddl for c in self.columns.values()]
+        if len(self.primary_key) > 1:
+            parts.append(f"PRIMARY KEY ({', '.join(_q(c) for c in self.primary_key)})")
+        parts.extend(f"FOREIGN KEY ({_q(c)}) REFERENCES {_q(t)}({_q(rc)})" for c, t, rc in self.foreign_keys)
+        parts.extend(self.constraints)
+        return f"CREATE TABLE IF NOT EXISTS {_q(self.name)} (\n  " + ",\n  ".join(parts) + "\n)"
+
+
+_TABLE_RE = re.compile(r"CREATE TABLE (?:public\.)?(\w+) \((.*?)\n\);", re.S)
+_INDEX_RE = re.compile(r"CREATE (UNIQUE )?INDEX (\w+) ON (?:public\.)?(\w+) \(([^)]*)\);")
+_DEFAULT_RE = re.compile(r"\bDEFAULT\s+(.+?)(?=\s+(?:UNIQUE|NOT NULL|CHECK|PRIMARY KEY|REFERENCES)\b|$)", re.I)
+
+
+def _q(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _column_kind(pg_type: str) -> str:
+    pg_type = pg_type.lower()
+    if pg_type.startswith(("bigint", "integer", "smallint", "int")):
+        return "integer"
+    if pg_type.startswith("boolean"):
+        return "boolean"
+    if pg_type.startswith("json"):
+        return "json"
+    return "text"
+
+
+def _sqlite_default(expr: str) -> str:
+    expr = re.sub(r"::[\w\s]+$", "", expr.strip())
+    if expr.lower() == "now()":
+        return f"({NOW_SQL})"
+    if expr.lower() in ("true", "false"):
+        return "1" if expr.lower() == "true" else "0"
+    return expr
+
+
+def _parse_column(line: str) -> Tuple[Column, bool]:
+    """Converte uma coluna do DDL do Postgres. Retorna (coluna, é chave primária)"""
+    name, rest = line.split(None, 1)
+    kind = _column_kind(rest)
+    upper = rest.upper()
+    primary = "PRIMARY KEY" in upper
+    identity = "AS IDENTITY" in upper
+
+    sqlite_type = {"integer": "INTEGER", "boolean": "INTEGER"}.get(kind, "TEXT")
+    ddl = f"{_q(name)} {sqlite_type}"
+    if primary:
+        ddl += " PRIMARY KEY AUTOINCREMENT" if identity else " PRIMARY KEY"
+    if "NOT NULL" in upper:
+        ddl += " NOT NULL"
+    default = _DEFAULT_RE.search(rest)
+    if default:
+        ddl += f" DEFAULT {_sqlite_default(default.group(1))}"
+    if re.search(r"\bUNIQUE\b", upper):
+        ddl += " UNIQUE"
+    check = re.search(r"\bCHECK\s*(\(.*\))", rest, re.I)
+    if check:
+        ddl += f" CHECK {check.group(1)}"
+    return Column(name, kind, ddl), primary
+
+
+def load_schema(path: str = DEFAULT_SCHEMA) -> Tuple[Dict[str, Table], List[str]]:
+    """Lê as tabelas e os índices do DDL do Supabase. Retorna ({tabela: Table}, [CREATE INDEX em SQLite])"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    tables: Dict[str, Table] = {}
+    for name, body in _TABLE_RE.findall(text):
+        table = Table(name, {}, [], [])
+        for line in body.splitlines():
+            line = line.strip().rstrip(",")
+            if not line or line.startswith("--"):
+                continue
+            if line.upper().startswith("CONSTRAINT"):
+                definition = line.split(None, 2)[2]
+                pk = re.match(r"PRIMARY KEY \(([^)]*)\)", definition, re.I)
+                fk = re.match(r"FOREIGN KEY \((\w+)\) REFERENCES (?:public\.)?(\w+)\((\w+)\)", definition, re.I)
+                if pk:
+                    table.primary_key = [c.strip() for c in pk.group(1).split(",")]
+                elif fk:
+                    table.foreign_keys.append(fk.groups())
+                else:
+                    table.constraints.append(definition)
+                continue
+            column, primary = _parse_column(line)
+            table.columns[column.name] = column
+            if primary:
+                table.primary_key = [column.name]
+        tables[name] = table
+
+    indexes = [
+        f"CREATE {unique or ''}INDEX IF NOT EXISTS {_q(index)} ON {_q(table)} ({columns})"
+        for unique, index, table, columns in _INDEX_RE.findall(text)
+    ]
+    return tables, indexes
+
+
+# -----------------------------
+# select=... e filtros
+# -----------------------------
+@dataclass
+class Embed:
+    key: str                 # nome no resultado (alias ou relação)
+    table: str
+    parent_column: str
+    child_column: str
+    to_one: bool
+    inner: bool
+    items: list              # ("column", chave, coluna) ou ("embed", Embed)
+    filters: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def _split_top(text: str, sep: str = ",") -> List[str]:
+    """Divide por sep fora de parênteses e de aspas"""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_list(value: str) -> List[str]:
+    """in.(a,"b,c",d) -> ['a', 'b,c', 'd']"""
+    if not (value.startswith("(") and value.endswith(")")):
+        raise PostgRESTError(400, "PGRST100", f'"failed to parse filter (in.{value})"')
+    values = []
+    for item in _split_top(value[1:-1]):
+        if len(item) >= 2 and item[0] == item[-1] == '"':
+            item = item[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        values.append(item)
+    return values
+
+
+def _chunks(values: list, size: int = IN_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _like_regex(pattern: str, ignore_case: bool):
+    out = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            # \ torna literal o carater seguinte (ESCAPE por defeito do Postgres)
+            out.append(re.escape(ch))
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch in "%*":
+            out.append(".*")
+        elif ch == "_":
+            out.append(".")
+        else:
+            out.append(re.escape(ch))
+    return re.compile("".join(out), re.S | (re.I if ignore_case else 0))
+
+
+# operador PostgREST -> SQL
+COMPARISONS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class FakePostgREST:
+    """
+    O servidor: recebe pedidos HTTP já decompostos (método, caminho, query, headers, corpo)
+    e responde como o PostgREST. Uma ligação SQLite partilhada, protegida por um lock;
+    a latência injetada é dormida fora do lock, por isso pedidos em paralelo sobrepõem-se
+    como numa rede real.
+    """
+
+    def __init__(self, database: str = ":memory:", schema_path: str = DEFAULT_SCHEMA, latency_ms: float = 0.0):
+        self.database = database
+        self.latency = latency_ms / 1000
+        self.calls: Counter = Counter()
+        self.lock = threading.RLock()
+        self.tables, indexes = load_schema(schema_path)
+
+        self.conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        if database != ":memory:":
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA busy_timeout = 5000")
+        self._patterns: Dict[Tuple[str, bool], Any] = {}
+        self.conn.create_function("pg_like", 3, self._like, deterministic=True)
+        with self.lock:
+            for table in self.tables.values():
+                self.conn.execute(table.ddl())
+            for index in indexes:
+                self.conn.execute(index)
+
+        # funções expostas em /rpc/<nome>
+        self.functions: Dict[str, Callable[[dict], Any]] = {
+            "adjust_stock": self._rpc_adjust_stock,
+            "adjust_stock_batch": self._rpc_adjust_stock_batch,
+        }
+
+    def _like(self, value, pattern, ignore_case) -> bool:
+        if value is None or pattern is None:
+            return False
+        key = (pattern, bool(ignore_case))
+        regex = self._patterns.get(key)
+        if regex is None:
+            regex = self._patterns[key] = _like_regex(pattern, bool(ignore_case))
+        return regex.fullmatch(str(value)) is not None
+
+    # -----------------------------
+    # Entrada HTTP
+    # -----------------------------
+    def request(
+        self,
+        method: str,
+        path: str,
+        query: List[Tuple[str, str]],
+        headers: Dict[str, str],
+        body: bytes = b"",
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Um pedido completo, com a latência configurada. Retorna (status, headers, corpo)"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handle(method, path, query, headers, body)
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: List[Tuple[str, str]],
+        headers: Dict[str, str],
+        body: bytes = b"",
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        method = method.upper()
+        headers = {k.lower(): v for k, v in headers.items()}
+        prefer = dict(
+            item.strip().split("=", 1) for item in headers.get("prefer", "").split(",") if "=" in item
+        )
+        target = path.split(REST_PREFIX, 1)[-1].strip("/")
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            return self._error(PostgRESTError(400, "PGRST102", "Empty or invalid json"))
+
+        with self.lock:
+            self.calls[f"{method} {target}"] += 1
+        try:
+            if target.startswith("rpc/"):
+                if method not in ("POST", "GET"):
+                    raise PostgRESTError(405, "PGRST101", "Only GET and POST verbs are allowed for RPC")
+                args = payload if method == "POST" else dict(query)
+                return self._respond(200, self._rpc(target[4:], args or {}))
+            table = self._table(target)
+            params = query
+            if method == "GET" or method == "HEAD":
+                rows, total = self._get(table, params, headers, prefer)
+                return self._respond(200, rows, total=total, offset=self._offset(params, headers))
+            if method == "POST":
+                rows = self._insert(table, payload, params, prefer)
+            elif method == "PATCH":
+                rows = self._update(table, payload or {}, params)
+            elif method == "DELETE":
+                rows = self._delete(table, params)
+            else:
+                raise PostgRESTError(405, "PGRST117", f"Unsupported HTTP method: {method}")
+        except PostgRESTError as e:
+            return self._error(e)
+
+        if prefer.get("return") != "representation":
+            return self._respond(201 if method == "POST" else 204, None, total=len(rows))
+        return self._respond(201 if method == "POST" else 200, rows, total=len(rows))
+
+    def _respond(self, status: int, data: Any, total: Optional[int] = None, offset: int = 0):
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if isinstance(data, list):
+            shown = f"{offset}-{offset + len(data) - 1}" if data else "*"
+            headers["Content-Range"] = f"{shown}/{'*' if total is None else total}"
+        content = b"" if data is None else json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        return status, headers, content
+
+    def _error(self, error: PostgRESTError):
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        return error.status, headers, json.dumps(error.body(), ensure_ascii=False).encode("utf-8")
+
+    # -----------------------------
+    # Tabelas, colunas e valores
+    # -----------------------------
+    def _table(self, name: str) -> Table:
+        table = self.tables.get(name)
+        if table is None:
+            raise PostgRESTError(404, "PGRST205", f"Could not find the table 'public.{name}' in the schema cache")
+        return table
+
+    def _column(self, table: Table, name: str) -> Column:
+        column = table.columns.get(name)
+        if column is None:
+            raise PostgRESTError(400, "42703", f"column {table.name}.{name} does not exist")
+        return column
+
+    def _to_db(self, table: Table, name: str, value: Any) -> Any:
+        kind = self._column(table, name).kind
+        if value is None:
+            return None
+        if kind == "json":
+            return json.dumps(value, ensure_ascii=False)
+        if kind == "boolean":
+            if isinstance(value, str):
+                return {"true": 1, "false": 0}.get(value.lower(), value)
+            return int(bool(value))
+        if isinstance(value, (dict, list)):
+            raise PostgRESTError(400, "22P02", f'invalid input syntax for column "{name}": {value!r}')
+        return value
+
+    def _from_db(self, table: Table, row: sqlite3.Row) -> dict:
+        out = {}
+        for name in row.keys():
+            value = row[name]
+            column = table.columns.get(name)
+            if value is not None and column is not None:
+                if column.kind == "boolean":
+                    value = bool(value)
+                elif column.kind == "json":
+                    value = json.loads(value)
+            out[name] = value
+        return out
+
+    @contextmanager
+    def _transaction(self):
+        """Uma escrita = uma transação (como cada pedido no PostgREST); erros do SQLite -> códigos do Postgres"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK")
+                raise self._db_error(e) from e
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _db_error(e: sqlite3.Error) -> PostgRESTError:
+        message = str(e)
+        if "UNIQUE constraint failed" in message or "PRIMARY KEY" in message:
+            return PostgRESTError(409, "23505", f"duplicate key value violates unique constraint ({message})")
+        if "FOREIGN KEY constraint failed" in message:
+            return PostgRESTError(409, "23503", "insert or update violates foreign key constraint")
+        if "CHECK constraint failed" in message:
+            return PostgRESTError(400, "23514", f"new row violates check constraint ({message})")
+        if "NOT NULL constraint failed" in message:
+            return PostgRESTError(400, "23502", f"null value violates not-null constraint ({message})")
+        if "ON CONFLICT clause does not match" in message:
+            return PostgRESTError(400, "42P10",
+                                  "there is no unique or exclusion constraint matching the ON CONFLICT specification")
+        return PostgRESTError(400, "PGRST000", message)
+
+    # -----------------------------
+    # select / relações
+    # -----------------------------
+    def _relation(self, parent: Table, name: str, hint: Optional[str]) -> Tuple[str, str, bool, Table]:
+        """Relação por FK entre parent e name: (coluna no pai, coluna no filho, to_one, tabela)"""
+        child = self._table(name)
+        to_one = [(c, rc) for c, t, rc in parent.foreign_keys if t == name and hint in (None, c)]
+        to_many = [(rc, c) for c, t, rc in child.foreign_keys if t == parent.name and hint in (None, c)]
+        if len(to_one) + len(to_many) > 1:
+            raise PostgRESTError(300, "PGRST201",
+                                 f"Could not embed because more than one relationship was found "
+                                 f"for '{parent.name}' and '{name}'")
+        if to_one:
+            return to_one[0][0], to_one[0][1], True, child
+        if to_many:
+            return to_many[0][0], to_many[0][1], False, child
+        raise PostgRESTError(400, "PGRST200",
+                             f"Could not find a relationship between '{parent.name}' and '{name}' in the schema cache")
+
+    def _parse_select(self, table: Table, text: str) -> list:
+        items = []
+        for part in _split_top(text or "*"):
+            if "(" in part:
+                head, inner = part.split("(", 1)
+                inner = inner.rsplit(")", 1)[0]
+                key, _, head = head.rpartition(":") if ":" in head else ("", "", head)
+                name, _, hint = head.partition("!")
+                name = name.strip()
+                inner_join = hint == "inner"
+                fk_hint = hint if hint and hint not in ("inner", "left") else None
+                parent_col, child_col, to_one, child = self._relation(table, name, fk_hint)
+                items.append(("embed", Embed(key.strip() or name, name, parent_col, child_col, to_one,
+                                             inner_join, self._parse_select(child, inner))))
+            elif part == "*":
+                items.extend(("column", c, c) for c in table.columns)
+            else:
+                key, _, column = part.rpartition(":") if ":" in part.split("::")[0] else ("", "", part)
+                column = column.split("::")[0].strip()
+                self._column(table, column)
+                items.append(("column", key.strip() or column, column))
+        return items
+
+    def _embeds(self, items: list) -> Dict[str, Embed]:
+        return {embed.key: embed for kind, *rest in items if kind == "embed" for embed in rest}
+
+    def _condition(self, table: Table, alias: str, column: str, expr: str) -> Tuple[str, list]:
+        """Um filtro coluna=operador.valor em SQL"""
+        negate = expr.startswith("not.")
+        if negate:
+            expr = expr[4:]
+        op, _, value = expr.partition(".")
+        self._column(table, column)
+        ref = f"{alias}.{_q(column)}"
+
+        if op in COMPARISONS:
+            sql, params = f"{ref} {COMPARISONS[op]} ?", [self._to_db(table, column, value)]
+        elif op == "in":
+            values = [self._to_db(table, column, v) for v in _parse_list(value)]
+            sql, params = (f"{ref} IN ({', '.join('?' * len(values))})" if values else "0"), values
+        elif op == "is":
+            checks = {"null": "IS NULL", "true": "= 1", "false": "= 0", "unknown": "IS NULL"}
+            if value.lower() not in checks:
+                raise PostgRESTError(400, "PGRST100", f'"failed to parse filter (is.{value})"')
+            sql, params = f"{ref} {checks[value.lower()]}", []
+        elif op in ("like", "ilike"):
+            sql, params = f"pg_like({ref}, ?, {int(op == 'ilike')})", [value]
+        else:
+            raise PostgRESTError(400, "PGRST100", f"operador não suportado pelo backend local: {op}")
+        return (f"NOT ({sql})" if negate else sql), params
+
+    def _split_filters(self, params: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict[str, list]]:
+        """Separa os filtros da tabela principal dos filtros de embeds ({'rel' ou 'rel.sub': [(col, expr)]})"""
+        own: List[Tuple[str, str]] = []
+        embedded: Dict[str, list] = {}
+        for key, value in params:
+            if key in RESERVED_PARAMS:
+                continue
+            if key in ("or", "and", "not.or", "not.and") or key.endswith((".or", ".and", ".order", ".limit", ".offset")):
+                raise PostgRESTError(400, "PGRST100", f"'{key}' não é suportado pelo backend local")
+            path, _, column = key.rpartition(".")
+            if path:
+                embedded.setdefault(path, []).append((column, value))
+            else:
+                own.append((column, value))
+        return own, embedded
+
+    def _assign_filters(self, items: list, embedded: Dict[str, list], prefix: str = "") -> None:
+        for embed in self._embeds(items).values():
+            path = prefix + embed.key
+            embed.filters = embedded.pop(path, [])
+            self._assign_filters(embed.items, embedded, path + ".")
+        if not prefix and embedded:
+            raise PostgRESTError(400, "PGRST108",
+                                 f"'{next(iter(embedded))}' is not an embedded resource in this request")
+
+    def _where(self, table: Table, alias: str, filters: List[Tuple[str, str]], items: list,
+               depth: int = 0) -> Tuple[List[str], list]:
+        """Condições de uma tabela: os seus filtros + EXISTS dos embeds !inner (com os filtros deles)"""
+        parts, params = [], []
+        for column, expr in filters:
+            sql, values = self._condition(table, alias, column, expr)
+            parts.append(sql)
+            params.extend(values)
+        for embed in self._embeds(items).values():
+            if not embed.inner:
+                continue
+            child = self.tables[embed.table]
+            child_alias = f"e{depth}_{len(parts)}"
+            inner_parts, inner_params = self._where(child, child_alias, embed.filters, embed.items, depth + 1)
+            join = f"{child_alias}.{_q(embed.child_column)} = {alias}.{_q(embed.parent_column)}"
+            parts.append(f"EXISTS (SELECT 1 FROM {_q(embed.table)} {child_alias} "
+                         f"WHERE {' AND '.join([join, *inner_parts])})")
+            params.extend(inner_params)
+        return parts, params
+
+    def _order(self, table: Table, params: List[Tuple[str, str]]) -> str:
+        terms = []
+        for key, value in params:
+            if key != "order":
+                continue
+            for item in _split_top(value):
+                expr, *modifiers = item.rsplit(")", 1)[-1].split(".") if ")" in item else item.split(".")
+                if ")" in item:
+                    # ordem por uma coluna de um embed to-one: relacao(coluna)
+                    relation, column = item.split(")", 1)[0].split("(")
+                    parent_col, child_col, to_one, child = self._relation(table, relation.strip(), None)
+                    self._column(child, column)
+                    if not to_one:
+                        raise PostgRESTError(400, "PGRST118", f"'{relation}' não é uma relação to-one")
+                    ref = (f"(SELECT o.{_q(column)} FROM {_q(relation)} o "
+                           f"WHERE o.{_q(child_col)} = t0.{_q(parent_col)})")
+                    modifiers = [m for m in modifiers if m]
+                else:
+                    self._column(table, expr)
+                    ref = f"t0.{_q(expr)}"
+                desc = "desc" in modifiers
+                nulls_first = "nullsfirst" in modifiers or (desc and "nullslast" not in modifiers)
+                terms.append(f"({ref} IS NULL) {'DESC' if nulls_first else 'ASC'}, {ref} {'DESC' if desc else 'ASC'}")
+        terms.append("t0.rowid")
+        return ", ".join(terms)
+
+    def _offset(self, params: List[Tuple[str, str]], headers: Dict[str, str]) -> int:
+        values = dict(params)
+        if "offset" in values:
+            return int(values["offset"])
+        match = re.match(r"(\d+)-", headers.get("range", ""))
+        return int(match.group(1)) if match else 0
+
+    def _limit(self, params: List[Tuple[str, str]], headers: Dict[str, str]) -> Optional[int]:
+        values = dict(params)
+        if "limit" in values:
+            return int(values["limit"])
+        match = re.match(r"(\d+)-(\d+)", headers.get("range", ""))
+        return int(match.group(2)) - int(match.group(1)) + 1 if match else None
+
+    def _get(self, table: Table, params, headers, prefer) -> Tuple[List[dict], Optional[int]]:
+        values = dict(params)
+        items = self._parse_select(table, values.get("select", "*"))
+        own, embedded = self._split_filters(params)
+        self._assign_filters(items, embedded)
+        where, args = self._where(table, "t0", own, items)
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+        limit = self._limit(params, headers)
+        offset = self._offset(params, headers)
+        sql = (f"SELECT t0.rowid AS __rowid, t0.* FROM {_q(table.name)} t0 {where_sql} "
+               f"ORDER BY {self._order(table, params)} LIMIT ? OFFSET ?")
+        with self.lock:
+            rows = self.conn.execute(sql, [*args, -1 if limit is None else limit, offset]).fetchall()
+            total = None
+            if prefer.get("count") == "exact":
+                total = self.conn.execute(f"SELECT count(*) FROM {_q(table.name)} t0 {where_sql}", args).fetchone()[0]
+            return self._project(table, rows, items), total
+
+    def _project(self, table: Table, rows: List[sqlite3.Row], items: list) -> List[dict]:
+        """Linhas completas -> o formato do select, com os embeds carregados em blocos (um IN por relação)"""
+        raw = [self._from_db(table, r) for r in rows]
+        embedded: Dict[str, Dict[Any, Any]] = {}
+        for embed in self._embeds(items).values():
+            keys = list({r[embed.parent_column] for r in raw if r.get(embed.parent_column) is not None})
+            embedded[embed.key] = self._load_embed(embed, keys)
+
+        out = []
+        for r in raw:
+            row = {}
+            for kind, *rest in items:
+                if kind == "column":
+                    key, column = rest
+                    row[key] = r[column]
+                else:
+                    embed = rest[0]
+                    found = embedded[embed.key].get(r.get(embed.parent_column))
+                    row[embed.key] = found if embed.to_one else (found or [])
+            out.append(row)
+        return out
+
+    def _load_embed(self, embed: Embed, keys: List[Any]) -> Dict[Any, Any]:
+        child = self.tables[embed.table]
+        result: Dict[Any, Any] = {}
+        for chunk in _chunks(keys):
+            where, args = self._where(child, "t0", embed.filters, embed.items)
+            where.insert(0, f"t0.{_q(embed.child_column)} IN ({', '.join('?' * len(chunk))})")
+            rows = self.conn.execute(
+                f"SELECT t0.rowid AS __rowid, t0.* FROM {_q(child.name)} t0 "
+                f"WHERE {' AND '.join(where)} ORDER BY t0.rowid",
+                [*chunk, *args],
+            ).fetchall()
+            projected = self._project(child, rows, embed.items)
+            for row, value in zip(rows, projected):
+                parent_key = row[embed.child_column]
+                if embed.to_one:
+                    result.setdefault(parent_key, value)
+                else:
+                    result.setdefault(parent_key, []).append(value)
+        return result
+
+    def _rows_by_rowid(self, table: Table, rowids: List[int], select: Optional[str]) -> List[dict]:
+        if not rowids:
+            return []
+        items = self._parse_select(table, select or "*")
+        self._assign_filters(items, {})
+        rows = []
+        for chunk in _chunks(rowids):
+            rows.extend(self.conn.execute(
+                f"SELECT t0.rowid AS __rowid, t0.* FROM {_q(table.name)} t0 "
+                f"WHERE t0.rowid IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall())
+        order = {rowid: i for i, rowid in enumerate(rowids)}
+        rows.sort(key=lambda r: order[r["__rowid"]])
+        return self._project(table, rows, items)
+
+    # -----------------------------
+    # Escritas
+    # -----------------------------
+    def _insert(self, table: Table, payload: Any, params, prefer) -> List[dict]:
+        values = dict(params)
+        rows = payload if isinstance(payload, list) else [payload or {}]
+        columns = [c.strip().strip('"') for c in values["columns"].split(",")] if "columns" in values else None
+        missing_default = prefer.get("missing") == "default"
+        resolution = prefer.get("resolution")
+        conflict = ([c.strip() for c in values["on_conflict"].split(",")] if "on_conflict" in values
+                    else table.primary_key)
+        for c in conflict:
+            self._column(table, c)
+
+        rowids = []
+        with self._transaction() as conn:
+            for row in rows:
+                if columns and not missing_default:
+                    keys = columns
+                else:
+                    keys = [k for k in row if columns is None or k in columns]
+                data = [self._to_db(table, k, row.get(k)) for k in keys]
+                if keys:
+                    sql = (f"INSERT INTO {_q(table.name)} ({', '.join(_q(k) for k in keys)}) "
+                           f"VALUES ({', '.join('?' * len(keys))})")
+                else:
+                    sql = f"INSERT INTO {_q(table.name)} DEFAULT VALUES"
+                if resolution:
+                    target = ", ".join(_q(c) for c in conflict)
+                    updates = [k for k in keys if k not in conflict]
+                    if resolution == "ignore-duplicates" or not updates:
+                        sql += f" ON CONFLICT ({target}) DO NOTHING"
+                    else:
+                        sets = [f"{_q(k)} = excluded.{_q(k)}" for k in updates]
+                        if "updated_at" in table.columns and "updated_at" not in keys:
+                            sets.append(f'"updated_at" = {NOW_SQL}')
+                        sql += f" ON CONFLICT ({target}) DO UPDATE SET {', '.join(sets)}"
+                found = conn.execute(sql + " RETURNING rowid", data).fetchone()
+                if found is not None:
+                    rowids.append(found[0])
+            return self._rows_by_rowid(table, rowids, values.get("select"))
+
+    def _matching_rowids(self, table: Table, params) -> List[int]:
+        own, embedded = self._split_filters(params)
+        if embedded:
+            raise PostgRESTError(400, "PGRST100", "filtros em embeds só são suportados em GET")
+        where, args = self._where(table, "t0", own, [])
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        return [r[0] for r in self.conn.execute(f"SELECT t0.rowid FROM {_q(table.name)} t0 {where_sql}", args)]
+
+    def _update(self, table: Table, payload: dict, params) -> List[dict]:
+        if not isinstance(payload, dict):
+            raise PostgRESTError(400, "PGRST102", "PATCH espera um objeto JSON")
+        with self._transaction() as conn:
+            rowids = self._matching_rowids(table, params)
+            if rowids and payload:
+                sets = [f"{_q(k)} = ?" for k in payload]
+                data = [self._to_db(table, k, v) for k, v in payload.items()]
+                # a app usa updated_at para sincronizar cópias locais: muda em cada update
+                if "updated_at" in table.columns and "updated_at" not in payload:
+                    sets.append(f'"updated_at" = {NOW_SQL}')
+                for chunk in _chunks(rowids):
+                    conn.execute(f"UPDATE {_q(table.name)} SET {', '.join(sets)} "
+                                 f"WHERE rowid IN ({', '.join('?' * len(chunk))})", [*data, *chunk])
+            return self._rows_by_rowid(table, rowids, dict(params).get("select"))
+
+    def _delete(self, table: Table, params) -> List[dict]:
+        with self._transaction() as conn:
+            rowids = self._matching_rowids(table, params)
+            rows = self._rows_by_rowid(table, rowids, dict(params).get("select"))
+            for chunk in _chunks(rowids):
+                conn.execute(f"DELETE FROM {_q(table.name)} WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk)
+            return rows
+
+    # -----------------------------
+    # RPC
+    # -----------------------------
+    def _rpc(self, name: str, args: dict) -> Any:
+        function = self.functions.get(name)
+        if function is None:
+            raise PostgRESTError(404, "PGRST202", f"Could not find the function public.{name} in the schema cache")
+        return function(args)
+
+    @staticmethod
+    def _adjust(conn, variant_id: int, warehouse_id: int, delta: int, key: Optional[str]) -> dict:
+        """Corpo de public.adjust_stock, dentro da transação de quem chama"""
+        row = conn.execute('SELECT stock FROM "warehouse_stock" WHERE variant_id = ? AND warehouse_id = ?',
+                           (variant_id, warehouse_id)).fetchone()
+        current = row[0] if row else 0
+        result = {"variant_id": variant_id, "warehouse_id": warehouse_id, "stock": current, "applied": True}
+        if key is not None:
+            if conn.execute('INSERT INTO "stock_movement_keys" (key) VALUES (?) ON CONFLICT (key) DO NOTHING',
+                            (key,)).rowcount == 0:
+                return result  # movimento já aplicado num envio anterior
+        if current + delta < 0:
+            conn.execute('DELETE FROM "stock_movement_keys" WHERE key = ?', (key,))
+            return {**result, "applied": False}
+        if row is not None:
+            result["stock"] = conn.execute(
+                f'UPDATE "warehouse_stock" SET stock = stock + ?, updated_at = {NOW_SQL} '
+                'WHERE variant_id = ? AND warehouse_id = ? RETURNING stock',
+                (delta, variant_id, warehouse_id),
+            ).fetchone()[0]
+        else:
+            result["stock"] = conn.execute(
+                'INSERT INTO "warehouse_stock" (variant_id, warehouse_id, stock) VALUES (?, ?, ?) RETURNING stock',
+                (variant_id, warehouse_id, delta),
+            ).fetchone()[0]
+        return result
+
+    def _rpc_adjust_stock(self, args: dict) -> List[dict]:
+        """public.adjust_stock: soma p_delta sem nunca deixar o stock negativo (ver query_corrected.txt)"""
+        try:
+            variant_id, warehouse_id, delta = (int(args["p_variant_id"]), int(args["p_warehouse_id"]),
+                                               int(args["p_delta"]))
+        except KeyError:
+            raise PostgRESTError(404, "PGRST202",
+                                 "Could not find the function public.adjust_stock with the given parameters")
+        with self._transaction() as conn:
+            return [self._adjust(conn, variant_id, warehouse_id, delta, args.get("p_key"))]
+
+    def _rpc_adjust_stock_batch(self, args: dict) -> List[dict]:
+        """public.adjust_stock_batch: os movimentos de p_movements, por ordem, numa só transação"""
+        if "p_movements" not in args:
+            raise PostgRESTError(404, "PGRST202",
+                                 "Could not find the function public.adjust_stock_batch with the given parameters")
+        with self._transaction() as conn:
+            return [
+                self._adjust(conn, int(m["variant_id"]), int(m["warehouse_id"]), int(m["delta"]), m.get("key"))
+                for m in args["p_movements"]
+            ]
+
+    # -----------------------------
+    # Utilitários para testes/benchmarks
+    # -----------------------------
+    def seed(self, table: str, rows: List[dict]) -> List[dict]:
+        """Insere linhas diretamente (sem latência nem contagem de pedidos). Retorna as linhas gravadas"""
+        return self._insert(self._table(table), rows, [], {})
+
+    def count(self, table: str) -> int:
+        with self.lock:
+            return self.conn.execute(f"SELECT count(*) FROM {_q(self._table(table).name)}").fetchone()[0]
+
+    def httpx_transport(self):
+        """Transporte httpx para o SDK do supabase (postgrest-py)"""
+        import httpx
+
+        server = self
+
+        class FakeTransport(httpx.BaseTransport):
+            def handle_request(self, request: httpx.Request) -> httpx.Response:
+                status, headers, content = server.request(
+                    request.method, request.url.path, list(request.url.params.multi_items()),
+                    dict(request.headers), request.read(),
+                )
+                return httpx.Response(status, headers=headers, content=content, request=request)
+
+        return FakeTransport()
+
+    def requests_adapter(self):
+        """Adapter do requests para o SupabaseClient do ETL (session.mount(FAKE_HTTP_URL, ...))"""
+        from requests.adapters import BaseAdapter
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+
+        server = self
+
+        class FakeAdapter(BaseAdapter):
+            def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+                url = urlsplit(request.url)
+                body = request.body or b""
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                status, headers, content = server.request(
+                    request.method, url.path, parse_qsl(url.query, keep_blank_values=True),
+                    dict(request.headers), body,
+                )
+                response = Response()
+                response.status_code = status
+                response.reason = HTTPStatus(status).phrase
+                response.headers = CaseInsensitiveDict(headers)
+                response._content = content
+                response.encoding = "utf-8"
+                response.url = request.url
+                response.request = request
+                return response
+
+            def close(self):
+                pass
+
+        return FakeAdapter()
+
+
+# -----------------------------
+# Registo (um servidor por URL e processo) e clientes
+# -----------------------------
+_servers: Dict[str, FakePostgREST] = {}
+_servers_lock = threading.Lock()
+
+
+def is_fake_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(FAKE_SCHEME)
+
+
+def get_server(url: str = FAKE_SCHEME + ":memory:") -> FakePostgREST:
+    """
+    O servidor de um URL fake://<ficheiro sqlite | :memory: | :memory:<nome>>; o mesmo para todos os
+    clientes do processo. A latência vem de FAKE_SUPABASE_LATENCY_MS (pode mudar-se depois em server.latency).
+    """
+    with _servers_lock:
+        server = _servers.get(url)
+        if server is None:
+            database = url[len(FAKE_SCHEME):] or ":memory:"
+            if database.startswith(":memory:"):
+                database = ":memory:"
+            latency_ms = float(os.getenv("FAKE_SUPABASE_LATENCY_MS", "").strip() or 0)
+            server = _servers[url] = FakePostgREST(database, latency_ms=latency_ms)
+        return server
+
+
+def close_server(url: str) -> None:
+    """Fecha e esquece o servidor de um URL (uma base :memory: perde-se; um ficheiro fica)"""
+    with _servers_lock:
+        server = _servers.pop(url, None)
+    if server is not None:
+        with server.lock:
+            server.conn.close()
+
+
+def create_client(url: str = FAKE_SCHEME + ":memory:"):
+    """Cliente do SDK do supabase ligado ao servidor local (para DB)"""
+    import httpx
+    from supabase import ClientOptions, create_client as create_supabase_client
+
+    http = httpx.Client(transport=get_server(url).httpx_transport())
+    return create_supabase_client(FAKE_HTTP_URL, FAKE_KEY, options=ClientOptions(httpx_client=http))
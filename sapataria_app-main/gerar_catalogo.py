@@ -0,0 +1,352 @@
+"""
+Gerador de catálogos sintéticos para testes de carga.
+
+Produz catálogos realistas (modelos x cores x tamanhos x armazéns) a qualquer escala,
+sempre iguais para a mesma semente:
+  - categorias, subcategorias, cores e tamanhos com a distribuição da folha atual
+    (Online Codigos de Barras.xlsx: 64 modelos, ~18 variantes por modelo)
+  - marcas com distribuição enviesada (Zipf): poucas marcas com a maior parte dos modelos
+  - GTIN-13 com dígito de controlo válido, no intervalo 2xx da GS1 (uso interno),
+    que nunca colide com códigos reais
+  - stock por armazém, com muitas variantes a 0 e poucas com muito stock
+
+Saídas:
+  - folha no formato do ETL (.xlsx na aba Folha1, ou .csv), opcionalmente com uma fração
+    de linhas "sujas" (GTIN vazio/inválido/repetido, marcas mal escritas) para exercitar os rejeitos
+  - dados gravados diretamente no backend local (fake_postgrest.py)
+
+Uso:
+    python gerar_catalogo.py --scale 10 --output catalogo_10x.xlsx
+    python gerar_catalogo.py --scale 100 --output catalogo_100x.csv --dirty 0.02
+    python gerar_catalogo.py --variants 50000 --seed 7 --seed-fake fake:///tmp/sapataria.sqlite
+"""
+
+import argparse
+import csv
+import os
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Catálogo atual (Online Codigos de Barras.xlsx)
+CURRENT_MODELS = 64
+
+# Colunas da folha que o ETL lê (SCRIPT_ETL/normalizacao.py: REQUIRED_COLUMNS)
+SHEET_COLUMNS = [
+    "Ref. Keyinvoice",
+    "Ref. Woocomerce",
+    "Categoria",
+    "Subcategoria",
+    "Marca",
+    "Nome",
+    "Cor",
+    "TAMANHO",
+    "CODIGO DE BARRAS",
+]
+
+DEFAULT_SUPPLIER = "KeyInvoice Import"
+
+# peso de cada categoria e das suas subcategorias, medidos na folha atual
+CATEGORIES = {
+    "Senhora": (0.69, {
+        "Sapato Raso": 260, "Botas": 143, "Sandálias": 118, "Loafer": 106, "Salto Alto": 60,
+        "Oxford": 56, "Fivela": 22, "Derby": 22, "Sandalia | Salto Alto": 14, "Sandália | Mule": 14,
+    }),
+    "Homem": (0.26, {"Loafer": 68, "Oxford": 57, "Botas": 42, "Sandálias": 25, "Fivela": 16, "Sneaker": 11}),
+    "Unisex": (0.05, {"Chinelos": 55}),
+}
+
+SIZE_RUNS = {
+    "Senhora": ["34", "35", "35.5", "36", "36.5", "37", "37.5", "38", "38.5", "39", "39.5", "40", "41", "42"],
+    "Homem": ["38", "39", "40", "41", "42", "43", "44", "45", "46", "47"],
+    "Unisex": ["35", "36", "37", "38", "39", "40", "41", "42", "43", "44", "45", "46"],
+}
+
+# por ordem de frequência (o peso de cada cor segue a mesma lei das marcas)
+COLORS = [
+    "Preto", "Bordeaux", "Castanho Escuro", "Vermelho", "Verde", "Castanho", "Castanho Ebony", "Dourado",
+    "Azul Navy", "Creme E Preto", "Preto E Creme", "Preto Polido", "Bordeaux Polido", "Castanho Escuro Camurça",
+    "Azul", "Camel", "Mel Camurça", "Castanho Avelã", "Castanho Cognac", "Verde Camurça", "Dourado E Prata",
+    "Castanho Camurça", "Camel E Branco", "Branco", "Azul Camurça", "Verde Kaki", "Prata", "Bege",
+    "Preto E Branco", "Branco E Vermelho",
+]
+
+BRANDS = ["SORRISO", "Hercules", "Martico", "Tavares", "Garcia Slippers"]
+
+NAMES = [
+    "Hélia", "Nicoly", "Júlia", "Lauren", "Lea", "Cloe", "Bianca", "Natalie", "Florence", "Brigitte",
+    "Caroline", "Alice", "Nora", "Bella", "Emma", "Carmo", "Viviane", "Rita", "Amélia", "Carmen",
+    "Martina", "Fiona", "Ofélia", "Emilia", "Sana", "Lisa", "Paola", "Mary", "Porto", "Selena",
+    "Faro", "Lisboa", "Beja", "Pearl", "Emily",
+]
+
+# prefixo GS1 2x: números de circulação restrita, nunca atribuídos a produtos
+GTIN_PREFIX = 29
+
+
+@dataclass
+class CatalogSpec:
+    models: int = CURRENT_MODELS
+    variants: Optional[int] = None        # se dado, gera modelos até ter exatamente este nº de variantes
+    seed: int = 42
+    colors_per_model: Tuple[int, int] = (1, 4)
+    brands: Optional[int] = None          # default: cresce com a raiz do nº de modelos
+    brand_skew: float = 1.3               # expoente da lei de Zipf (0 = uniforme)
+    warehouses: Dict[str, float] = field(default_factory=lambda: {"Loja": 1.0, "Armazem": 1.0})
+    max_stock: int = 30
+
+
+@dataclass
+class Catalog:
+    spec: CatalogSpec
+    models: List[dict]        # nome_modelo, ref, marca, categoria, subcategoria, ref_woocomerce
+    variants: List[dict]      # model (índice em models), gtin, cor, tamanho
+    stock: Dict[Tuple[int, str], int]   # (índice da variante, armazém) -> stock
+
+    def domain(self, key: str) -> List[str]:
+        source = self.models if key in ("marca", "categoria") else self.variants
+        return sorted({row[key] for row in source})
+
+
+def ean13(number: int) -> str:
+    """GTIN-13 a partir dos 12 primeiros dígitos, com o dígito de controlo"""
+    digits = f"{number:012d}"
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def zipf_weights(count: int, skew: float) -> List[float]:
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def brand_names(count: int) -> List[str]:
+    return BRANDS[:count] + [f"Marca {i:03d}" for i in range(len(BRANDS) + 1, count + 1)]
+
+
+def generate(spec: CatalogSpec) -> Catalog:
+    """Gera o catálogo (só depende da spec: a mesma semente dá sempre o mesmo catálogo)"""
+    rng = random.Random(spec.seed)
+    expected_models = spec.models if spec.variants is None else max(1, spec.variants // 15)
+    brands = brand_names(spec.brands or max(len(BRANDS), round(expected_models ** 0.5)))
+    brand_weights = zipf_weights(len(brands), spec.brand_skew)
+    color_weights = zipf_weights(len(COLORS), 1.0)
+    categories = list(CATEGORIES)
+    category_weights = [weight for weight, _ in CATEGORIES.values()]
+    width = len(str(expected_models * 2))
+
+    models, variants, stock = [], [], {}
+    lo, hi = spec.colors_per_model
+    while True:
+        if spec.variants is None and len(models) >= spec.models:
+            break
+        if spec.variants is not None and len(variants) >= spec.variants:
+            break
+
+        index = len(models)
+        category = rng.choices(categories, category_weights)[0]
+        subcategories = CATEGORIES[category][1]
+        models.append({
+            "nome_modelo": f"{NAMES[index % len(NAMES)]} {index:0{width}d}",
+            "ref": str(5000 + index),
+            "ref_woocomerce": str(rng.randint(10_000, 99_999)) if rng.random() < 0.3 else None,
+            "marca": rng.choices(brands, brand_weights)[0],
+            "categoria": category,
+            "subcategoria": rng.choices(list(subcategories), list(subcategories.values()))[0],
+        })
+
+        # cores sem repetir (as mais comuns saem mais vezes); tamanhos numa sequência contígua
+        colors = set()
+        for _ in range(rng.randint(lo, hi)):
+            colors.add(rng.choices(COLORS, color_weights)[0])
+        run = SIZE_RUNS[category]
+        length = rng.randint(min(4, len(run)), len(run))
+        start = rng.randint(0, len(run) - length)
+
+        for color in sorted(colors, key=COLORS.index):
+            for size in run[start:start + length]:
+                if spec.variants is not None and len(variants) >= spec.variants:
+                    break
+                position = len(variants)
+                variants.append({
+                    "model": index,
+                    "gtin": ean13(GTIN_PREFIX * 10 ** 10 + spec.seed % 1000 * 10 ** 7 + position),
+                    "cor": color,
+                    "tamanho": size,
+                })
+                for warehouse, coverage in spec.warehouses.items():
+                    if rng.random() < coverage:
+                        # ~1/3 a zero, o resto com cauda longa
+                        quantity = 0 if rng.random() < 0.35 else min(spec.max_stock, int(rng.paretovariate(1.2)))
+                        stock[(position, warehouse)] = quantity
+
+    return Catalog(spec, models, variants, stock)
+
+
+# -----------------------------
+# Folha do ETL
+# -----------------------------
+def sheet_rows(catalog: Catalog, dirty: float = 0.0, seed: Optional[int] = None) -> List[dict]:
+    """
+    Linhas no formato da folha do ETL. Com dirty > 0, essa fração de linhas sai com problemas
+    que o ETL tem de limpar ou rejeitar (GTIN vazio, curto ou repetido, texto mal formatado).
+    """
+    rng = random.Random(catalog.spec.seed if seed is None else seed)
+    rows = []
+    for variant in catalog.variants:
+        model = catalog.models[variant["model"]]
+        row = {
+            "Ref. Keyinvoice": model["ref"],
+            "Ref. Woocomerce": model["ref_woocomerce"] or "",
+            "Categoria": model["categoria"],
+            "Subcategoria": model["subcategoria"],
+            "Marca": model["marca"],
+            "Nome": model["nome_modelo"],
+            "Cor": variant["cor"],
+            "TAMANHO": variant["tamanho"],
+            "CODIGO DE BARRAS": variant["gtin"],
+        }
+        if dirty and rng.random() < dirty:
+            problem = rng.randrange(5)
+            if problem == 0:
+                row["CODIGO DE BARRAS"] = ""
+            elif problem == 1:
+                row["CODIGO DE BARRAS"] = "000"
+            elif problem == 2 and rows:
+                row["CODIGO DE BARRAS"] = rows[-1]["CODIGO DE BARRAS"]
+            elif problem == 3:
+                row["Marca"] = f"  {row['Marca'].lower()} "
+                row["Cor"] = row["Cor"].upper()
+            else:
+                row["Nome"] = ""
+        rows.append(row)
+    return rows
+
+
+def write_sheet(rows: List[dict], path: str, sheet_name: str = "Folha1") -> None:
+    """Grava a folha: .csv com o módulo csv, o resto como .xlsx (openpyxl em modo write-only)"""
+    if os.path.splitext(path)[1].lower() == ".csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SHEET_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(SHEET_COLUMNS)
+    for row in rows:
+        ws.append([row[c] for c in SHEET_COLUMNS])
+    wb.save(path)
+
+
+# -----------------------------
+# Backend local
+# -----------------------------
+def seed_fake(catalog: Catalog, server, supplier: str = DEFAULT_SUPPLIER) -> dict:
+    """
+    Grava o catálogo no backend local (FakePostgREST.seed: sem latência nem contagem de pedidos).
+    Retorna {"warehouses": {nome: id}, "variant_ids": [id por variante, pela ordem de catalog.variants]}
+    """
+    def ids(table, column, values, extra=None):
+        written = server.seed(table, [{column: v, **(extra(v) if extra else {})} for v in values])
+        return {row[column]: row["id"] for row in written}
+
+    # armazéns pela ordem da spec (o primeiro fica com o id 1, o armazém por defeito das vendas online)
+    warehouses = ids("warehouses", "name", list(catalog.spec.warehouses))
+    suppliers = ids("suppliers", "name", [supplier])
+    brands = ids("brands", "name", catalog.domain("marca"))
+    categories = ids("categories", "name", catalog.domain("categoria"))
+    pairs = sorted({(m["categoria"], m["subcategoria"]) for m in catalog.models})
+    written = server.seed("subcategories", [{"category_id": categories[c], "name": s} for c, s in pairs])
+    subcategories = {(c, s): row["id"] for (c, s), row in zip(pairs, written)}
+    colors = ids("colors", "name", catalog.domain("cor"))
+    sizes = ids("sizes", "value", catalog.domain("tamanho"))
+
+    models = server.seed("product_model", [
+        {
+            "nome_modelo": m["nome_modelo"], "ref": m["ref"], "marca_id": brands[m["marca"]],
+            "categoria_id": categories[m["categoria"]],
+            "subcategoria_id": subcategories[(m["categoria"], m["subcategoria"])],
+            "fornecedor_id": suppliers[supplier],
+        }
+        for m in catalog.models
+    ])
+    variants = server.seed("product_variant", [
+        {
+            "model_id": models[v["model"]]["id"], "gtin": v["gtin"], "cor_id": colors[v["cor"]],
+            "tamanho_id": sizes[v["tamanho"]], "ref_keyinvoice": catalog.models[v["model"]]["ref"],
+            "ref_woocomerce": catalog.models[v["model"]]["ref_woocomerce"],
+        }
+        for v in catalog.variants
+    ])
+    variant_ids = [v["id"] for v in variants]
+    server.seed("warehouse_stock", [
+        {"variant_id": variant_ids[position], "warehouse_id": warehouses[warehouse], "stock": quantity}
+        for (position, warehouse), quantity in catalog.stock.items()
+    ])
+    return {"warehouses": warehouses, "variant_ids": variant_ids}
+
+
+def print_summary(catalog: Catalog) -> None:
+    brands = Counter(catalog.models[v["model"]]["marca"] for v in catalog.variants)
+    total = len(catalog.variants)
+    print(f"  - Modelos:   {len(catalog.models)}")
+    print(f"  - Variantes: {total}")
+    print(f"  - Marcas:    {len(brands)} (top 3: "
+          + ", ".join(f"{name} {count / total:.0%}" for name, count in brands.most_common(3)) + ")")
+    for warehouse in catalog.spec.warehouses:
+        rows = [q for (_, w), q in catalog.stock.items() if w == warehouse]
+        print(f"  - Stock {warehouse}: {len(rows)} linhas, {sum(rows)} unidades")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera catálogos sintéticos para testes de carga")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", type=float, default=1.0,
+                      help=f"múltiplo do catálogo atual ({CURRENT_MODELS} modelos; default: 1)")
+    size.add_argument("--models", type=int, default=None, help="nº de modelos")
+    size.add_argument("--variants", type=int, default=None, help="nº exato de variantes")
+    parser.add_argument("--seed", type=int, default=42, help="semente (default: 42)")
+    parser.add_argument("--brands", type=int, default=None, help="nº de marcas (default: cresce com o catálogo)")
+    parser.add_argument("--brand-skew", type=float, default=1.3, help="enviesamento das marcas (0 = uniforme)")
+    parser.add_argument("--warehouses", default="Loja,Armazem", help="armazéns, separados por vírgulas")
+    parser.add_argument("--output", default=None, help="folha no formato do ETL (.xlsx ou .csv)")
+    parser.add_argument("--dirty", type=float, default=0.0, help="fração de linhas com problemas na folha")
+    parser.add_argument("--seed-fake", default=None, metavar="URL",
+                        help="grava o catálogo no backend local (ex.: fake:///tmp/sapataria.sqlite)")
+    args = parser.parse_args()
+
+    if not args.output and not args.seed_fake:
+        parser.error("indica --output e/ou --seed-fake")
+
+    spec = CatalogSpec(
+        models=args.models or max(1, round(CURRENT_MODELS * args.scale)),
+        variants=args.variants,
+        seed=args.seed,
+        brands=args.brands,
+        brand_skew=args.brand_skew,
+        warehouses={name.strip(): 1.0 for name in args.warehouses.split(",") if name.strip()},
+    )
+    catalog = generate(spec)
+    print("📦 Catálogo gerado:")
+    print_summary(catalog)
+
+    if args.output:
+        write_sheet(sheet_rows(catalog, args.dirty), args.output)
+        print(f"💾 Folha: {args.output}")
+
+    if args.seed_fake:
+        import fake_postgrest
+
+        server = fake_postgrest.get_server(args.seed_fake)
+        if server.count("product_variant"):
+            raise SystemExit(f"{args.seed_fake} já tem produtos; usa uma base nova")
+        seed_fake(catalog, server)
+        print(f"💾 Backend local: {args.seed_fake}")
+
+
+if __name__ == "__main__":
+    main()
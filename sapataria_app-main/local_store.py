@@ -0,0 +1,701 @@
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from db import DB, DOMAIN_TABLES, escape_like
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+  tbl TEXT NOT NULL,
+  id INTEGER NOT NULL,
+  name TEXT,
+  category_id INTEGER,
+  PRIMARY KEY (tbl, id)
+);
+
+CREATE TABLE IF NOT EXISTS product_model (
+  id INTEGER PRIMARY KEY,
+  ref TEXT,
+  nome_modelo TEXT,
+  marca_id INTEGER,
+  categoria_id INTEGER,
+  subcategoria_id INTEGER,
+  fornecedor_id INTEGER,
+  updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS product_variant (
+  id INTEGER PRIMARY KEY,
+  model_id INTEGER,
+  gtin TEXT,
+  cor_id INTEGER,
+  tamanho_id INTEGER,
+  ref_keyinvoice TEXT,
+  ref_woocomerce TEXT,
+  updated_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_variant_gtin ON product_variant (gtin);
+CREATE INDEX IF NOT EXISTS idx_variant_ref_keyinvoice ON product_variant (ref_keyinvoice);
+CREATE INDEX IF NOT EXISTS idx_variant_ref_woocomerce ON product_variant (ref_woocomerce);
+
+CREATE TABLE IF NOT EXISTS warehouse_stock (
+  variant_id INTEGER NOT NULL,
+  warehouse_id INTEGER NOT NULL,
+  stock INTEGER NOT NULL DEFAULT 0,
+  updated_at TEXT,
+  PRIMARY KEY (variant_id, warehouse_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_warehouse ON warehouse_stock (warehouse_id);
+
+-- fila de escritas por enviar ao Supabase (movimentos de stock e auditoria)
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  detail TEXT
+);
+
+CREATE TABLE IF NOT EXISTS profiles (
+  username TEXT PRIMARY KEY,
+  data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+"""
+
+# Colunas sincronizadas por tabela (incrementais via updated_at)
+SYNC_TABLES = {
+    "product_model": ("id, ref, nome_modelo, marca_id, categoria_id, subcategoria_id, fornecedor_id, updated_at", ("id",)),
+    "product_variant": ("id, model_id, gtin, cor_id, tamanho_id, ref_keyinvoice, ref_woocomerce, updated_at", ("id",)),
+    "warehouse_stock": ("variant_id, warehouse_id, stock, updated_at", ("variant_id", "warehouse_id")),
+}
+
+# O incremental não vê linhas apagadas no servidor: de tempos a tempos a sincronização é completa
+FULL_SYNC_INTERVAL = timedelta(hours=6)
+
+SEARCH_FIELDS = {
+    "gtin": "gtin",
+    "ref_keyinvoice": "ref_keyinvoice",
+    "ref_woocommerce": "ref_woocomerce",
+}
+
+DIMENSION_JOINS = """
+    LEFT JOIN product_model m ON m.id = v.model_id
+    LEFT JOIN domains b ON b.tbl = 'brands' AND b.id = m.marca_id
+    LEFT JOIN domains c ON c.tbl = 'categories' AND c.id = m.categoria_id
+    LEFT JOIN domains sc ON sc.tbl = 'subcategories' AND sc.id = m.subcategoria_id
+    LEFT JOIN domains f ON f.tbl = 'suppliers' AND f.id = m.fornecedor_id
+    LEFT JOIN domains co ON co.tbl = 'colors' AND co.id = v.cor_id
+    LEFT JOIN domains sz ON sz.tbl = 'sizes' AND sz.id = v.tamanho_id
+"""
+
+VARIANT_JOIN = "FROM product_variant v" + DIMENSION_JOINS
+
+VARIANT_COLUMNS = """
+    v.id AS variant_id, v.gtin, v.ref_keyinvoice, v.ref_woocomerce, v.model_id, v.cor_id, v.tamanho_id,
+    v.updated_at, m.nome_modelo, m.marca_id, m.categoria_id, m.subcategoria_id, m.fornecedor_id,
+    b.name AS marca, c.name AS categoria, sc.name AS subcategoria, f.name AS fornecedor,
+    co.name AS cor, sz.name AS tamanho
+"""
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def is_network_error(exc):
+    """True se a exceção indica falta de ligação (e não um erro devolvido pelo servidor)"""
+    import httpx
+    return isinstance(exc, (httpx.TransportError, OSError))
+
+
+class LocalMirror:
+    """Cópia local (SQLite) do catálogo e stock, com fila de escritas pendentes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    # ------------------------------------------
+    # Meta
+    # ------------------------------------------
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def ready(self):
+        """True depois da primeira sincronização completa"""
+        return self.get_meta("last_full_sync") is not None
+
+    # ------------------------------------------
+    # Escrita a partir do servidor
+    # ------------------------------------------
+
+    def replace_domain(self, table, rows):
+        """rows: [(id, name)] ou [(id, name, category_id)] para subcategorias"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM domains WHERE tbl = ?", (table,))
+            self.conn.executemany(
+                "INSERT INTO domains (tbl, id, name, category_id) VALUES (?, ?, ?, ?)",
+                [(table, r[0], r[1], r[2] if len(r) > 2 else None) for r in rows],
+            )
+
+    def put_domain(self, table, id_, name, category_id=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO domains (tbl, id, name, category_id) VALUES (?, ?, ?, ?)",
+                (table, id_, name, category_id),
+            )
+
+    def apply_rows(self, table, rows, replace=False, skip_stock_keys=()):
+        """Aplica linhas vindas do servidor (upsert). replace=True limpa a tabela antes."""
+        columns = [c.strip() for c in SYNC_TABLES[table][0].split(",")]
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        values = []
+        for r in rows:
+            if table == "warehouse_stock" and (r["variant_id"], r["warehouse_id"]) in skip_stock_keys:
+                continue
+            values.append(tuple(r.get(c) for c in columns))
+        with self.lock, self.conn:
+            if replace:
+                # o stock com movimentos por enviar fica como está localmente
+                kept = []
+                if table == "warehouse_stock":
+                    kept = [tuple(r) for r in self.conn.execute(
+                        f"SELECT {', '.join(columns)} FROM warehouse_stock").fetchall()
+                        if (r[0], r[1]) in skip_stock_keys]
+                self.conn.execute(f"DELETE FROM {table}")
+                values.extend(kept)
+            self.conn.executemany(sql, values)
+
+    def put_model(self, model_id, data):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO product_model (id) VALUES (?)", (model_id,))
+            self._update("product_model", model_id, data)
+
+    def put_variant(self, variant_id, data):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO product_variant (id) VALUES (?)", (variant_id,))
+            self._update("product_variant", variant_id, data)
+
+    def _update(self, table, id_, data):
+        columns = [c.strip() for c in SYNC_TABLES[table][0].split(",")]
+        data = {k: v for k, v in data.items() if k in columns and k != "id"}
+        if data:
+            sets = ", ".join(f"{k} = ?" for k in data)
+            self.conn.execute(f"UPDATE {table} SET {sets} WHERE id = ?", (*data.values(), id_))
+
+    def delete_variant(self, variant_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM warehouse_stock WHERE variant_id = ?", (variant_id,))
+            self.conn.execute("DELETE FROM product_variant WHERE id = ?", (variant_id,))
+
+    def set_stock(self, variant_id, warehouse_id, stock):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO warehouse_stock (variant_id, warehouse_id, stock, updated_at) VALUES (?, ?, ?, ?)",
+                (variant_id, warehouse_id, int(stock), now_iso()),
+            )
+
+    def delete_stock(self, variant_id, warehouse_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM warehouse_stock WHERE variant_id = ? AND warehouse_id = ?", (variant_id, warehouse_id))
+
+    def cache_profile(self, user):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO profiles (username, data) VALUES (?, ?)",
+                              (user["username"], json.dumps(user)))
+
+    # ------------------------------------------
+    # Leituras
+    # ------------------------------------------
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
+
+    def list_domain(self, table):
+        rows = self.query("SELECT id, name FROM domains WHERE tbl = ? ORDER BY name", (table,))
+        return [(r["id"], r["name"]) for r in rows]
+
+    def list_subcategories_by_category(self, category_id):
+        rows = self.query(
+            "SELECT id, name FROM domains WHERE tbl = 'subcategories' AND category_id = ? ORDER BY name",
+            (int(category_id),),
+        )
+        return [(r["id"], r["name"]) for r in rows]
+
+    def find_domain_id(self, table, name, category_id=None):
+        sql = "SELECT id FROM domains WHERE tbl = ? AND name = ?"
+        params = [table, name]
+        if category_id is not None:
+            sql += " AND category_id = ?"
+            params.append(int(category_id))
+        rows = self.query(sql, params)
+        return rows[0]["id"] if rows else None
+
+    def variants_where(self, where, params=()):
+        return self.query(f"SELECT {VARIANT_COLUMNS} {VARIANT_JOIN} WHERE {where} ORDER BY v.id", params)
+
+    def get_profile(self, username):
+        rows = self.query("SELECT data FROM profiles WHERE username = ?", (username,))
+        return json.loads(rows[0]["data"]) if rows else None
+
+    def get_stock(self, variant_id, warehouse_id):
+        rows = self.query("SELECT stock FROM warehouse_stock WHERE variant_id = ? AND warehouse_id = ?",
+                          (int(variant_id), int(warehouse_id)))
+        return rows[0]["stock"] if rows else 0
+
+    # ------------------------------------------
+    # Outbox
+    # ------------------------------------------
+
+    def enqueue(self, kind, payload):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO outbox (kind, payload, created_at) VALUES (?, ?, ?)",
+                              (kind, json.dumps(payload), now_iso()))
+
+    def pending(self, kind):
+        rows = self.query("SELECT id, payload FROM outbox WHERE status = 'pending' AND kind = ? ORDER BY id", (kind,))
+        return [(r["id"], json.loads(r["payload"])) for r in rows]
+
+    def mark(self, ids, status, detail=None):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE outbox SET status = ?, detail = ? WHERE id = ?",
+                                  [(status, detail, i) for i in ids])
+
+    def pending_count(self):
+        return self.query("SELECT COUNT(*) AS n FROM outbox WHERE status = 'pending'")[0]["n"]
+
+    def pending_stock_keys(self):
+        return {(p["variant_id"], p["warehouse_id"]) for _, p in self.pending("stock")}
+
+    def list_conflicts(self):
+        return self.query(
+            "SELECT id, payload, created_at, status, detail FROM outbox "
+            "WHERE status IN ('merged', 'rejected') ORDER BY id DESC"
+        )
+
+
+class OfflineDB(DB):
+    """
+    DB que serve as leituras a partir do espelho local e põe as escritas de stock
+    e auditoria numa fila persistente, enviada ao Supabase quando há ligação.
+    Restantes escritas (cadastro, alterações, exclusões) continuam a exigir ligação.
+    """
+
+    def __init__(self, mirror: LocalMirror):
+        super().__init__()
+        self.mirror = mirror
+        self.online = True
+        self._sync_lock = threading.Lock()
+
+    # ------------------------------------------
+    # Sincronização
+    # ------------------------------------------
+
+    def _online_call(self, func, *args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_network_error(e):
+                self.online = False
+            raise
+        self.online = True
+        return result
+
+    def sync(self, full=False):
+        """
+        Envia a fila pendente e depois puxa do servidor as alterações desde a última sincronização.
+        Retorna {"pushed": n, "conflicts": [...], "pulled": n, "online": bool}
+        """
+        report = {"pushed": 0, "conflicts": [], "pulled": 0, "online": self.online}
+        with self._sync_lock:
+            try:
+                pushed, conflicts = self._replay()
+                report["pushed"] = pushed
+                report["conflicts"] = conflicts
+                report["pulled"] = self._pull(full=full or self._full_sync_due())
+                self.online = True
+            except Exception as e:
+                if not is_network_error(e):
+                    raise
+                self.online = False
+            report["online"] = self.online
+        return report
+
+    def _full_sync_due(self):
+        last = self.mirror.get_meta("last_full_sync")
+        if last is None:
+            return True
+        return datetime.fromisoformat(last) < datetime.now(timezone.utc) - FULL_SYNC_INTERVAL
+
+    def _pull(self, full=False):
+        pulled = 0
+        for table in DOMAIN_TABLES:
+            self.mirror.replace_domain(table, super().list_domain(table))
+        subs = self.list_rows_since('subcategories', 'id, name, category_id')
+        self.mirror.replace_domain('subcategories', [(r['id'], r['name'], r['category_id']) for r in subs])
+
+        skip = self.mirror.pending_stock_keys()
+        for table, (columns, order_cols) in SYNC_TABLES.items():
+            since = None if full else self.mirror.get_meta(f"since:{table}")
+            rows = self.list_rows_since(table, columns, updated_since=since, order_cols=order_cols)
+            self.mirror.apply_rows(table, rows, replace=full, skip_stock_keys=skip)
+            stamps = [r["updated_at"] for r in rows if r.get("updated_at")]
+            if stamps:
+                self.mirror.set_meta(f"since:{table}", max([since or ""] + stamps))
+            pulled += len(rows)
+
+        self.mirror.set_meta("last_sync", now_iso())
+        if full:
+            self.mirror.set_meta("last_full_sync", now_iso())
+        return pulled
+
+    def _device_id(self):
+        """Identifica esta cópia local nas chaves de idempotência dos movimentos (ver _replay)"""
+        device = self.mirror.get_meta("device_id")
+        if device is None:
+            device = uuid.uuid4().hex
+            self.mirror.set_meta("device_id", device)
+        return device
+
+    def _replay(self):
+        """
+        Envia a fila: todos os movimentos de stock num só adjust_stock_batch (deltas atómicos
+        no servidor) e 1 insert para a auditoria. Cada movimento leva a chave
+        "<device_id>:<id na fila>", para um reenvio depois de uma resposta perdida não somar
+        duas vezes. Os movimentos são deltas sobre o stock visto localmente; se o servidor
+        mudou entretanto o delta é aplicado sobre o valor do servidor e a diferença é
+        reportada como conflito.
+        O que o servidor recusa (stock insuficiente, variante apagada, ...) fica 'rejected'
+        com o erro no detalhe, para não bloquear o resto da fila.
+        """
+        conflicts = []
+        stock_items = self.mirror.pending("stock")
+        if stock_items:
+            device = self._device_id()
+            movements = [
+                {"variant_id": p["variant_id"], "warehouse_id": p["warehouse_id"], "delta": p["delta"],
+                 "key": f"{device}:{outbox_id}"}
+                for outbox_id, p in stock_items
+            ]
+            try:
+                rows = DB.adjust_stock_batch(self, movements)
+            except Exception as e:
+                if is_network_error(e):
+                    raise
+                # um erro desfaz o lote inteiro: um a um, para recusar só o movimento que falha
+                rows = []
+                for m in movements:
+                    try:
+                        rows.append(DB.adjust_stock(self, m["variant_id"], m["warehouse_id"], m["delta"], m["key"]))
+                    except Exception as item_error:
+                        if is_network_error(item_error):
+                            raise
+                        rows.append(item_error)
+
+            for (outbox_id, p), row in zip(stock_items, rows):
+                vid, wh, delta = p["variant_id"], p["warehouse_id"], p["delta"]
+                if isinstance(row, Exception):
+                    detail = f"variant_id={vid} warehouse_id={wh}: recusado pelo servidor ({row})"
+                    self.mirror.mark([outbox_id], "rejected", detail)
+                    # desfaz o movimento no espelho
+                    self.mirror.set_stock(vid, wh, self.mirror.get_stock(vid, wh) - delta)
+                    conflicts.append(detail)
+                    continue
+
+                self.mirror.set_stock(vid, wh, row["stock"])
+                if not row["applied"]:
+                    detail = (f"variant_id={vid} warehouse_id={wh}: stock insuficiente no servidor "
+                              f"(servidor={row['stock']}, delta={delta:+d})")
+                    self.mirror.mark([outbox_id], "rejected", detail)
+                    conflicts.append(detail)
+                    continue
+
+                current = row["stock"] - delta
+                if current != p["base_stock"]:
+                    detail = (f"variant_id={vid} warehouse_id={wh}: stock alterado no servidor "
+                              f"({p['base_stock']} -> {current}); aplicado delta {delta:+d} = {row['stock']}")
+                    self.mirror.mark([outbox_id], "merged", detail)
+                    conflicts.append(detail)
+                else:
+                    self.mirror.mark([outbox_id], "applied")
+
+        audit_items = self.mirror.pending("audit")
+        if audit_items:
+            try:
+                self.supabase.table('audit_logs').insert([p for _, p in audit_items]).execute()
+                self.mirror.mark([i for i, _ in audit_items], "applied")
+            except Exception as e:
+                if is_network_error(e):
+                    raise
+                # uma linha inválida não pode travar as outras: envia uma a uma
+                for outbox_id, p in audit_items:
+                    try:
+                        self.supabase.table('audit_logs').insert(p).execute()
+                    except Exception as item_error:
+                        if is_network_error(item_error):
+                            raise
+                        self.mirror.mark([outbox_id], "rejected", f"auditoria recusada pelo servidor ({item_error})")
+                    else:
+                        self.mirror.mark([outbox_id], "applied")
+
+        return len(stock_items) + len(audit_items), conflicts
+
+    def _try_flush(self):
+        """Tenta enviar a fila já; se outra sincronização estiver a correr, fica para ela"""
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._replay()
+            self.online = True
+        except Exception as e:
+            if not is_network_error(e):
+                raise
+            self.online = False
+        finally:
+            self._sync_lock.release()
+
+    # ------------------------------------------
+    # AUTH
+    # ------------------------------------------
+
+    def get_user_by_username(self, username):
+        try:
+            user = self._online_call(super().get_user_by_username, username)
+        except Exception as e:
+            if not is_network_error(e):
+                raise
+            return self.mirror.get_profile(username.strip())
+        if user:
+            self.mirror.cache_profile(user)
+        return user
+
+    # ------------------------------------------
+    # AUDIT (via fila)
+    # ------------------------------------------
+
+    def audit(self, user, action, entity, entity_pk=None, details=None):
+        self.mirror.enqueue("audit", self.audit_row(user, action, entity, entity_pk, details))
+        self._try_flush()
+
+    def audit_batch(self, user, entries):
+        for e in entries:
+            self.mirror.enqueue("audit", self.audit_row(user, **e))
+        self._try_flush()
+
+    # ------------------------------------------
+    # Leituras locais
+    # ------------------------------------------
+
+    def list_domain(self, table):
+        if not self.mirror.ready:
+            return super().list_domain(table)
+        return self.mirror.list_domain(table)
+
+    def list_subcategories_by_category(self, category_id):
+        if not self.mirror.ready:
+            return super().list_subcategories_by_category(category_id)
+        return self.mirror.list_subcategories_by_category(category_id)
+
+    def find_variant_by_gtin(self, gtin):
+        if not self.mirror.ready:
+            return super().find_variant_by_gtin(gtin)
+        rows = self.mirror.variants_where("v.gtin = ?", (gtin.strip(),))
+        return rows[0] if rows else None
+
+    def search_variants(self, search_value, search_type='gtin'):
+        if not self.mirror.ready:
+            return super().search_variants(search_value, search_type)
+        if search_type == 'modelo':
+            return self.mirror.variants_where("m.nome_modelo LIKE ? ESCAPE '\\'",
+                                              (f"%{escape_like(str(search_value).strip())}%",))
+        if search_type not in SEARCH_FIELDS:
+            raise ValueError("search_type inválido")
+        return self.mirror.variants_where(f"v.{SEARCH_FIELDS[search_type]} = ?", (str(search_value).strip(),))
+
+    def list_variant_index(self, updated_since=None):
+        if not self.mirror.ready:
+            return super().list_variant_index(updated_since)
+        if updated_since:
+            return self.mirror.variants_where("v.updated_at >= ?", (updated_since,))
+        return self.mirror.variants_where("1 = 1")
+
+    def get_full_view_by_variant_id(self, variant_id):
+        if not self.mirror.ready:
+            return super().get_full_view_by_variant_id(variant_id)
+        rows = self.mirror.variants_where("v.id = ?", (int(variant_id),))
+        if not rows:
+            return None
+        return rows[0], self.list_variant_stocks(rows[0]["variant_id"])
+
+    def get_full_view_by_gtin(self, search_value, search_type='gtin'):
+        if not self.mirror.ready:
+            return super().get_full_view_by_gtin(search_value, search_type)
+        if search_type not in SEARCH_FIELDS:
+            return None
+        rows = self.search_variants(search_value, search_type)
+        if not rows:
+            return None
+        return rows[0], self.list_variant_stocks(rows[0]["variant_id"])
+
+    def list_variant_stocks(self, variant_id):
+        if not self.mirror.ready:
+            return super().list_variant_stocks(variant_id)
+        return self.mirror.query(
+            "SELECT s.warehouse_id, w.name AS armazem, s.stock FROM warehouse_stock s "
+            "LEFT JOIN domains w ON w.tbl = 'warehouses' AND w.id = s.warehouse_id "
+            "WHERE s.variant_id = ? ORDER BY s.warehouse_id",
+            (int(variant_id),),
+        )
+
+    def list_stocks_for_variants(self, variant_ids):
+        if not self.mirror.ready:
+            return super().list_stocks_for_variants(variant_ids)
+        return {vid: self.list_variant_stocks(vid) for vid in variant_ids}
+
+    def get_stock(self, variant_id, warehouse_id):
+        if not self.mirror.ready:
+            return super().get_stock(variant_id, warehouse_id)
+        return self.mirror.get_stock(variant_id, warehouse_id)
+
+    def get_stock_rows(self, variant_ids, warehouse_ids):
+        if not self.mirror.ready:
+            return super().get_stock_rows(variant_ids, warehouse_ids)
+        if not variant_ids or not warehouse_ids:
+            return {}
+        vids, whs = [int(v) for v in variant_ids], [int(w) for w in warehouse_ids]
+        rows = self.mirror.query(
+            f"SELECT variant_id, warehouse_id, stock FROM warehouse_stock "
+            f"WHERE variant_id IN ({', '.join('?' * len(vids))}) AND warehouse_id IN ({', '.join('?' * len(whs))})",
+            (*vids, *whs),
+        )
+        return {(r['variant_id'], r['warehouse_id']): r['stock'] for r in rows}
+
+    def list_warehouse_stock(self, warehouse_id):
+        if not self.mirror.ready:
+            return super().list_warehouse_stock(warehouse_id)
+        return self.mirror.query(
+            f"SELECT s.stock, {VARIANT_COLUMNS} FROM warehouse_stock s "
+            f"JOIN product_variant v ON v.id = s.variant_id {DIMENSION_JOINS} "
+            "WHERE s.warehouse_id = ? ORDER BY v.gtin",
+            (int(warehouse_id),),
+        )
+
+    def variant_has_any_stock_rows(self, variant_id):
+        if not self.mirror.ready:
+            return super().variant_has_any_stock_rows(variant_id)
+        return bool(self.mirror.query("SELECT 1 FROM warehouse_stock WHERE variant_id = ? LIMIT 1", (int(variant_id),)))
+
+    # ------------------------------------------
+    # Stock (via fila)
+    # ------------------------------------------
+
+    def upsert_stock(self, variant_id, warehouse_id, stock):
+        self.upsert_stock_rows([{'variant_id': variant_id, 'warehouse_id': warehouse_id, 'stock': stock}])
+
+    def adjust_stock(self, variant_id, warehouse_id, delta, key=None):
+        vid, wh = int(variant_id), int(warehouse_id)
+        current = self.mirror.get_stock(vid, wh)
+        new_stock = current + int(delta)
+        if new_stock < 0:
+            return {'variant_id': vid, 'warehouse_id': wh, 'stock': current, 'applied': False}
+        self.upsert_stock_rows([{'variant_id': vid, 'warehouse_id': wh, 'stock': new_stock}])
+        return {'variant_id': vid, 'warehouse_id': wh, 'stock': new_stock, 'applied': True}
+
+    def adjust_stock_batch(self, movements, applied=None):
+        # tudo para a fila e um só envio (em vez de um por movimento); as chaves são as da fila (_replay)
+        applied = [] if applied is None else applied
+        for m in movements:
+            vid, wh, delta = int(m['variant_id']), int(m['warehouse_id']), int(m['delta'])
+            base = self.mirror.get_stock(vid, wh)
+            stock = base + delta
+            if stock < 0:
+                applied.append({'variant_id': vid, 'warehouse_id': wh, 'stock': base, 'applied': False})
+                continue
+            self.mirror.set_stock(vid, wh, stock)
+            self.mirror.enqueue("stock", {"variant_id": vid, "warehouse_id": wh, "delta": delta, "base_stock": base})
+            applied.append({'variant_id': vid, 'warehouse_id': wh, 'stock': stock, 'applied': True})
+        self._try_flush()
+        return applied
+
+    def upsert_stock_rows(self, rows):
+        for r in rows:
+            vid, wh, stock = int(r['variant_id']), int(r['warehouse_id']), int(r['stock'])
+            base = self.mirror.get_stock(vid, wh)
+            self.mirror.set_stock(vid, wh, stock)
+            self.mirror.enqueue("stock", {"variant_id": vid, "warehouse_id": wh,
+                                          "delta": stock - base, "base_stock": base})
+        self._try_flush()
+        return rows
+
+    # ------------------------------------------
+    # Escritas diretas (exigem ligação) refletidas no espelho
+    # ------------------------------------------
+
+    def get_or_create_simple_domain(self, table, value):
+        new_id = self._online_call(super().get_or_create_simple_domain, table, value)
+        self.mirror.put_domain(table, new_id, value.strip())
+        return new_id
+
+    def get_or_create_subcategory(self, category_id, name):
+        new_id = self._online_call(super().get_or_create_subcategory, category_id, name)
+        self.mirror.put_domain('subcategories', new_id, name.strip(), int(category_id))
+        return new_id
+
+    def get_or_create_model(self, nome_modelo, marca_id, categoria_id, subcategoria_id, fornecedor_id, ref=None):
+        model_id = self._online_call(super().get_or_create_model, nome_modelo, marca_id, categoria_id,
+                                     subcategoria_id, fornecedor_id, ref)
+        self.mirror.put_model(model_id, {
+            'ref': ref, 'nome_modelo': nome_modelo.strip(), 'marca_id': marca_id, 'categoria_id': categoria_id,
+            'subcategoria_id': subcategoria_id, 'fornecedor_id': fornecedor_id,
+        })
+        return model_id
+
+    def update_model(self, model_id, model_data):
+        self._online_call(super().update_model, model_id, model_data)
+        self.mirror.put_model(model_id, model_data)
+
+    def create_variant(self, model_id, gtin, cor_id, tamanho_id, ref_keyinvoice=None, ref_woocommerce=None):
+        variant_id = self._online_call(super().create_variant, model_id, gtin, cor_id, tamanho_id,
+                                       ref_keyinvoice, ref_woocommerce)
+        self.mirror.put_variant(variant_id, {
+            'model_id': model_id, 'gtin': gtin.strip(), 'cor_id': cor_id, 'tamanho_id': tamanho_id,
+            'ref_keyinvoice': ref_keyinvoice, 'ref_woocomerce': ref_woocommerce, 'updated_at': now_iso(),
+        })
+        return variant_id
+
+    def update_variant(self, variant_id, variant_data):
+        self._online_call(super().update_variant, variant_id, variant_data)
+        self.mirror.put_variant(variant_id, variant_data)
+
+    def delete_variant(self, variant_id):
+        self._online_call(super().delete_variant, variant_id)
+        self.mirror.delete_variant(variant_id)
+
+    def delete_stock_row(self, variant_id, warehouse_id):
+        self._online_call(super().delete_stock_row, variant_id, warehouse_id)
+        self.mirror.delete_stock(variant_id, warehouse_id)
@@ -1,12 +1,56 @@
-import bcrypt
+import time
+
 from db import DB
 
 
+class GtinCache:
+    """
+    GTIN -> variant_id por ttl segundos, para as vendas do WooCommerce não repetirem a pesquisa
+    da variante em cada linha. Só guarda GTINs encontrados (um produto novo aparece logo).
+    Uma variante apagada/alterada pode ser usada até ao fim do ttl; ttl=0 (por defeito) desliga
+    e só conta as pesquisas.
+    """
+
+    def __init__(self, ttl=0.0, max_size=50000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, gtin):
+        entry = self.entries.get(gtin)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put(self, gtin, variant_id):
+        if self.ttl <= 0:
+            return
+        if len(self.entries) >= self.max_size:
+            # limpa os expirados; se não chegar, recomeça do zero
+            now = time.monotonic()
+            self.entries = {g: e for g, e in self.entries.items() if e[1] > now}
+            if len(self.entries) >= self.max_size:
+                self.entries.clear()
+        self.entries[gtin] = (variant_id, time.monotonic() + self.ttl)
+
+    def invalidate(self, gtin):
+        self.entries.pop(gtin, None)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
 class ProductService:
     """Serviço com regras de negócio para produtos"""
     
-    def __init__(self, db: DB):
+    def __init__(self, db: DB, gtin_cache: GtinCache = None):
         self.db = db
+        self.gtin_cache = gtin_cache
 
     def create_or_update_product(self, gtin, nome_modelo, brand_id, category_id, 
                                  subcategory_id, supplier_id, color_id, size_id, 
@@ -86,29 +130,58 @@ class ProductService:
         self.db.upsert_stock(variant_id, warehouse_id, stock)
         return True, "Stock atualizado."
 
+    def adjust_stock(self, variant_id, warehouse_id, delta):
+        """
+        Soma (delta > 0) ou retira (delta < 0) quantidade ao stock numa só chamada.
+        Retorna (success: bool, message: str, row: dict) com a linha de stock resultante
+        """
+        return self._stock_result(delta, self.db.adjust_stock(variant_id, warehouse_id, delta))
+
+    def adjust_stock_batch(self, movements):
+        """
+        Vários movimentos numa só chamada e numa só transação (DB.adjust_stock_batch).
+        movements: [(variant_id, warehouse_id, delta)]
+        Retorna [(success, message, row)] pela mesma ordem, como adjust_stock
+        """
+        rows = self.db.adjust_stock_batch(
+            [{'variant_id': vid, 'warehouse_id': wh, 'delta': delta} for vid, wh, delta in movements])
+        return [self._stock_result(delta, row) for (_, _, delta), row in zip(movements, rows)]
+
+    @staticmethod
+    def _stock_result(delta, row):
+        if not row["applied"]:
+            return False, f"Stock insuficiente! Stock atual: {row['stock']}", row
+        if delta >= 0:
+            return True, f"Adicionado {delta}. Stock atual: {row['stock']}", row
+        return True, f"Retirado {-delta}. Stock atual: {row['stock']}", row
+
     def add_to_stock(self, variant_id, warehouse_id, quantity):
         """Adiciona quantidade ao stock existente"""
-        # Buscar stock atual
-        current_stock = self._get_current_stock(variant_id, warehouse_id)
-        new_stock = current_stock + quantity
-        self.db.upsert_stock(variant_id, warehouse_id, new_stock)
-        return True, f"Adicionado {quantity}. Stock atual: {new_stock}"
+        success, msg, _ = self.adjust_stock(variant_id, warehouse_id, quantity)
+        return success, msg
 
     def remove_from_stock(self, variant_id, warehouse_id, quantity):
         """Remove quantidade do stock existente"""
-        current_stock = self._get_current_stock(variant_id, warehouse_id)
-        new_stock = current_stock - quantity
-        if new_stock < 0:
-            return False, f"Stock insuficiente! Stock atual: {current_stock}"
-        self.db.upsert_stock(variant_id, warehouse_id, new_stock)
-        return True, f"Retirado {quantity}. Stock atual: {new_stock}"
+        success, msg, _ = self.adjust_stock(variant_id, warehouse_id, -quantity)
+        return success, msg
+
+    def add_stock_batch(self, movements, applied=None):
+        """
+        Aplica várias entradas de stock num só pedido, como deltas atómicos no servidor
+        (não sobrepõe vendas do WooCommerce que cheguem entretanto).
+        movements: {(variant_id, warehouse_id): quantidade}
+        applied: ver DB.adjust_stock_rows (o que ficou gravado, se o pedido falhar)
+        Retorna {(variant_id, warehouse_id): novo_stock}
+        """
+        if not movements:
+            return {}
+
+        rows = self.db.adjust_stock_rows(movements, applied)
+        return {key: row['stock'] for key, row in rows.items()}
 
     def _get_current_stock(self, variant_id, warehouse_id):
         """Obtém stock atual de uma variante num armazém"""
-        response = self.db.supabase.table('warehouse_stock').select('stock').eq('variant_id', variant_id).eq('warehouse_id', warehouse_id).execute()
-        if response.data:
-            return response.data[0]['stock']
-        return 0
+        return self.db.get_stock(variant_id, warehouse_id)
 
     def delete_stock(self, variant_id, warehouse_id):
         """
@@ -141,25 +214,30 @@ class ProductService:
         warehouse_id padrão = 1 (ajustar conforme necessário)
         Retorna (success: bool, message: str)
         """
-        # Verificar se produto existe
-        row = self.db.find_variant_by_gtin(gtin)
-        if not row:
-            return False, f"Produto com GTIN {gtin} não encontrado no sistema"
-        
-        variant_id = row["variant_id"]
-        
-        # Verificar stock atual
-        current_stock = self._get_current_stock(variant_id, warehouse_id)
-        
-        if current_stock < quantity:
-            return False, f"Stock insuficiente para GTIN {gtin}. Disponível: {current_stock}, Solicitado: {quantity}"
-        
-        # Baixar stock
-        new_stock = current_stock - quantity
-        self.db.upsert_stock(variant_id, warehouse_id, new_stock)
-        
-        return True, f"Stock baixado com sucesso. GTIN: {gtin}, Qtd: {quantity}, Stock restante: {new_stock}"
+        cache = self.gtin_cache
+        variant_id = cache.get(gtin) if cache is not None else None
+        if variant_id is None:
+            # Verificar se produto existe
+            row = self.db.find_variant_by_gtin(gtin)
+            if not row:
+                return False, f"Produto com GTIN {gtin} não encontrado no sistema"
 
+            variant_id = row["variant_id"]
+            if cache is not None:
+                cache.put(gtin, variant_id)
+
+        # Baixar stock (verificação e baixa numa só operação no servidor)
+        try:
+            stock_row = self.db.adjust_stock(variant_id, warehouse_id, -quantity)
+        except Exception:
+            # ex.: a variante em cache foi apagada entretanto
+            if cache is not None:
+                cache.invalidate(gtin)
+            raise
+        if not stock_row["applied"]:
+            return False, f"Stock insuficiente para GTIN {gtin}. Disponível: {stock_row['stock']}, Solicitado: {quantity}"
+
+        return True, f"Stock baixado com sucesso. GTIN: {gtin}, Qtd: {quantity}, Stock restante: {stock_row['stock']}"
 
 class AuthService:
     """Serviço de autenticação"""
@@ -172,6 +250,8 @@ class AuthService:
         Cria novo utilizador com senha hasheada.
         Retorna user_id
         """
+        import bcrypt  # só é preciso no registo/login; não atrasa o arranque
+
         pw_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
         user_id = self.db.create_user(username, nome_usuario, setor, pw_hash)
         return user_id
@@ -188,6 +268,8 @@ class AuthService:
         if not user.get("is_active", True):
             return "inactive"
         
+        import bcrypt
+
         if bcrypt.checkpw(password.encode("utf-8"), user["password_hash"].encode("utf-8")):
             return {
                 "user_id": user["user_id"],
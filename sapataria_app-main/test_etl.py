@@ -0,0 +1,325 @@
+"""
+Testes do ETL (SCRIPT_ETL/) contra o backend local (fake_postgrest.py): as funções puras
+(validacao.py, impressoes_digitais.py, checkpoint.py, reconciliacao.py) e o ETL inteiro (etl_excel_to_supabase.main) sobre folhas geradas por gerar_catalogo.py.
+
+    python test_etl.py        (ou pytest test_etl.py)
+"""
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(APP_DIR, "SCRIPT_ETL"))
+
+import etl_excel_to_supabase as etl
+import fake_postgrest
+from gerar_catalogo import CatalogSpec, generate, seed_fake, sheet_rows, write_sheet
+from checkpoint import Checkpoint
+from impressoes_digitais import compute_delta, load_state, sheet_fingerprints
+from reconciliacao import diff_stock, validate_counts
+from validacao import gtin_check_digit_ok, validate_frame
+
+
+def new_server(name):
+    """Base nova em memória, só com os armazéns (o ETL cria o resto)"""
+    url = f"fake://:memory:test_etl_{name}"
+    fake_postgrest.close_server(url)
+    server = fake_postgrest.get_server(url)
+    server.seed("warehouses", [{"name": "Loja"}, {"name": "Armazem"}])
+    return url, server
+
+
+def run_etl(url, workdir, *argv):
+    """etl.main com SUPABASE_URL=url, a gravar de verdade, com os ficheiros do ETL em workdir"""
+    env = {"SUPABASE_URL": url, "DRY_RUN": "false"}
+    previous = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            etl.main([*argv, "--workers", "1"])
+    finally:
+        os.chdir(cwd)
+        for k, v in previous.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        logger = logging.getLogger("etl")
+        for handler in logger.handlers:
+            handler.close()
+        logger.handlers.clear()
+
+
+def server_rows(server, table, select):
+    rows, _ = server._get(server._table(table), [("select", select)], {}, {})
+    return rows
+
+
+def server_gtins(server):
+    return {r["gtin"] for r in server_rows(server, "product_variant", "gtin")}
+
+
+def server_stock(server):
+    return {(r["variant_id"], r["warehouse_id"]): r["stock"]
+            for r in server_rows(server, "warehouse_stock", "variant_id,warehouse_id,stock")}
+
+
+# -----------------------------
+# validacao.py
+# -----------------------------
+def test_gtin_check_digit():
+    gtins = pd.Series(["5601234567892", "5601234567890", "96385074", "0012345678905", "123", None])
+    assert gtin_check_digit_ok(gtins).tolist() == [True, False, True, True, False, False]
+
+
+def test_validate_frame():
+    base = {"categoria": "Senhora", "subcategoria": "Sandálias", "marca": "Sorriso",
+            "nome": "Hélia", "cor": "Azul", "tamanho": "38"}
+    df = pd.DataFrame([
+        {**base, "gtin": "5601234567892"},
+        {**base, "gtin": None},
+        {**base, "gtin": "123"},
+        {**base, "gtin": "5601234567890"},
+        {**base, "gtin": "5601234567892", "nome": None},
+        {**base, "gtin": "1234567890123456"},
+    ])
+    valid, rejects = validate_frame(df)
+    assert valid.index.tolist() == [0, 5]
+    assert rejects["reason_code"].tolist() == ["GTIN_MISSING", "GTIN_TOO_SHORT", "GTIN_CHECK_DIGIT", "REQUIRED_EMPTY"]
+
+    valid, rejects = validate_frame(df, strict_gtin=True)
+    assert valid.index.tolist() == [0]
+    assert rejects.loc[5, "reason_code"] == "GTIN_LENGTH"
+
+
+def test_etl_rejects_invalid_rows():
+    url, server = new_server("rejects")
+    rows = sheet_rows(generate(CatalogSpec(variants=40, seed=5)))
+    rows[0]["CODIGO DE BARRAS"] = ""
+    rows[1]["CODIGO DE BARRAS"] = "000"
+    rows[2]["Nome"] = ""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "folha.csv")
+        write_sheet(rows, path)
+        run_etl(url, workdir, "--input", path)
+        rejects = pd.read_csv(os.path.join(workdir, etl.DEFAULT_REJECTS_FILE), dtype=str)
+
+    assert sorted(rejects["reason_code"]) == ["GTIN_MISSING", "GTIN_TOO_SHORT", "REQUIRED_EMPTY"]
+    assert server_gtins(server) == {r["CODIGO DE BARRAS"] for r in rows[3:]}
+
+
+# -----------------------------
+# impressoes_digitais.py (--delta)
+# -----------------------------
+def test_fingerprints_and_delta():
+    df = pd.DataFrame([
+        {c: f"{c}-{i}" for c in ["ref_keyinvoice", "ref_woocomerce", "categoria", "subcategoria",
+                                 "marca", "nome", "cor", "tamanho", "gtin"]}
+        for i in range(3)
+    ])
+    before = sheet_fingerprints(df, "Fornecedor")
+    assert sheet_fingerprints(df, "Fornecedor") == before
+    assert sheet_fingerprints(df, "Outro") != before  # o fornecedor também vai para o modelo
+
+    df.loc[1, "cor"] = "outra"
+    df.loc[2, "gtin"] = "gtin-novo"
+    delta = compute_delta(sheet_fingerprints(df, "Fornecedor"), before)
+    assert (delta.added, delta.changed, delta.unchanged, delta.removed) == (
+        {"gtin-novo"}, {"gtin-1"}, {"gtin-0"}, {"gtin-2"})
+
+
+def test_etl_delta_only_sends_changed_rows():
+    url, server = new_server("delta")
+    rows = sheet_rows(generate(CatalogSpec(variants=40, seed=6)))
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "folha.csv")
+        write_sheet(rows, path)
+        run_etl(url, workdir, "--input", path, "--delta")
+        state_file = os.path.join(workdir, etl.DEFAULT_STATE_FILE)
+        assert set(load_state(state_file)) == {r["CODIGO DE BARRAS"] for r in rows}
+
+        # sem alterações: nenhuma escrita
+        server.calls.clear()
+        run_etl(url, workdir, "--input", path, "--delta")
+        assert not [call for call in server.calls if not call.startswith("GET")]
+
+        # uma linha alterada (outro tamanho): só essa variante muda
+        changed = rows[0]["CODIGO DE BARRAS"]
+        rows[0]["TAMANHO"] = "99"
+        write_sheet(rows, path)
+        run_etl(url, workdir, "--input", path, "--delta")
+
+    sizes = {r["id"]: r["value"] for r in server_rows(server, "sizes", "id,value")}
+    variants = {r["gtin"]: sizes[r["tamanho_id"]] for r in server_rows(server, "product_variant", "gtin,tamanho_id")}
+    assert variants[changed] == "99"
+    assert len(variants) == len(rows)
+
+
+# -----------------------------
+# checkpoint.py (--resume)
+# -----------------------------
+def test_checkpoint_round_trip():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "checkpoint.json")
+        saved = Checkpoint(path, "assinatura", etl.Stats(models_created=2))
+        saved.model_ids[("REF", 1, 2, None)] = 10
+        saved.variant_ids["5601234567892"] = 20
+        saved.stock_done.add(20)
+        saved.save()
+
+        loaded = Checkpoint(path, "assinatura", etl.Stats(models_created=1))
+        assert loaded.load()
+        assert (loaded.model_ids, loaded.variant_ids, loaded.stock_done) == (
+            {("REF", 1, 2, None): 10}, {"5601234567892": 20}, {20})
+        assert loaded.stats.models_created == 3  # soma ao relatório da retomada
+
+        assert not Checkpoint(path, "outra folha", etl.Stats()).load()
+        loaded.clear()
+        assert not os.path.exists(path)
+
+
+def test_etl_resume_after_interruption():
+    url, server = new_server("resume")
+    rows = sheet_rows(generate(CatalogSpec(variants=40, seed=7)))
+    handle = server.handle
+
+    def interrupt_on_stock(method, path, *args, **kwargs):
+        if method.upper() == "POST" and path.rstrip("/").endswith("warehouse_stock"):
+            raise KeyboardInterrupt
+        return handle(method, path, *args, **kwargs)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "folha.csv")
+        write_sheet(rows, path)
+        server.handle = interrupt_on_stock
+        try:
+            run_etl(url, workdir, "--input", path, "--concurrency", "1")
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("o ETL devia ter sido interrompido")
+        finally:
+            server.handle = handle
+        assert os.path.exists(os.path.join(workdir, etl.DEFAULT_CHECKPOINT_FILE))
+        assert server.count("warehouse_stock") == 0
+
+        # a retomada só envia o stock: modelos e variantes vêm do checkpoint
+        server.calls.clear()
+        run_etl(url, workdir, "--input", path, "--resume")
+        writes = {call for call in server.calls if not call.startswith("GET")}
+        assert writes == {"POST warehouse_stock"}, writes
+        assert not os.path.exists(os.path.join(workdir, etl.DEFAULT_CHECKPOINT_FILE))
+
+    assert server_gtins(server) == {r["CODIGO DE BARRAS"] for r in rows}
+    assert server.count("warehouse_stock") == len(rows) * 2
+
+
+# -----------------------------
+# reconciliacao.py (reconcile)
+# -----------------------------
+def test_validate_counts():
+    df = pd.DataFrame([
+        {"gtin": "5601234567892", "warehouse": "Loja", "qty": "3"},
+        {"gtin": "5601234567892", "warehouse": "2", "qty": "0"},
+        {"gtin": "5601234567892", "warehouse": None, "qty": "1"},
+        {"gtin": "123", "warehouse": "loja", "qty": "1"},
+        {"gtin": "5601234567892", "warehouse": "loja", "qty": "1.5"},
+        {"gtin": "5601234567892", "warehouse": "Sótão", "qty": "1"},
+    ])
+    warehouses = {"1": 1, "2": 2, "loja": 1, "armazem": 2}
+    valid, rejects = validate_counts(df, warehouses, default_warehouse="Armazem")
+    assert valid[["warehouse_id", "qty"]].values.tolist() == [[1, 3], [2, 0], [2, 1]]
+    assert rejects["reason_code"].tolist() == ["GTIN_TOO_SHORT", "QTY_INVALID", "WAREHOUSE_UNKNOWN"]
+
+
+def test_diff_stock():
+    counts = pd.DataFrame({"variant_id": [1, 2, 3, 4], "warehouse_id": [1, 1, 1, 1],
+                           "gtin": ["a", "b", "c", "d"], "qty": [5, 2, 0, 4]})
+    current = pd.DataFrame({"variant_id": [1, 2, 9], "warehouse_id": [1, 1, 1], "stock": [3, 2, 7]})
+
+    changes = diff_stock(counts, current)
+    assert changes[["gtin", "after", "diff"]].values.tolist() == [["a", 5, 2], ["d", 4, 4]]
+    assert changes["before"].isna().tolist() == [False, True]
+
+    # contagem completa: o que não foi contado (variante 9) passa a 0
+    changes = diff_stock(counts, current, whole_warehouses=True)
+    zeroed = changes[~changes["counted"]]
+    assert zeroed[["variant_id", "after", "diff"]].values.tolist() == [[9, 0, -7]]
+
+
+def test_etl_reconcile():
+    url = "fake://:memory:test_etl_reconcile"
+    fake_postgrest.close_server(url)
+    server = fake_postgrest.get_server(url)
+    catalog = generate(CatalogSpec(variants=30, seed=8))
+    ids = seed_fake(catalog, server)
+    loja, armazem = ids["warehouses"]["Loja"], ids["warehouses"]["Armazem"]
+    gtins = [v["gtin"] for v in catalog.variants]
+    vids = ids["variant_ids"]
+    before = server_stock(server)
+
+    def in_loja(i):
+        return before.get((vids[i], loja), 0)
+
+    count = pd.DataFrame([
+        {"GTIN": gtins[0], "Armazém": "Loja", "Quantidade": in_loja(0) + 2},
+        {"GTIN": gtins[1], "Armazém": "Loja", "Quantidade": in_loja(1)},
+        {"GTIN": gtins[2], "Armazém": "loja", "Quantidade": 1},   # duas prateleiras: soma
+        {"GTIN": gtins[2], "Armazém": str(loja), "Quantidade": 2},
+        {"GTIN": "5601234567892", "Armazém": "Loja", "Quantidade": 1},
+        {"GTIN": gtins[3], "Armazém": "Sótão", "Quantidade": 1},
+        {"GTIN": gtins[3], "Armazém": "Loja", "Quantidade": -1},
+    ])
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "contagem.csv")
+        count.to_csv(path, index=False)
+        run_etl(url, workdir, "reconcile", "--input", path)
+        audit = pd.read_csv(os.path.join(workdir, etl.DEFAULT_AUDIT_FILE), dtype={"gtin": str})
+        rejects = pd.read_csv(os.path.join(workdir, etl.DEFAULT_REJECTS_FILE), dtype=str)
+
+    after = server_stock(server)
+    assert after[(vids[0], loja)] == in_loja(0) + 2
+    assert after[(vids[2], loja)] == 3
+    assert sorted(rejects["reason_code"]) == ["GTIN_UNKNOWN", "QTY_INVALID", "WAREHOUSE_UNKNOWN"]
+    # só o que mudou é escrito e auditado; o resto do stock fica igual
+    assert set(audit["gtin"]) == {gtins[0]} | ({gtins[2]} if in_loja(2) != 3 else set())
+    counted = {(vids[0], loja), (vids[2], loja)}
+    assert {k: v for k, v in after.items() if k not in counted} == {k: v for k, v in before.items() if k not in counted}
+
+    # contagem completa do Armazem com um só GTIN: o resto do Armazem passa a 0
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "contagem.csv")
+        pd.DataFrame([{"GTIN": gtins[0], "Quantidade": 4}]).to_csv(path, index=False)
+        run_etl(url, workdir, "reconcile", "--input", path, "--warehouse", "Armazem", "--full-count")
+    after = server_stock(server)
+    assert {k: v for k, v in after.items() if k[1] == armazem and v} == {(vids[0], armazem): 4}
+
+
+TESTS = [
+    test_gtin_check_digit,
+    test_validate_frame,
+    test_etl_rejects_invalid_rows,
+    test_fingerprints_and_delta,
+    test_etl_delta_only_sends_changed_rows,
+    test_checkpoint_round_trip,
+    test_etl_resume_after_interruption,
+    test_validate_counts,
+    test_diff_stock,
+    test_etl_reconcile,
+]
+
+if __name__ == "__main__":
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+            raise SystemExit(1)
@@ -7,11 +7,16 @@ load_dotenv()
 url = os.environ.get("SUPABASE_URL")
 key = os.environ.get("SUPABASE_KEY")
 
-if not url or not key:
+if url and url.startswith("fake://"):
+    # backend local em SQLite (fake_postgrest.py), sem tocar no projeto Supabase
+    import fake_postgrest
+
+    supabase = fake_postgrest.create_client(url)
+elif not url or not key:
     print("ERRO: Variáveis SUPABASE_URL ou SUPABASE_KEY não encontradas no .env")
     exit(1)
-
-supabase = create_client(url, key)
+else:
+    supabase = create_client(url, key)
 
 print("Testando busca de produtos...")
 
@@ -0,0 +1,103 @@
+"""
+Teste do modo scanner (ui/tabs/scan_window.py) contra o backend local (fake_postgrest.py):
+leituras, envio em lote e reposição das leituras quando o envio falha.
+
+    python test_scan.py        (ou pytest test_scan.py)
+"""
+import os
+
+# base nova em memória, nunca o projeto Supabase do .env
+os.environ["SUPABASE_URL"] = "fake://:memory:test_scan"
+
+import fake_postgrest
+from db import DB
+from gerar_catalogo import CatalogSpec, generate, seed_fake
+from services import ProductService
+from ui.tabs.scan_window import ScanBatch
+
+BOGUS_VARIANT = 10 ** 9  # não existe: o servidor recusa (foreign key)
+
+
+def setup():
+    fake_postgrest.close_server(os.environ["SUPABASE_URL"])
+    server = fake_postgrest.get_server(os.environ["SUPABASE_URL"])
+    ids = seed_fake(generate(CatalogSpec(variants=6, seed=7)), server)
+    db = DB()
+    return db, ProductService(db), ids["warehouses"]["Loja"], ids["variant_ids"][:3]
+
+
+def stocks(db, keys):
+    return {key: db.get_stock(*key) for key in keys}
+
+
+def test_scan_and_flush():
+    db, service, wh, variants = setup()
+    keys = [(vid, wh) for vid in variants]
+    before = stocks(db, keys)
+
+    batch = ScanBatch()
+    for key in keys + keys[:1]:
+        batch.add(key, 2)
+    assert batch.units() == 8
+
+    sent_batch = batch.start()
+    assert batch.flushing and not batch.pending
+    assert batch.start() is None  # um lote de cada vez
+    batch.add(keys[1], 1)  # leitura durante o envio fica para o próximo lote
+
+    new_stock = batch.send(service, sent_batch)
+    sent = batch.done()
+    assert sent == {keys[0]: 4, keys[1]: 2, keys[2]: 2}
+    assert not batch.flushing and batch.pending == {keys[1]: 1}
+
+    after = stocks(db, keys)
+    for key in keys:
+        assert after[key] == before[key] + sent[key]
+        assert new_stock[key] == after[key]
+
+
+def test_failed_flush_requeues_only_unsent():
+    db, service, wh, variants = setup()
+    keys = [(vid, wh) for vid in variants]
+    before = stocks(db, keys)
+
+    batch = ScanBatch()
+    for key in keys:
+        batch.add(key, 3)
+    batch.add((BOGUS_VARIANT, wh), 1)
+
+    sent_batch = batch.start()
+    try:
+        batch.send(service, sent_batch)
+    except Exception:
+        batch.failed()
+    else:
+        raise AssertionError("o envio devia ter falhado")
+    assert not batch.flushing
+    assert batch.pending.get((BOGUS_VARIANT, wh)) == 1
+
+    # nada é contado duas vezes: servidor + pendente = lido
+    after = stocks(db, keys)
+    for key in keys:
+        assert after[key] - before[key] + batch.pending.get(key, 0) == 3
+
+    # sem a leitura inválida, o reenvio completa o que faltava
+    batch.pending.pop((BOGUS_VARIANT, wh))
+    retry = batch.start()
+    if retry:
+        batch.send(service, retry)
+        batch.done()
+    assert batch.units() == 0
+    after = stocks(db, keys)
+    for key in keys:
+        assert after[key] == before[key] + 3
+
+
+if __name__ == "__main__":
+    for test in (test_scan_and_flush, test_failed_flush_requeues_only_unsent):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+            raise SystemExit(1)
@@ -0,0 +1,446 @@
+"""
+Tracing das operações na base de dados (DB.supabase e quem o usa diretamente, como as views do Django).
+
+Cada pedido (o .execute() de uma query ou RPC) gera um span com: operação (o método do DB ou a
+função que chamou db.supabase), tabela, método (select/insert/upsert/update/delete/rpc), filtros,
+linhas devolvidas, tamanho do payload enviado/recebido, duração e erro. Os spans vão para os sinks:
+  - LogSink           linha no log (opcionalmente só os lentos, slow_ms)
+  - RingBufferSink    últimos N spans em memória, com resumo por operação (para encontrar os lentos)
+  - JsonLinesSink     um JSON por linha num ficheiro
+  - OTelSink          spans do OpenTelemetry (precisa do opentelemetry-api; ou um exporter próprio)
+
+Sem sinks o tracing está desligado e não custa nada: DB.supabase devolve o cliente original.
+
+Ligar por variável de ambiente (lida ao importar db.py):
+    DB_TRACE=log                            # só log
+    DB_TRACE=ring,jsonl:/tmp/db_trace.jsonl # buffer em memória + ficheiro
+    DB_TRACE=otel
+    DB_TRACE_SLOW_MS=200                    # LogSink só regista pedidos com >= 200 ms
+ou em código:
+    from tracing import tracer, RingBufferSink
+    ring = tracer.add_sink(RingBufferSink(2000))
+    ...
+    for row in ring.summary(): print(row)
+
+Para agrupar vários pedidos (ex.: um webhook inteiro) num span pai:
+    with tracer.span("webhook_woocommerce", order_id=123):
+        ...
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("sapataria.db")
+
+# métodos do query builder que definem o tipo de pedido
+QUERY_METHODS = ("select", "insert", "upsert", "update", "delete")
+
+# valores maiores que isto são cortados nos filtros (ex.: in.(...) com mil ids)
+MAX_FILTER_VALUE = 80
+
+
+@dataclass
+class Span:
+    name: str                          # operação: método do DB ou função que fez o pedido
+    table: Optional[str] = None
+    method: Optional[str] = None       # select | insert | upsert | update | delete | rpc
+    filters: List[str] = field(default_factory=list)
+    rows: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    duration_ms: float = 0.0
+    start: float = 0.0                 # epoch em segundos
+    error: Optional[str] = None
+    trace_id: str = ""
+    span_id: str = ""
+    parent_id: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+# span pai atual (por thread / tarefa asyncio)
+_current: ContextVar[Optional[Span]] = ContextVar("db_trace_parent", default=None)
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def _payload_size(value: Any) -> int:
+    if value is None:
+        return 0
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def _short(value: Any) -> str:
+    if isinstance(value, (list, tuple, set)):
+        values = list(value)
+        text = ",".join(str(v) for v in values[:5])
+        return f"({text},…{len(values)} valores)" if len(values) > 5 else f"({text})"
+    text = str(value)
+    return text if len(text) <= MAX_FILTER_VALUE else text[:MAX_FILTER_VALUE] + "…"
+
+
+def _describe(name: str, args: tuple, kwargs: dict) -> str:
+    """eq('gtin', '123') -> 'gtin=eq.123'; order('id') -> 'order=id'"""
+    if len(args) >= 2 and isinstance(args[0], str):
+        op = name.rstrip("_")
+        return f"{args[0]}={op}.{_short(args[1])}" if len(args) == 2 else f"{args[0]}={op}.{_short(args[1:])}"
+    values = [_short(a) for a in args] + [f"{k}={_short(v)}" for k, v in kwargs.items()]
+    return f"{name}={','.join(values)}" if values else name
+
+
+class Tracer:
+    """Distribui os spans pelos sinks. enabled é False enquanto não houver sinks"""
+
+    def __init__(self):
+        self.sinks: List[Any] = []
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks = [*self.sinks, sink]
+            self.enabled = True
+        return sink
+
+    def remove_sink(self, sink) -> None:
+        with self._lock:
+            self.sinks = [s for s in self.sinks if s is not sink]
+            self.enabled = bool(self.sinks)
+        close = getattr(sink, "close", None)
+        if close:
+            close()
+
+    def clear(self) -> None:
+        for sink in list(self.sinks):
+            self.remove_sink(sink)
+
+    def find(self, kind):
+        """Primeiro sink do tipo dado (ex.: tracer.find(RingBufferSink)), ou None"""
+        return next((s for s in self.sinks if isinstance(s, kind)), None)
+
+    def emit(self, span: Span) -> None:
+        for sink in self.sinks:
+            try:
+                sink.emit(span)
+            except Exception:
+                # um sink com problemas nunca pode partir a operação na base de dados
+                logger.exception("Falha no sink de tracing %s", type(sink).__name__)
+
+    def _start(self, name: str, **kwargs) -> Span:
+        parent = _current.get()
+        return Span(
+            name=name,
+            start=time.time(),
+            trace_id=parent.trace_id if parent else _new_id(16),
+            span_id=_new_id(8),
+            parent_id=parent.span_id if parent else None,
+            **kwargs,
+        )
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Span pai para agrupar os pedidos feitos dentro do bloco (não faz nada com o tracing desligado)"""
+        if not self.enabled:
+            yield None
+            return
+        span = self._start(name, attributes=attributes)
+        token = _current.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            span.duration_ms = (time.perf_counter() - started) * 1000
+            self.emit(span)
+
+    def wrap(self, client, operation: str):
+        """Cliente do supabase que regista cada pedido como um span desta operação"""
+        return TracedClient(self, client, operation)
+
+
+tracer = Tracer()
+
+
+# -----------------------------
+# Cliente instrumentado
+# -----------------------------
+class TracedClient:
+    """Proxy do cliente do supabase: table()/from_()/rpc() devolvem queries instrumentadas"""
+
+    def __init__(self, tracer: Tracer, client, operation: str):
+        self._tracer = tracer
+        self._client = client
+        self._operation = operation
+
+    def table(self, name: str):
+        return TracedQuery(self._tracer, self._client.table(name), self._operation, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[dict] = None, *args, **kwargs):
+        builder = self._client.rpc(fn, params if params is not None else {}, *args, **kwargs)
+        return TracedQuery(self._tracer, builder, self._operation, fn, method="rpc", payload=params)
+
+    def __getattr__(self, name):
+        # auth, storage, etc. passam sem instrumentação
+        return getattr(self._client, name)
+
+
+class TracedQuery:
+    """Acompanha a cadeia do query builder (filtros, payload) e mede o execute()"""
+
+    def __init__(self, tracer: Tracer, builder, operation: str, table: str, method: Optional[str] = None,
+                 filters: Optional[List[str]] = None, payload: Any = None):
+        self._tracer = tracer
+        self._builder = builder
+        self._operation = operation
+        self._table = table
+        self._method = method
+        self._filters = filters or []
+        self._payload = payload
+
+    def _chain(self, builder, method, filters, payload):
+        return TracedQuery(self._tracer, builder, self._operation, self._table, method, filters, payload)
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            # ex.: .not_ devolve o próprio builder, com a negação para o filtro seguinte
+            if hasattr(attr, "execute"):
+                return self._chain(attr, self._method, [*self._filters, name.rstrip("_")], self._payload)
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if not hasattr(result, "execute"):
+                return result
+            method, filters, payload = self._method, self._filters, self._payload
+            if name in QUERY_METHODS and method in (None, "select"):
+                method = name
+                if name != "select":
+                    payload = args[0] if args else kwargs.get("json")
+                elif args and args != ("*",):
+                    filters = [*filters, f"select={_short(','.join(args))}"]
+            elif filters and filters[-1] == "not":
+                column, _, rest = _describe(name, args, kwargs).partition("=")
+                filters = [*filters[:-1], f"{column}=not.{rest}"]
+            else:
+                filters = [*filters, _describe(name, args, kwargs)]
+            return self._chain(result, method, filters, payload)
+
+        return call
+
+    def execute(self):
+        span = self._tracer._start(
+            self._operation, table=self._table, method=self._method or "select", filters=self._filters,
+            request_bytes=_payload_size(self._payload),
+        )
+        started = time.perf_counter()
+        try:
+            response = self._builder.execute()
+        except Exception as e:
+            code = getattr(e, "code", None)
+            span.error = f"{code}: {getattr(e, 'message', e)}" if code else f"{type(e).__name__}: {e}"
+            raise
+        else:
+            data = getattr(response, "data", None)
+            span.rows = len(data) if isinstance(data, list) else int(data is not None)
+            span.response_bytes = _payload_size(data)
+            count = getattr(response, "count", None)
+            if count is not None:
+                span.attributes["count"] = count
+            return response
+        finally:
+            span.duration_ms = (time.perf_counter() - started) * 1000
+            self._tracer.emit(span)
+
+
+# -----------------------------
+# Sinks
+# -----------------------------
+class LogSink:
+    """Uma linha de log por span (só os que demoram >= slow_ms)"""
+
+    def __init__(self, log: Optional[logging.Logger] = None, slow_ms: float = 0.0, level: int = logging.INFO):
+        self.log = log or logger
+        self.slow_ms = slow_ms
+        self.level = level
+
+    def emit(self, span: Span) -> None:
+        if span.duration_ms < self.slow_ms and not span.error:
+            return
+        target = f"{span.method} {span.table}" if span.table else "span"
+        self.log.log(
+            logging.WARNING if span.error else self.level,
+            "db %s | %s | %s | %d linhas | %d/%d bytes | %.1f ms%s",
+            span.name, target, " ".join(span.filters) or "-", span.rows, span.request_bytes,
+            span.response_bytes, span.duration_ms, f" | ERRO {span.error}" if span.error else "",
+        )
+
+
+class RingBufferSink:
+    """Os últimos `size` spans em memória"""
+
+    def __init__(self, size: int = 1000):
+        self.buffer: deque = deque(maxlen=size)
+
+    def emit(self, span: Span) -> None:
+        self.buffer.append(span)
+
+    def spans(self) -> List[Span]:
+        return list(self.buffer)
+
+    def clear(self) -> None:
+        self.buffer.clear()
+
+    def slowest(self, n: int = 10) -> List[Span]:
+        return sorted(self.buffer, key=lambda s: s.duration_ms, reverse=True)[:n]
+
+    def summary(self) -> List[dict]:
+        """Por (operação, tabela, método): nº de pedidos, tempo total/médio/máximo, linhas e bytes; mais lentos primeiro"""
+        groups: Dict[tuple, List[Span]] = {}
+        for span in list(self.buffer):
+            if span.table is not None:
+                groups.setdefault((span.name, span.table, span.method), []).append(span)
+        out = []
+        for (name, table, method), spans in groups.items():
+            durations = [s.duration_ms for s in spans]
+            out.append({
+                "operation": name, "table": table, "method": method, "calls": len(spans),
+                "total_ms": round(sum(durations), 1), "avg_ms": round(sum(durations) / len(spans), 1),
+                "max_ms": round(max(durations), 1), "rows": sum(s.rows for s in spans),
+                "response_bytes": sum(s.response_bytes for s in spans),
+                "errors": sum(1 for s in spans if s.error),
+            })
+        return sorted(out, key=lambda r: r["total_ms"], reverse=True)
+
+
+class JsonLinesSink:
+    """Acrescenta cada span como uma linha JSON ao ficheiro"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def emit(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OTelSink:
+    """
+    Spans no modelo do OpenTelemetry. Sem exporter usa o opentelemetry-api (o SDK/exporter configurado
+    na aplicação decide para onde vão); com exporter, chama exporter(dict) com o span já convertido
+    (trace_id, span_id, parent_span_id, name, start/end em ns, attributes, status).
+    """
+
+    def __init__(self, exporter: Optional[Callable[[dict], None]] = None, service_name: str = "sapataria"):
+        self.exporter = exporter
+        self.service_name = service_name
+        self._otel = None
+        if exporter is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise RuntimeError("OTelSink sem exporter precisa do opentelemetry-api (pip install opentelemetry-api)")
+            self._otel = trace
+            self._tracer = trace.get_tracer(service_name)
+
+    @staticmethod
+    def attributes(span: Span) -> dict:
+        attrs = {
+            "db.system": "postgresql",
+            "code.function": span.name,
+            "db.response.returned_rows": span.rows,
+            "sapataria.request_bytes": span.request_bytes,
+            "sapataria.response_bytes": span.response_bytes,
+        }
+        if span.table is not None:
+            attrs["db.collection.name"] = span.table
+            attrs["db.operation.name"] = span.method
+        if span.filters:
+            attrs["db.query.summary"] = " ".join(span.filters)
+        for key, value in span.attributes.items():
+            attrs[f"sapataria.{key}"] = value if isinstance(value, (str, bool, int, float)) else str(value)
+        return attrs
+
+    def emit(self, span: Span) -> None:
+        start_ns = int(span.start * 1e9)
+        end_ns = start_ns + int(span.duration_ms * 1e6)
+        name = f"{span.method} {span.table}" if span.table else span.name
+        if self.exporter is not None:
+            self.exporter({
+                "trace_id": span.trace_id, "span_id": span.span_id, "parent_span_id": span.parent_id,
+                "name": name, "kind": "CLIENT" if span.table else "INTERNAL",
+                "start_time_unix_nano": start_ns, "end_time_unix_nano": end_ns,
+                "attributes": self.attributes(span),
+                "status": {"code": "ERROR", "message": span.error} if span.error else {"code": "OK"},
+                "resource": {"service.name": self.service_name},
+            })
+            return
+
+        trace = self._otel
+        otel_span = self._tracer.start_span(
+            name, start_time=start_ns, attributes=self.attributes(span),
+            kind=trace.SpanKind.CLIENT if span.table else trace.SpanKind.INTERNAL,
+        )
+        if span.error:
+            otel_span.set_status(trace.Status(trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=end_ns)
+
+
+# -----------------------------
+# Configuração
+# -----------------------------
+def configure(spec: Optional[str], slow_ms: float = 0.0) -> List[Any]:
+    """
+    Liga os sinks descritos em spec ('log', 'ring[:N]', 'jsonl:<ficheiro>', 'otel'), separados por vírgulas.
+    Retorna os sinks criados.
+    """
+    sinks = []
+    for item in (spec or "").split(","):
+        kind, _, arg = item.strip().partition(":")
+        kind = kind.lower()
+        if not kind:
+            continue
+        if kind == "log":
+            sinks.append(LogSink(slow_ms=slow_ms))
+        elif kind == "ring":
+            sinks.append(RingBufferSink(int(arg) if arg else 1000))
+        elif kind == "jsonl":
+            sinks.append(JsonLinesSink(arg or "db_trace.jsonl"))
+        elif kind == "otel":
+            sinks.append(OTelSink())
+        else:
+            raise ValueError(f"DB_TRACE: sink desconhecido '{kind}' (log, ring, jsonl, otel)")
+    for sink in sinks:
+        tracer.add_sink(sink)
+    return sinks
+
+
+def configure_from_env() -> List[Any]:
+    spec = os.getenv("DB_TRACE", "").strip()
+    if not spec:
+        return []
+    return configure(spec, slow_ms=float(os.getenv("DB_TRACE_SLOW_MS", "").strip() or 0))
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
 from typing import TYPE_CHECKING
@@ -10,6 +12,10 @@ from ui.components.dialogs import AddOptionDialog
 if TYPE_CHECKING:
     from ui.main import App
 
+# Pesquisa enquanto se escreve: espera (ms) após a última tecla e nº mínimo de caracteres
+LIVE_SEARCH_DELAY_MS = 200
+LIVE_SEARCH_MIN_CHARS = 2
+
 
 def safe_int(s, default=None):
     """Converte string para int com segurança"""
@@ -40,6 +46,37 @@ def paste_from_clipboard(widget):
         messagebox.showwarning("Atenção", "Não há texto no clipboard.")
 
 
+def run_in_background(widget, func, on_success=None, on_error=None, poll_ms=50):
+    """
+    Executa func numa thread de fundo e entrega o resultado na thread do Tk.
+    O Tk não é thread-safe, por isso o resultado é recolhido por polling com after().
+    """
+    result = queue.Queue(maxsize=1)
+
+    def worker():
+        try:
+            result.put((True, func()))
+        except Exception as e:
+            result.put((False, e))
+
+    def poll():
+        try:
+            ok, value = result.get_nowait()
+        except queue.Empty:
+            try:
+                widget.after(poll_ms, poll)
+            except tk.TclError:
+                pass  # widget já foi destruído
+            return
+        if ok and on_success:
+            on_success(value)
+        elif not ok and on_error:
+            on_error(value)
+
+    threading.Thread(target=worker, daemon=True).start()
+    widget.after(poll_ms, poll)
+
+
 class BaseTab(ttk.Frame):
     """Tab base com funcionalidades comuns"""
 
@@ -50,6 +87,35 @@ class BaseTab(ttk.Frame):
         self.domain_service: DomainService = app.domain_service
         self.cache = {}
 
+    def bind_live_search(self, entry, callback, delay_ms=LIVE_SEARCH_DELAY_MS):
+        """Chama callback quando o utilizador pára de escrever no entry (debounce)"""
+        self._live_after_id = None
+
+        def on_key(event):
+            if event.keysym in ("Return", "KP_Enter", "Tab", "Up", "Down"):
+                return
+            if self._live_after_id:
+                self.after_cancel(self._live_after_id)
+            self._live_after_id = self.after(delay_ms, callback)
+
+        entry.bind("<KeyRelease>", on_key)
+
+    def find_variants(self, value, search_type, allow_server=True, exact=True):
+        """
+        Pesquisa primeiro no índice local do catálogo (sem rede);
+        só vai ao servidor se o índice não tiver resultados.
+        exact=True (botão Buscar/Enter) procura o código completo, como o servidor;
+        a pesquisa enquanto se escreve usa exact=False (prefixo).
+        """
+        catalog = self.app.catalog
+        if catalog.loaded:
+            results = catalog.search(value, search_type, exact=exact)
+            if results:
+                return results
+        if not allow_server:
+            return []
+        return self.db.search_variants(value, search_type)
+
     def load_domains(self):
         """Carrega todos os domínios"""
         self.cache["brands"] = self.domain_service.get_domain_list("brands")
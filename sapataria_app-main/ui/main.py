@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import os
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, messagebox
 
+from catalog import CatalogIndex
 from db import DB
+from local_store import LocalMirror, OfflineDB
 from services import ProductService, AuthService, DomainService
+from ui.components.helpers import run_in_background
 from ui.login import LoginFrame
 from ui.tabs.create_tab import CreateTab
 from ui.tabs.update_tab import UpdateTab
@@ -12,6 +16,17 @@ from ui.tabs.delete_tab import DeleteTab
 from ui.tabs.view_tab import ViewTab
 from ui.tabs.warehouse_tab import WarehouseTab
 
+# Intervalo (ms) entre refreshes incrementais do índice do catálogo
+CATALOG_REFRESH_MS = 60_000
+
+# Intervalo (ms) entre sincronizações com o Supabase (envio da fila + alterações remotas)
+SYNC_INTERVAL_MS = 30_000
+
+MIRROR_PATH = os.environ.get(
+    "LOCAL_MIRROR_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "local_mirror.sqlite3"),
+)
+
 
 class App(tk.Tk):
     """Aplicação principal"""
@@ -26,10 +41,54 @@ class App(tk.Tk):
         self.product_service = ProductService(db)
         self.auth_service = AuthService(db)
         self.domain_service = DomainService(db)
+        self.catalog = CatalogIndex(db)
 
         self.db.init_app_tables()
+        self.sync_status = ""
+        self.syncing = False
         self.show_login()
 
+        # liga ao Supabase enquanto o utilizador escreve as credenciais;
+        # uma falha aqui volta a aparecer (com mensagem) no login
+        run_in_background(self, self.db.warm_up)
+
+        if isinstance(self.db, OfflineDB):
+            self.sync_now()
+        self.refresh_catalog()
+
+    def refresh_catalog(self):
+        """Atualiza o índice local do catálogo em segundo plano (pesquisa enquanto se escreve, scanner)"""
+        run_in_background(self, self.catalog.refresh,
+                          on_success=lambda n: self.after(CATALOG_REFRESH_MS, self.refresh_catalog),
+                          on_error=lambda e: self.after(CATALOG_REFRESH_MS, self.refresh_catalog))
+
+    def sync_now(self):
+        """Sincroniza o espelho local em segundo plano e reagenda a próxima sincronização"""
+        if self.syncing:
+            return
+        self.syncing = True
+        run_in_background(self, self.db.sync, on_success=self._on_sync_done, on_error=self._on_sync_error)
+
+    def _on_sync_done(self, report):
+        self.syncing = False
+        pending = self.db.mirror.pending_count()
+        state = "Online" if report["online"] else "Offline"
+        self.sync_status = f"{state} | Pendentes: {pending}"
+        self.event_generate("<<SyncStatus>>")
+        if report["conflicts"]:
+            messagebox.showwarning(
+                "Conflitos de sincronização",
+                "Alguns movimentos feitos offline encontraram stock diferente no servidor:\n\n"
+                + "\n".join(report["conflicts"][:10]),
+            )
+        self.after(SYNC_INTERVAL_MS, self.sync_now)
+
+    def _on_sync_error(self, error):
+        self.syncing = False
+        self.sync_status = f"Erro de sincronização: {error}"
+        self.event_generate("<<SyncStatus>>")
+        self.after(SYNC_INTERVAL_MS, self.sync_now)
+
     def show_login(self):
         for w in self.winfo_children():
             w.destroy()
@@ -55,6 +114,11 @@ class MainFrame(ttk.Frame):
         ttk.Label(top, text=f"Utilizador: {app.user['nome_usuario']}  |  Setor: {app.user.get('setor') or '-'}",
                  font=("Segoe UI", 10, "bold")).pack(side="left")
         ttk.Button(top, text="Sair", command=self.logout).pack(side="right")
+        if isinstance(app.db, OfflineDB):
+            ttk.Button(top, text="Sincronizar", command=app.sync_now).pack(side="right", padx=(0, 8))
+            self.lbl_sync = ttk.Label(top, text=app.sync_status)
+            self.lbl_sync.pack(side="right", padx=(0, 12))
+            app.bind("<<SyncStatus>>", self._on_sync_status)
 
         nb = ttk.Notebook(self)
         nb.pack(fill="both", expand=True, pady=(10, 0))
@@ -71,6 +135,10 @@ class MainFrame(ttk.Frame):
         nb.add(self.tab_view, text="Visualizar")
         nb.add(self.tab_warehouse, text="Armazéns")
 
+    def _on_sync_status(self, event=None):
+        if self.winfo_exists():
+            self.lbl_sync.config(text=self.app.sync_status)
+
     def logout(self):
         self.app.db.audit(self.app.user, "LOGOUT", "profiles",
                          entity_pk=f"user_id={self.app.user['user_id']}", details={})
@@ -80,7 +148,7 @@ class MainFrame(ttk.Frame):
 
 def main():
     """Função principal"""
-    db = DB()
+    db = OfflineDB(LocalMirror(MIRROR_PATH))
     app = App(db)
     app.mainloop()
 
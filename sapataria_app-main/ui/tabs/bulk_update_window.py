@@ -128,8 +128,7 @@ class BulkUpdateWindow(tk.Toplevel):
 
     def _load_warehouses(self):
         try:
-            response = self.db.supabase.table('warehouses').select('id, name').execute()
-            warehouses = {row['name']: row['id'] for row in response.data}
+            warehouses = {name: wh_id for wh_id, name in self.db.list_domain('warehouses')}
             self.warehouse_name_to_id = warehouses
             self.combo_warehouse['values'] = list(warehouses.keys())
             if self.combo_warehouse['values']:
@@ -216,12 +215,10 @@ class BulkUpdateWindow(tk.Toplevel):
                 if already_exists:
                     continue
 
-                stock_response = self.db.supabase.table('warehouse_stock').select(
-                    'stock, warehouses(name)'
-                ).eq('variant_id', variant_id).execute()
+                stock_rows = self.db.list_variant_stocks(variant_id)
 
-                if stock_response.data:
-                    stocks = [f"{s['warehouses']['name']}: {s['stock']}" for s in stock_response.data]
+                if stock_rows:
+                    stocks = [f"{s['armazem']}: {s['stock']}" for s in stock_rows]
                     stock_text = " | ".join(stocks)
                 else:
                     stock_text = "Sem stock"
@@ -312,19 +309,14 @@ class BulkUpdateWindow(tk.Toplevel):
                 elif operation == "remove":
                     success, msg = self.app.product_service.remove_from_stock(variant_id, wh_id, quantity)
                 else:
-                    current_response = self.db.supabase.table('warehouse_stock').select('stock').eq(
-                        'variant_id', variant_id).eq('warehouse_id', wh_id).execute()
-                    if current_response.data:
-                        current_stock = current_response.data[0]['stock']
-                        diff = quantity - current_stock
-                        if diff > 0:
-                            success, msg = self.app.product_service.add_to_stock(variant_id, wh_id, diff)
-                        elif diff < 0:
-                            success, msg = self.app.product_service.remove_from_stock(variant_id, wh_id, abs(diff))
-                        else:
-                            success, msg = True, f"Stock já está em {quantity}"
+                    current_stock = self.db.get_stock(variant_id, wh_id)
+                    diff = quantity - current_stock
+                    if diff > 0:
+                        success, msg = self.app.product_service.add_to_stock(variant_id, wh_id, diff)
+                    elif diff < 0:
+                        success, msg = self.app.product_service.remove_from_stock(variant_id, wh_id, abs(diff))
                     else:
-                        success, msg = self.app.product_service.add_to_stock(variant_id, wh_id, quantity)
+                        success, msg = True, f"Stock já está em {quantity}"
 
                 if success:
                     self.log(f"✓ {produto_info}")
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+from typing import TYPE_CHECKING
+
+from ui.components.helpers import safe_int, run_in_background
+
+if TYPE_CHECKING:
+    from ui.main import App
+
+
+class ScanBatch:
+    """
+    Quantidades lidas e ainda não enviadas, e o lote em envio.
+    Sem Tk, para o envio e a reposição em caso de falha poderem ser testados (test_scan.py).
+    """
+
+    def __init__(self):
+        # (variant_id, warehouse_id) -> quantidade ainda não enviada
+        self.pending = {}
+        # lote em envio e, preenchido pela thread, o que dele já ficou gravado no servidor
+        self.in_flight = {}
+        self.applied = {}
+
+    @property
+    def flushing(self):
+        return bool(self.in_flight)
+
+    def add(self, key, qty):
+        self.pending[key] = self.pending.get(key, 0) + qty
+
+    def quantity(self, key):
+        return self.pending.get(key, 0) + self.in_flight.get(key, 0)
+
+    def units(self):
+        return sum(self.pending.values()) + sum(self.in_flight.values())
+
+    def start(self):
+        """Passa as leituras pendentes para o lote em envio; retorna o lote (ou None se não houver nada)"""
+        if self.flushing or not self.pending:
+            return None
+        self.in_flight, self.pending = self.pending, {}
+        self.applied = {}
+        return dict(self.in_flight)
+
+    def send(self, product_service, batch):
+        """Corre na thread de fundo"""
+        return product_service.add_stock_batch(batch, self.applied)
+
+    def done(self):
+        """Lote gravado; retorna-o"""
+        sent, self.in_flight = self.in_flight, {}
+        return sent
+
+    def failed(self):
+        """
+        Falha no envio: volta para pending só o que não chegou a ser gravado
+        (o resto não pode ser somado outra vez). Retorna o que ficou gravado.
+        """
+        sent = {key: qty for key, qty in self.in_flight.items() if key in self.applied}
+        for key, qty in self.in_flight.items():
+            if key not in self.applied:
+                self.add(key, qty)
+        self.in_flight = {}
+        return sent
+
+
+class ScanWindow(tk.Toplevel):
+    """
+    Modo scanner para receção de mercadoria.
+    Cada leitura é resolvida no índice local e acumulada em memória;
+    as quantidades são enviadas em lote a cada N segundos ou a pedido.
+    """
+
+    def __init__(self, parent, app: App):
+        super().__init__(parent)
+        self.app = app
+        self.db = app.db
+        self.catalog = app.catalog
+        self.title("Modo Scanner - Entrada de Stock")
+        self.geometry("900x620")
+        self.resizable(True, True)
+
+        # leituras por enviar e lote em envio
+        self.batch = ScanBatch()
+        self.scan_count = 0
+
+        main_frame = ttk.Frame(self, padding=10)
+        main_frame.pack(fill="both", expand=True)
+
+        ttk.Label(main_frame, text="Modo Scanner", font=("Segoe UI", 14, "bold")).grid(
+            row=0, column=0, columnspan=6, sticky="w", pady=(0, 12))
+
+        ttk.Label(main_frame, text="Armazém:").grid(row=1, column=0, sticky="w")
+        self.var_warehouse = tk.StringVar()
+        self.combo_warehouse = ttk.Combobox(main_frame, textvariable=self.var_warehouse, width=28, state="readonly")
+        self.combo_warehouse.grid(row=1, column=1, sticky="w", padx=(0, 12))
+
+        ttk.Label(main_frame, text="Qtd por leitura:").grid(row=1, column=2, sticky="w")
+        self.qty_per_scan = ttk.Entry(main_frame, width=6)
+        self.qty_per_scan.insert(0, "1")
+        self.qty_per_scan.grid(row=1, column=3, sticky="w", padx=(0, 12))
+
+        ttk.Label(main_frame, text="Enviar a cada (s):").grid(row=1, column=4, sticky="w")
+        self.flush_seconds = ttk.Entry(main_frame, width=6)
+        self.flush_seconds.insert(0, "10")
+        self.flush_seconds.grid(row=1, column=5, sticky="w")
+
+        ttk.Label(main_frame, text="GTIN:").grid(row=2, column=0, sticky="w", pady=(12, 0))
+        self.entry_scan = ttk.Entry(main_frame, width=30, font=("Segoe UI", 12))
+        self.entry_scan.grid(row=2, column=1, columnspan=2, sticky="w", pady=(12, 0))
+        self.entry_scan.bind("<Return>", lambda e: self.on_scan())
+
+        btn_frame = ttk.Frame(main_frame)
+        btn_frame.grid(row=2, column=3, columnspan=3, sticky="w", pady=(12, 0))
+        ttk.Button(btn_frame, text="Enviar agora", command=self.flush).pack(side="left", padx=(0, 8))
+        ttk.Button(btn_frame, text="Fechar", command=self.on_close).pack(side="left")
+
+        self.lbl_feedback = tk.Label(main_frame, text="", font=("Segoe UI", 12, "bold"), anchor="w")
+        self.lbl_feedback.grid(row=3, column=0, columnspan=6, sticky="ew", pady=(10, 6))
+
+        cols = ("gtin", "modelo", "cor", "tamanho", "pendente", "stock")
+        self.tree = ttk.Treeview(main_frame, columns=cols, show="headings", height=14)
+        self.tree.grid(row=4, column=0, columnspan=6, sticky="nsew")
+
+        self.tree.heading("gtin", text="GTIN")
+        self.tree.heading("modelo", text="Modelo")
+        self.tree.heading("cor", text="Cor")
+        self.tree.heading("tamanho", text="Tamanho")
+        self.tree.heading("pendente", text="Por enviar")
+        self.tree.heading("stock", text="Stock (após envio)")
+
+        self.tree.column("gtin", width=130, anchor="w")
+        self.tree.column("modelo", width=200, anchor="w")
+        self.tree.column("cor", width=110, anchor="w")
+        self.tree.column("tamanho", width=80, anchor="w")
+        self.tree.column("pendente", width=90, anchor="center")
+        self.tree.column("stock", width=130, anchor="center")
+
+        self.lbl_status = ttk.Label(main_frame, text="", font=("Segoe UI", 9))
+        self.lbl_status.grid(row=5, column=0, columnspan=6, sticky="w", pady=(8, 0))
+
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(4, weight=1)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self._load_warehouses()
+        self._refresh_index()
+        self._schedule_flush()
+        self.entry_scan.focus_set()
+
+    def _load_warehouses(self):
+        whs = self.app.domain_service.get_domain_list("warehouses")
+        self.warehouse_name_to_id = {r[1]: r[0] for r in whs}
+        self.combo_warehouse["values"] = list(self.warehouse_name_to_id.keys())
+        if self.combo_warehouse["values"]:
+            self.var_warehouse.set(self.combo_warehouse["values"][0])
+
+    # ------------------------------------------
+    # Índice GTIN
+    # ------------------------------------------
+
+    def _refresh_index(self):
+        if not self.catalog.loaded:
+            self.lbl_status.config(text="A carregar índice de GTINs...")
+        run_in_background(self, self.catalog.refresh,
+                          on_success=lambda n: self._update_status(),
+                          on_error=lambda e: self.lbl_status.config(text=f"Falha ao atualizar índice: {e}"))
+
+    # ------------------------------------------
+    # Leituras
+    # ------------------------------------------
+
+    def on_scan(self):
+        gtin = self.entry_scan.get().strip()
+        self.entry_scan.delete(0, tk.END)
+        if not gtin:
+            return
+
+        wh_id = self.warehouse_name_to_id.get(self.var_warehouse.get())
+        if not wh_id:
+            messagebox.showwarning("Atenção", "Escolhe um armazém.", parent=self)
+            return
+
+        qty = safe_int(self.qty_per_scan.get(), None)
+        if qty is None or qty <= 0:
+            messagebox.showwarning("Atenção", "Quantidade por leitura inválida.", parent=self)
+            return
+
+        entry = self.catalog.lookup_gtin(gtin)
+        if entry:
+            self._register_scan(entry, wh_id, qty)
+            return
+
+        # GTIN fora do índice: confirma no servidor sem bloquear as próximas leituras
+        self._feedback(f"A procurar {gtin} no servidor...", "#b58900")
+        run_in_background(self, lambda: self.db.search_variants(gtin, "gtin"),
+                          on_success=lambda res: self._on_remote_lookup(gtin, res, wh_id, qty),
+                          on_error=lambda e: self._feedback(f"✗ {gtin}: erro na pesquisa ({e})", "#c0392b"))
+
+    def _on_remote_lookup(self, gtin, results, wh_id, qty):
+        if not results:
+            self.bell()
+            self._feedback(f"✗ GTIN desconhecido: {gtin}", "#c0392b")
+            return
+        entry = results[0]
+        self.catalog.add(entry)
+        self._register_scan(entry, wh_id, qty)
+
+    def _register_scan(self, entry, wh_id, qty):
+        self.batch.add((entry["variant_id"], wh_id), qty)
+        self.scan_count += 1
+
+        self._upsert_row(entry, wh_id)
+        self._feedback(
+            f"✓ +{qty}  {entry.get('nome_modelo') or ''} | {entry.get('cor') or ''} | Tam: {entry.get('tamanho') or ''}",
+            "#2e7d32",
+        )
+        self._update_status()
+
+    def _row_iid(self, variant_id, wh_id):
+        return f"{variant_id}:{wh_id}"
+
+    def _upsert_row(self, entry, wh_id, stock=None):
+        iid = self._row_iid(entry["variant_id"], wh_id)
+        pending = self.batch.quantity((entry["variant_id"], wh_id))
+
+        if self.tree.exists(iid):
+            values = list(self.tree.item(iid, "values"))
+            values[4] = pending
+            if stock is not None:
+                values[5] = stock
+            self.tree.item(iid, values=values)
+            self.tree.move(iid, "", 0)
+        else:
+            self.tree.insert("", 0, iid=iid, values=(
+                entry.get("gtin") or "",
+                entry.get("nome_modelo") or "",
+                entry.get("cor") or "",
+                entry.get("tamanho") or "",
+                pending,
+                stock if stock is not None else "",
+            ))
+
+    # ------------------------------------------
+    # Envio em lote
+    # ------------------------------------------
+
+    def _schedule_flush(self):
+        seconds = safe_int(self.flush_seconds.get(), 10) or 10
+        self.after(max(1, seconds) * 1000, self._periodic_flush)
+
+    def _periodic_flush(self):
+        self.flush()
+        self._schedule_flush()
+
+    def flush(self):
+        batch = self.batch.start()
+        if batch is None:
+            return
+        self._update_status()
+
+        run_in_background(
+            self, lambda: self.batch.send(self.app.product_service, batch),
+            on_success=self._on_flush_ok, on_error=self._on_flush_error,
+        )
+
+    def _audit_batch(self, batch):
+        """Auditoria à parte: se falhar, o stock já enviado não volta para a fila"""
+        user = self.app.user
+        run_in_background(self, lambda: self.db.audit(
+            user,
+            "SCAN_ADD_STOCK",
+            "warehouse_stock",
+            details={
+                "movements": [
+                    {"variant_id": vid, "warehouse_id": wh, "quantity": qty}
+                    for (vid, wh), qty in batch.items()
+                ]
+            },
+        ))
+
+    def _on_flush_ok(self, new_stock):
+        sent = self.batch.done()
+        self._audit_batch(sent)
+
+        for (vid, wh), stock in new_stock.items():
+            entry = self.catalog.get(vid) or {"variant_id": vid}
+            self._upsert_row(entry, wh, stock=stock)
+
+        self.lbl_status.config(text=f"Enviadas {sum(sent.values())} unidades ({len(sent)} variações).")
+        self.after(1500, self._update_status)
+
+    def _on_flush_error(self, error):
+        applied = self.batch.applied
+        sent = self.batch.failed()
+        if sent:
+            self._audit_batch(sent)
+            for key, row in applied.items():
+                entry = self.catalog.get(key[0]) or {"variant_id": key[0]}
+                self._upsert_row(entry, key[1], stock=row["stock"])
+        self.bell()
+        self.lbl_status.config(text=f"Falha ao enviar lote (será repetido): {error}")
+
+    # ------------------------------------------
+    # Estado
+    # ------------------------------------------
+
+    def _feedback(self, text, color):
+        self.lbl_feedback.config(text=text, fg=color)
+
+    def _update_status(self):
+        pending_units = self.batch.units()
+        index_info = f"{len(self.catalog)} GTINs no índice" if self.catalog.loaded else "índice a carregar"
+        self.lbl_status.config(
+            text=f"Leituras: {self.scan_count} | Por enviar: {pending_units} unidades | {index_info}"
+        )
+
+    def on_close(self):
+        if self.batch.units():
+            if messagebox.askyesno("Leituras por enviar", "Há leituras por enviar. Enviar agora antes de fechar?",
+                                   parent=self):
+                self.flush()
+                self._close_when_flushed()
+                return
+        self.destroy()
+
+    def _close_when_flushed(self):
+        if self.batch.flushing:
+            self.after(200, self._close_when_flushed)
+            return
+        if self.batch.pending:
+            messagebox.showerror("Erro", "Não foi possível enviar todas as leituras.", parent=self)
+            return
+        self.destroy()
@@ -3,8 +3,9 @@ from __future__ import annotations
 import tkinter as tk
 from tkinter import ttk, messagebox
 
-from ui.components.helpers import BaseTab, safe_int
+from ui.components.helpers import BaseTab, safe_int, run_in_background, LIVE_SEARCH_MIN_CHARS
 from ui.tabs.bulk_update_window import BulkUpdateWindow
+from ui.tabs.scan_window import ScanWindow
 
 
 class UpdateTab(BaseTab):
@@ -30,17 +31,23 @@ class UpdateTab(BaseTab):
         ttk.Radiobutton(search_frame, text="Ref KeyInvoice", variable=self.var_search_type,
                        value="ref_keyinvoice").pack(side="left", padx=(0, 10))
         ttk.Radiobutton(search_frame, text="Ref WooCommerce", variable=self.var_search_type,
-                       value="ref_woocommerce").pack(side="left")
+                       value="ref_woocommerce").pack(side="left", padx=(0, 10))
+        ttk.Radiobutton(search_frame, text="Modelo", variable=self.var_search_type,
+                       value="modelo").pack(side="left")
 
         ttk.Label(self, text="Código:").grid(row=2, column=0, sticky="w", pady=(6, 0))
         self.search_value = ttk.Entry(self, width=28)
         self.search_value.grid(row=2, column=1, sticky="w", padx=(0, 8), pady=(6, 0))
+        self.search_value.bind("<Return>", lambda e: self.search_variants())
+        self.bind_live_search(self.search_value, self.live_search)
 
         ttk.Button(self, text="Procurar", command=self.search_variants).grid(row=2, column=2, sticky="w", pady=(6, 0))
         ttk.Button(self, text="Carregar selecionado", command=self.load_selected_variant).grid(
             row=2, column=3, sticky="w", pady=(6, 0))
         ttk.Button(self, text="Alteração em Massa", command=self.bulk_update_stock).grid(
             row=2, column=4, sticky="w", padx=(8, 0), pady=(6, 0))
+        ttk.Button(self, text="Modo Scanner", command=self.open_scan_mode).grid(
+            row=2, column=5, sticky="w", padx=(8, 0), pady=(6, 0))
 
         cols = ("variant_id", "gtin", "modelo", "cor", "tamanho", "ref_keyinvoice", "ref_woocomerce")
         self.tree = ttk.Treeview(self, columns=cols, show="headings", height=6)
@@ -128,29 +135,13 @@ class UpdateTab(BaseTab):
             return
 
         try:
-            results = self.db.search_variants(value, search_type)
-
-            for iid in self.tree.get_children():
-                self.tree.delete(iid)
+            results = self.find_variants(value, search_type)
+            self._show_results(results)
 
             if not results:
                 messagebox.showinfo("Não encontrado", "Nenhuma variação encontrada para esse código.")
                 return
 
-            for r in results:
-                self.tree.insert(
-                    "", "end",
-                    values=(
-                        r["variant_id"],
-                        r.get("gtin") or "",
-                        r.get("nome_modelo") or "",
-                        r.get("cor") or "",
-                        r.get("tamanho") or "",
-                        r.get("ref_keyinvoice") or "",
-                        r.get("ref_woocomerce") or "",
-                    )
-                )
-
             if len(results) == 1:
                 self.tree.selection_set(self.tree.get_children()[0])
                 self.load_selected_variant()
@@ -158,6 +149,31 @@ class UpdateTab(BaseTab):
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao buscar.\n\n{e}")
 
+    def live_search(self):
+        """Pesquisa no índice local enquanto o utilizador escreve (sem ir ao servidor)"""
+        value = self.search_value.get().strip()
+        if len(value) < LIVE_SEARCH_MIN_CHARS or not self.app.catalog.loaded:
+            return
+        self._show_results(self.find_variants(value, self.var_search_type.get(), allow_server=False, exact=False))
+
+    def _show_results(self, results):
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+
+        for r in results:
+            self.tree.insert(
+                "", "end",
+                values=(
+                    r["variant_id"],
+                    r.get("gtin") or "",
+                    r.get("nome_modelo") or "",
+                    r.get("cor") or "",
+                    r.get("tamanho") or "",
+                    r.get("ref_keyinvoice") or "",
+                    r.get("ref_woocomerce") or "",
+                )
+            )
+
     def load_selected_variant(self):
         sel = self.tree.selection()
         if not sel:
@@ -197,28 +213,15 @@ class UpdateTab(BaseTab):
             self.var_color.set(self.color_id_to_name.get(header["cor_id"], ""))
             self.var_size.set(self.size_id_to_name.get(header["tamanho_id"], ""))
 
-            self.txt_stock_info.config(state="normal")
-            self.txt_stock_info.delete("1.0", tk.END)
+            self.loaded_stocks = list(stocks)
+            self._render_stock_info()
 
+            self.stock.delete(0, tk.END)
             if stocks:
-                self.txt_stock_info.insert(tk.END, "Stock disponível nos armazéns:\n\n")
-                total_stock = 0
-                for s in stocks:
-                    self.txt_stock_info.insert(tk.END, f"  • {s['armazem']}: {s['stock']} unidades\n")
-                    total_stock += s['stock']
-                self.txt_stock_info.insert(tk.END, f"\n📦 Total geral: {total_stock} unidades")
-
                 wh_name = stocks[0]["armazem"]
                 if wh_name in self.combo_warehouse["values"]:
                     self.var_warehouse.set(wh_name)
-                self.stock.delete(0, tk.END)
                 self.stock.insert(0, str(stocks[0]["stock"]))
-            else:
-                self.txt_stock_info.insert(tk.END, "⚠️ Nenhum stock registado em armazéns.\n\n")
-                self.txt_stock_info.insert(tk.END, "Use os botões 'Adicionar' para criar stock.")
-                self.stock.delete(0, tk.END)
-
-            self.txt_stock_info.config(state="disabled")
 
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao carregar.\n\n{e}")
@@ -303,6 +306,7 @@ class UpdateTab(BaseTab):
     def clear(self):
         self.loaded_variant_id = None
         self.loaded_gtin = None
+        self.loaded_stocks = []
         self.lbl_gtin.config(text="Item carregado: -")
         self.nome_modelo.delete(0, tk.END)
         self.ref_keyinvoice.delete(0, tk.END)
@@ -376,14 +380,12 @@ class UpdateTab(BaseTab):
             return
 
         try:
-            success, msg = self.app.product_service.add_to_stock(self.loaded_variant_id, wh_id, quantity)
+            success, msg, row = self.app.product_service.adjust_stock(self.loaded_variant_id, wh_id, quantity)
+            self._apply_stock_row(row)
             if success:
-                self.app.db.audit(self.app.user, "ADD_STOCK", "warehouse_stock",
-                                entity_pk=f"variant_id={self.loaded_variant_id},warehouse_id={wh_id}",
-                                details={"quantity_added": quantity})
+                self._audit_in_background("ADD_STOCK", wh_id, {"quantity_added": quantity})
                 messagebox.showinfo("OK", msg)
                 self.stock.delete(0, tk.END)
-                self._refresh_stock_display()
             else:
                 messagebox.showerror("Erro", msg)
         except Exception as e:
@@ -405,14 +407,12 @@ class UpdateTab(BaseTab):
             return
 
         try:
-            success, msg = self.app.product_service.remove_from_stock(self.loaded_variant_id, wh_id, quantity)
+            success, msg, row = self.app.product_service.adjust_stock(self.loaded_variant_id, wh_id, -quantity)
+            self._apply_stock_row(row)
             if success:
-                self.app.db.audit(self.app.user, "REMOVE_STOCK", "warehouse_stock",
-                                entity_pk=f"variant_id={self.loaded_variant_id},warehouse_id={wh_id}",
-                                details={"quantity_removed": quantity})
+                self._audit_in_background("REMOVE_STOCK", wh_id, {"quantity_removed": quantity})
                 messagebox.showinfo("OK", msg)
                 self.stock.delete(0, tk.END)
-                self._refresh_stock_display()
             else:
                 messagebox.showerror("Erro", msg)
         except Exception as e:
@@ -429,43 +429,62 @@ class UpdateTab(BaseTab):
             return
 
         try:
-            response = self.db.supabase.table('warehouse_stock').select('stock').eq('variant_id', self.loaded_variant_id).eq('warehouse_id', wh_id).execute()
-            if response.data:
-                current = response.data[0]['stock']
-                messagebox.showinfo("Stock Atual", f"Armazém: {self.var_warehouse.get()}\nStock atual: {current}")
-            else:
-                messagebox.showinfo("Stock Atual", f"Armazém: {self.var_warehouse.get()}\nStock atual: 0 (sem registo)")
+            current = self.db.get_stock(self.loaded_variant_id, wh_id)
+            messagebox.showinfo("Stock Atual", f"Armazém: {self.var_warehouse.get()}\nStock atual: {current}")
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao consultar stock.\n\n{e}")
 
-    def _refresh_stock_display(self):
-        if not self.loaded_variant_id:
+    def _apply_stock_row(self, row):
+        """Atualiza o stock mostrado a partir da linha devolvida pela operação (sem recarregar a variante)"""
+        if not self.loaded_variant_id or str(row["variant_id"]) != str(self.loaded_variant_id):
             return
 
-        try:
-            full = self.db.get_full_view_by_variant_id(self.loaded_variant_id)
-            if not full:
-                return
+        wh_id = row["warehouse_id"]
+        stock = row.get("stock")
+        if stock is None:
+            # a operação não devolveu o stock: relê só este armazém
+            stock = self.db.get_stock(self.loaded_variant_id, wh_id)
 
-            header, stocks = full
+        for s in self.loaded_stocks:
+            if s["warehouse_id"] == wh_id:
+                s["stock"] = stock
+                break
+        else:
+            name = self.warehouse_id_to_name.get(wh_id) or self.var_warehouse.get()
+            self.loaded_stocks.append({"warehouse_id": wh_id, "armazem": name, "stock": stock})
 
-            self.txt_stock_info.config(state="normal")
-            self.txt_stock_info.delete("1.0", tk.END)
+        self._render_stock_info()
 
-            if stocks:
-                self.txt_stock_info.insert(tk.END, "Stock disponível nos armazéns:\n\n")
-                total_stock = 0
-                for s in stocks:
-                    self.txt_stock_info.insert(tk.END, f"  • {s['armazem']}: {s['stock']} unidades\n")
-                    total_stock += s['stock']
-                self.txt_stock_info.insert(tk.END, f"\n📦 Total geral: {total_stock} unidades")
-            else:
-                self.txt_stock_info.insert(tk.END, "⚠️ Nenhum stock registado em armazéns.\n\n")
-                self.txt_stock_info.insert(tk.END, "Use os botões 'Adicionar' para criar stock.")
+    def _audit_in_background(self, action, wh_id, details):
+        """Regista a auditoria sem atrasar a resposta ao clique"""
+        # lido já: até a thread correr o utilizador pode carregar outra variante (ou limpar)
+        entity_pk = f"variant_id={self.loaded_variant_id},warehouse_id={wh_id}"
+        user = self.app.user
+        run_in_background(self, lambda: self.app.db.audit(
+            user, action, "warehouse_stock", entity_pk=entity_pk, details=details,
+        ))
 
-            self.txt_stock_info.config(state="disabled")
-        except Exception:
-            pass
+    def _render_stock_info(self):
+        stocks = self.loaded_stocks
+
+        self.txt_stock_info.config(state="normal")
+        self.txt_stock_info.delete("1.0", tk.END)
+
+        if stocks:
+            self.txt_stock_info.insert(tk.END, "Stock disponível nos armazéns:\n\n")
+            total_stock = 0
+            for s in stocks:
+                self.txt_stock_info.insert(tk.END, f"  • {s['armazem']}: {s['stock']} unidades\n")
+                total_stock += s['stock']
+            self.txt_stock_info.insert(tk.END, f"\n📦 Total geral: {total_stock} unidades")
+        else:
+            self.txt_stock_info.insert(tk.END, "⚠️ Nenhum stock registado em armazéns.\n\n")
+            self.txt_stock_info.insert(tk.END, "Use os botões 'Adicionar' para criar stock.")
+
+        self.txt_stock_info.config(state="disabled")
 
     def bulk_update_stock(self):
         BulkUpdateWindow(self, self.app)
+
+    def open_scan_mode(self):
+        ScanWindow(self, self.app)
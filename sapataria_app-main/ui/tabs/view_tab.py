@@ -3,10 +3,17 @@ from __future__ import annotations
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
 
-from ui.components.helpers import BaseTab, copy_to_clipboard, paste_from_clipboard
+from ui.components.helpers import (
+    BaseTab, copy_to_clipboard, paste_from_clipboard, run_in_background, LIVE_SEARCH_MIN_CHARS,
+)
+
+SEARCH_LABELS = {
+    'gtin': 'GTIN',
+    'ref_keyinvoice': 'Ref KeyInvoice',
+    'ref_woocommerce': 'Ref WooCommerce',
+    'modelo': 'Modelo',
+}
 
 
 class ViewTab(BaseTab):
@@ -29,11 +36,15 @@ class ViewTab(BaseTab):
         ttk.Radiobutton(search_frame, text="Ref KeyInvoice", variable=self.var_search_type,
                        value="ref_keyinvoice").pack(side="left", padx=(0, 10))
         ttk.Radiobutton(search_frame, text="Ref WooCommerce", variable=self.var_search_type,
-                       value="ref_woocommerce").pack(side="left")
+                       value="ref_woocommerce").pack(side="left", padx=(0, 10))
+        ttk.Radiobutton(search_frame, text="Modelo", variable=self.var_search_type,
+                       value="modelo").pack(side="left")
 
         ttk.Label(self, text="Código:").grid(row=2, column=0, sticky="w", pady=(8, 0))
         self.search_value = ttk.Entry(self, width=40)
         self.search_value.grid(row=2, column=1, sticky="w", padx=(0, 8), pady=(8, 0))
+        self.search_value.bind("<Return>", lambda e: self.search())
+        self.bind_live_search(self.search_value, self.live_search)
 
         ttk.Button(self, text="Buscar", command=self.search).grid(row=2, column=2, sticky="w", pady=(8, 0))
         ttk.Button(self, text="Limpar", command=self.clear).grid(row=2, column=3, sticky="w", pady=(8, 0))
@@ -86,6 +97,7 @@ class ViewTab(BaseTab):
         self.grid_rowconfigure(7, weight=1)
 
         self.selected_variant_id = None
+        self._search_seq = 0
 
     def export_to_excel(self):
         if not self.tree.get_children():
@@ -102,6 +114,9 @@ class ViewTab(BaseTab):
             return
 
         try:
+            from openpyxl import Workbook
+            from openpyxl.styles import Font, PatternFill, Alignment
+
             wb = Workbook()
             ws = wb.active
             ws.title = "Produtos"
@@ -143,6 +158,14 @@ class ViewTab(BaseTab):
         for item in self.tree.get_children():
             self.tree.delete(item)
 
+    def live_search(self):
+        """Pesquisa no índice local enquanto o utilizador escreve (sem ir ao servidor)"""
+        value = self.search_value.get().strip()
+        if len(value) < LIVE_SEARCH_MIN_CHARS or not self.app.catalog.loaded:
+            return
+        results = self.find_variants(value, self.var_search_type.get(), allow_server=False, exact=False)
+        self._show_results(results)
+
     def search(self):
         value = self.search_value.get().strip()
         search_type = self.var_search_type.get()
@@ -152,49 +175,13 @@ class ViewTab(BaseTab):
             return
 
         try:
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            self.txt.delete("1.0", tk.END)
-
-            results = self.db.search_variants(value, search_type)
+            results = self.find_variants(value, search_type)
+            self._show_results(results)
 
             if not results:
-                tipo_busca = {
-                    'gtin': 'GTIN',
-                    'ref_keyinvoice': 'Ref KeyInvoice',
-                    'ref_woocommerce': 'Ref WooCommerce'
-                }
-                self.txt.insert(tk.END, f"{tipo_busca[search_type]} não encontrado.\n")
+                self.txt.insert(tk.END, f"{SEARCH_LABELS[search_type]} não encontrado.\n")
                 return
 
-            for r in results:
-                variant_id = r["variant_id"]
-
-                stock_response = self.db.supabase.table('warehouse_stock').select(
-                    'stock, warehouses(name)'
-                ).eq('variant_id', variant_id).execute()
-
-                if stock_response.data:
-                    stocks = [f"{s['warehouses']['name']}: {s['stock']}" for s in stock_response.data]
-                    stock_text = " | ".join(stocks)
-                else:
-                    stock_text = "Sem stock"
-
-                self.tree.insert(
-                    "", "end",
-                    values=(
-                        r.get("gtin") or "",
-                        r.get("nome_modelo") or "",
-                        r.get("marca") or "",
-                        r.get("cor") or "",
-                        r.get("tamanho") or "",
-                        r.get("ref_keyinvoice") or "",
-                        r.get("ref_woocomerce") or "",
-                        stock_text
-                    ),
-                    tags=(r["variant_id"],)
-                )
-
             if len(results) == 1:
                 self.tree.selection_set(self.tree.get_children()[0])
                 self.show_details()
@@ -204,6 +191,47 @@ class ViewTab(BaseTab):
         except Exception as e:
             messagebox.showerror("Erro", f"Falha na busca.\n\n{e}")
 
+    def _show_results(self, results):
+        """Preenche a tabela já; o stock chega depois numa só query em segundo plano"""
+        self._search_seq += 1
+        seq = self._search_seq
+
+        for item in self.tree.get_children():
+            self.tree.delete(item)
+        self.txt.delete("1.0", tk.END)
+
+        for r in results:
+            self.tree.insert(
+                "", "end",
+                iid=str(r["variant_id"]),
+                values=(
+                    r.get("gtin") or "",
+                    r.get("nome_modelo") or "",
+                    r.get("marca") or "",
+                    r.get("cor") or "",
+                    r.get("tamanho") or "",
+                    r.get("ref_keyinvoice") or "",
+                    r.get("ref_woocomerce") or "",
+                    "...",
+                ),
+                tags=(r["variant_id"],)
+            )
+
+        if results:
+            variant_ids = [r["variant_id"] for r in results]
+            run_in_background(self, lambda: self.db.list_stocks_for_variants(variant_ids),
+                              on_success=lambda stocks: self._fill_stock_column(seq, stocks))
+
+    def _fill_stock_column(self, seq, stocks):
+        if seq != self._search_seq:
+            return  # resultado de uma pesquisa já substituída
+        for variant_id, rows in stocks.items():
+            iid = str(variant_id)
+            if not self.tree.exists(iid):
+                continue
+            stock_text = " | ".join(f"{s['armazem']}: {s['stock']}" for s in rows) if rows else "Sem stock"
+            self.tree.set(iid, "stock", stock_text)
+
     def show_details(self):
         sel = self.tree.selection()
         if not sel:
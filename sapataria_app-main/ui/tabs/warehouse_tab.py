@@ -3,8 +3,6 @@ from __future__ import annotations
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
 
 from ui.components.helpers import BaseTab
 
@@ -87,35 +85,32 @@ class WarehouseTab(BaseTab):
             for item in self.tree.get_children():
                 self.tree.delete(item)
 
-            response = self.db.supabase.table('warehouse_stock').select(
-                'stock, product_variant(id, gtin, product_model(nome_modelo, brands(name), categories(name), subcategories(name)), colors(name), sizes(value))'
-            ).eq('warehouse_id', wh_id).order('product_variant(gtin)').execute()
+            rows = self.db.list_warehouse_stock(wh_id)
 
-            if not response.data:
+            if not rows:
                 self.lbl_warehouse_info.config(text=f"Armazém: {wh_name} - Sem produtos")
                 self.lbl_summary.config(text="")
                 return
 
             total_items = 0
-            for row in response.data:
-                variant = row['product_variant']
+            for row in rows:
                 stock = row['stock']
                 total_items += stock
 
                 self.tree.insert(
                     "", "end",
                     values=(
-                        variant.get('gtin') or "",
-                        variant['product_model']['nome_modelo'] if variant.get('product_model') else "",
-                        variant['product_model']['brands']['name'] if variant.get('product_model') and variant['product_model'].get('brands') else "",
-                        variant['colors']['name'] if variant.get('colors') else "",
-                        variant['sizes']['value'] if variant.get('sizes') else "",
+                        row.get('gtin') or "",
+                        row.get('nome_modelo') or "",
+                        row.get('marca') or "",
+                        row.get('cor') or "",
+                        row.get('tamanho') or "",
                         stock
                     ),
-                    tags=(variant['id'],)
+                    tags=(row['variant_id'],)
                 )
 
-            self.lbl_warehouse_info.config(text=f"Armazém: {wh_name} - {len(response.data)} variação(ões)")
+            self.lbl_warehouse_info.config(text=f"Armazém: {wh_name} - {len(rows)} variação(ões)")
             self.lbl_summary.config(text=f"Total de itens em stock: {total_items}")
 
             self.app.db.audit(
@@ -161,6 +156,9 @@ class WarehouseTab(BaseTab):
             return
 
         try:
+            from openpyxl import Workbook
+            from openpyxl.styles import Font, PatternFill, Alignment
+
             wb = Workbook()
             ws = wb.active
             ws.title = wh_name[:31]
@@ -1,9 +1,8 @@
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
 from db import DB
 from services import ProductService, AuthService, DomainService
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
 from datetime import datetime
 
 
@@ -72,6 +71,15 @@ class App(tk.Tk):
         self.db.init_app_tables()
         self.show_login()
 
+        # liga ao Supabase em segundo plano enquanto o utilizador escreve as credenciais
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            self.db.warm_up()
+        except Exception:
+            pass  # o erro volta a aparecer (com mensagem) no login
+
     def show_login(self):
         """Mostra tela de login"""
         for w in self.winfo_children():
@@ -1626,6 +1634,9 @@ class ViewTab(BaseTab):
             return
         
         try:
+            from openpyxl import Workbook
+            from openpyxl.styles import Font, PatternFill, Alignment
+
             wb = Workbook()
             ws = wb.active
             ws.title = "Produtos"
@@ -1961,6 +1972,9 @@ class WarehouseTab(BaseTab):
             return
         
         try:
+            from openpyxl import Workbook
+            from openpyxl.styles import Font, PatternFill, Alignment
+
             wb = Workbook()
             ws = wb.active
             ws.title = wh_name[:31]  # Limitar nome da sheet a 31 caracteres
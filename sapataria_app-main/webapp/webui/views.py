@@ -667,53 +667,72 @@ def bulk_update_view(request):
                     success_count = 0
                     error_count = 0
 
+                    # variantes de cada código (pela ordem dos códigos)
+                    targets = []
                     for code in codes:
                         try:
                             results = db.search_variants(code, search_type)
-                            if not results:
-                                logs.append(f"Not found: {code}")
-                                error_count += 1
-                                continue
-
-                            for result in results:
-                                variant_id = result.get("variant_id")
-                                if operation == "add":
-                                    success, msg = product_service.add_to_stock(variant_id, warehouse_id, quantity)
-                                elif operation == "remove":
-                                    success, msg = product_service.remove_from_stock(variant_id, warehouse_id, quantity)
-                                else:
-                                    current = db.supabase.table("warehouse_stock").select("stock").eq(
-                                        "variant_id", variant_id
-                                    ).eq("warehouse_id", warehouse_id).execute()
-                                    if current.data:
-                                        current_stock = current.data[0]["stock"]
-                                        diff = quantity - current_stock
-                                        if diff > 0:
-                                            success, msg = product_service.add_to_stock(variant_id, warehouse_id, diff)
-                                        elif diff < 0:
-                                            success, msg = product_service.remove_from_stock(variant_id, warehouse_id, abs(diff))
-                                        else:
-                                            success, msg = True, f"Stock already at {quantity}"
-                                    else:
-                                        success, msg = product_service.add_to_stock(variant_id, warehouse_id, quantity)
-
-                                if success:
-                                    logs.append(f"OK: {code} -> {msg}")
-                                    success_count += 1
-                                else:
-                                    logs.append(f"ERROR: {code} -> {msg}")
-                                    error_count += 1
-
-                                db.audit(
-                                    user,
-                                    f"BULK_{operation.upper()}_STOCK",
-                                    "warehouse_stock",
-                                    entity_pk=f"variant_id={variant_id},warehouse_id={warehouse_id}",
-                                    details={"code": code, "quantity": quantity, "operation": operation},
-                                )
                         except Exception as exc:
                             logs.append(f"ERROR: {code} -> {exc}")
                             error_count += 1
+                            continue
+                        if not results:
+                            logs.append(f"Not found: {code}")
+                            error_count += 1
+                            continue
+                        targets.extend((code, result.get("variant_id")) for result in results)
+
+                    # movimentos: "set" vira a diferença para o stock atual (lido numa só query)
+                    movements = []
+                    current, done = {}, set()
+                    if operation not in ("add", "remove") and targets:
+                        try:
+                            current = db.get_stock_rows([vid for _, vid in targets], [safe_int(warehouse_id)])
+                        except Exception as exc:
+                            logs.extend(f"ERROR: {code} -> {exc}" for code, _ in targets)
+                            error_count += len(targets)
+                            targets = []
+                    for code, variant_id in targets:
+                        if operation == "add":
+                            delta = quantity
+                        elif operation == "remove":
+                            delta = -quantity
+                        else:
+                            diff = quantity - current.get((variant_id, safe_int(warehouse_id)), 0)
+                            if diff == 0 or variant_id in done:
+                                logs.append(f"OK: {code} -> Stock already at {quantity}")
+                                success_count += 1
+                                continue
+                            done.add(variant_id)
+                            delta = diff
+                        movements.append((code, variant_id, delta))
+
+                    # um pedido para o stock e um para a auditoria
+                    try:
+                        results = product_service.adjust_stock_batch(
+                            [(variant_id, warehouse_id, delta) for _, variant_id, delta in movements])
+                    except Exception as exc:
+                        results = [(False, str(exc), None)] * len(movements)
+                    for (code, _, _), (success, msg, _) in zip(movements, results):
+                        if success:
+                            logs.append(f"OK: {code} -> {msg}")
+                            success_count += 1
+                        else:
+                            logs.append(f"ERROR: {code} -> {msg}")
+                            error_count += 1
+
+                    try:
+                        db.audit_batch(user, [
+                            {
+                                "action": f"BULK_{operation.upper()}_STOCK",
+                                "entity": "warehouse_stock",
+                                "entity_pk": f"variant_id={variant_id},warehouse_id={warehouse_id}",
+                                "details": {"code": code, "quantity": quantity, "operation": operation},
+                            }
+                            for code, variant_id in targets
+                        ])
+                    except Exception as exc:
+                        logs.append(f"ERROR: audit -> {exc}")
 
                     messages.append(("success", f"Processed. Success: {success_count}. Errors: {error_count}."))
 
@@ -739,54 +758,47 @@ def bulk_update_view(request):
 
 
 def build_bulk_preview(db, codes, search_type):
-    rows = []
+    results = []
     for code in codes:
-        results = db.search_variants(code, search_type)
-        if not results:
-            continue
-        for result in results:
-            variant_id = result.get("variant_id")
-            full = db.get_full_view_by_variant_id(variant_id)
-            brand = None
-            category = None
-            subcategory = None
-            if full:
-                header, _ = full
-                brand = header.get("marca")
-                category = header.get("categoria")
-                subcategory = header.get("subcategoria")
-
-            stock_response = db.supabase.table("warehouse_stock").select(
-                "stock, warehouses(name)"
-            ).eq("variant_id", variant_id).execute()
-
-            stock_rows = []
-            if stock_response.data:
-                stocks = [f"{s['warehouses']['name']}: {s['stock']}" for s in stock_response.data]
-                stock_text = " | ".join(stocks)
-                stock_rows = [
-                    {"warehouse": s["warehouses"]["name"], "stock": s["stock"]}
-                    for s in stock_response.data
-                ]
-            else:
-                stock_text = "Sem stock"
-
-            rows.append(
-                {
-                    "variant_id": variant_id,
-                    "gtin": result.get("gtin"),
-                    "category": category,
-                    "subcategory": subcategory,
-                    "nome_modelo": result.get("nome_modelo"),
-                    "marca": brand,
-                    "cor": result.get("cor"),
-                    "tamanho": result.get("tamanho"),
-                    "ref_keyinvoice": result.get("ref_keyinvoice"),
-                    "ref_woocomerce": result.get("ref_woocomerce"),
-                    "stock": stock_text,
-                    "stock_rows": stock_rows,
-                }
-            )
+        results.extend(db.search_variants(code, search_type) or [])
+
+    rows = []
+    for result in results:
+        variant_id = result.get("variant_id")
+        full = db.get_full_view_by_variant_id(variant_id)
+        brand = None
+        category = None
+        subcategory = None
+        stocks = []
+        if full:
+            # a vista completa já traz o stock por armazém
+            header, stocks = full
+            brand = header.get("marca")
+            category = header.get("categoria")
+            subcategory = header.get("subcategoria")
+
+        stock_rows = [{"warehouse": s["armazem"], "stock": s["stock"]} for s in stocks]
+        if stock_rows:
+            stock_text = " | ".join(f"{s['warehouse']}: {s['stock']}" for s in stock_rows)
+        else:
+            stock_text = "Sem stock"
+
+        rows.append(
+            {
+                "variant_id": variant_id,
+                "gtin": result.get("gtin"),
+                "category": category,
+                "subcategory": subcategory,
+                "nome_modelo": result.get("nome_modelo"),
+                "marca": brand,
+                "cor": result.get("cor"),
+                "tamanho": result.get("tamanho"),
+                "ref_keyinvoice": result.get("ref_keyinvoice"),
+                "ref_woocomerce": result.get("ref_woocomerce"),
+                "stock": stock_text,
+                "stock_rows": stock_rows,
+            }
+        )
     return rows
 
 